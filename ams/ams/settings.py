@@ -166,10 +166,13 @@ CORS_ALLOWED_ORIGINS = config(
     cast=Csv()
 )
 
+CORS_EXPOSE_HEADERS = ["Idempotent-Replayed"]
+
 CORS_ALLOW_HEADERS = [
     "Authorization",
     "Content-Type",
     "X-CSRFToken",
+    "Idempotency-Key",
 ]
 
 CSRF_TRUSTED_ORIGINS = config(
@@ -186,3 +189,48 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# 打卡緩衝佇列（上班尖峰時段先寫入本機日誌，再由背景批次寫入資料庫）
+PUNCH_QUEUE_ENABLED = config('PUNCH_QUEUE_ENABLED', default=False, cast=bool)
+PUNCH_QUEUE_DIR = config('PUNCH_QUEUE_DIR', default=str(BASE_DIR / 'var' / 'punch_queue'))
+PUNCH_QUEUE_FLUSH_INTERVAL = config('PUNCH_QUEUE_FLUSH_INTERVAL', default=2.0, cast=float)
+# 設為 False 時改由 `python manage.py drain_punch_queue --watch` 獨立程序寫入
+PUNCH_QUEUE_IN_PROCESS_FLUSHER = config('PUNCH_QUEUE_IN_PROCESS_FLUSHER', default=True, cast=bool)
+
+# 資訊站輪替 QR Code（HMAC 簽章權杖）
+QR_TOKEN_WINDOW_SECONDS = config('QR_TOKEN_WINDOW_SECONDS', default=30, cast=int)
+# 設為 True 時 clock_in / clock_out 不再接受印出的靜態 QR Code 座標
+QR_REQUIRE_SIGNED_TOKEN = config('QR_REQUIRE_SIGNED_TOKEN', default=False, cast=bool)
+
+# 快取（報表結果快取）
+# 多個 worker 程序時須使用共用快取，否則報表失效只會作用在單一程序，例如：
+#   CACHE_BACKEND=django.core.cache.backends.db.DatabaseCache、CACHE_LOCATION=ams_cache
+#   （需先執行 `python manage.py createcachetable`）
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default='ams'),
+    }
+}
+# 進行中期間（當月、當天）的報表保存秒數
+REPORT_CACHE_TTL = config('REPORT_CACHE_TTL', default=300, cast=int)
+# 已結束期間的報表保存秒數，只在共用快取（DatabaseCache、Redis、Memcached 等）下生效：
+# LocMemCache 的標籤失效只作用在單一程序，其他程序會持續回應過時的報表，
+# 因此使用 LocMemCache 時已結束期間同樣只保存 REPORT_CACHE_TTL 秒
+REPORT_CACHE_CLOSED_TTL = config(
+    'REPORT_CACHE_CLOSED_TTL',
+    default=REPORT_CACHE_TTL if CACHE_BACKEND.endswith('LocMemCache') else 30 * 24 * 60 * 60,
+    cast=int
+)
+
+# 背景匯出工作
+EXPORT_JOB_DIR = config('EXPORT_JOB_DIR', default=str(BASE_DIR / 'var' / 'exports'))
+# 完成檔案的保存秒數
+EXPORT_JOB_TTL = config('EXPORT_JOB_TTL', default=24 * 60 * 60, cast=int)
+EXPORT_JOB_WORKERS = config('EXPORT_JOB_WORKERS', default=2, cast=int)
+# 設為 False 時改由 `python manage.py run_export_jobs --watch` 獨立程序處理
+EXPORT_JOBS_IN_PROCESS = config('EXPORT_JOBS_IN_PROCESS', default=True, cast=bool)
+
+# 同一角色有多位審批人時的分派方式：round_robin（輪流）/ least_pending（待審件數最少）
+APPROVER_ASSIGNMENT = config('APPROVER_ASSIGNMENT', default='round_robin')
@@ -1,10 +1,10 @@
 from django.contrib import admin
-from django.http import HttpResponse
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.http import FileResponse, HttpResponse
 from django import forms
 from django.shortcuts import render
 from django.urls import path, reverse
 from django.utils.html import format_html
-import openpyxl
 import qrcode
 from io import BytesIO
 import json
@@ -17,8 +17,24 @@ from .models import (
     # Phase 2 新增
     OvertimeRecords, OvertimeApproval, Notifications,
     # Phase 3 新增
-    Departments
+    Departments,
+    ExportJob,
+    generate_qr_secret
 )
+from .rollups import add_leave_hours
+from .export_jobs import ADMIN_LEAVE_SEARCH_FIELDS, download_name, export_jobs
+
+
+def _submit_export_job(model_admin, request, kind, params):
+    """建立後台背景匯出工作，完成後於「匯出工作」頁面下載"""
+    job, created = export_jobs.submit(request.user, kind, 'xlsx', params)
+    url = reverse('admin:attendance_exportjob_changelist')
+    if created:
+        message = format_html('已建立匯出工作 #{}，完成後請至<a href="{}">匯出工作</a>下載', job.id, url)
+    else:
+        message = format_html('相同的匯出工作 #{} 處理中，完成後請至<a href="{}">匯出工作</a>下載', job.id, url)
+    model_admin.message_user(request, message)
+
 
 class DateRangeForm(forms.Form):
     start_date = forms.DateField(label="起始日期", widget=forms.DateInput(attrs={'type': 'date'}))
@@ -48,6 +64,15 @@ class EmployeesAdmin(admin.ModelAdmin):
 @admin.register(Companies)
 class CompaniesAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'address', 'latitude', 'longitude', 'radius', 'qr_code_download')
+    actions = ['regenerate_qr_secret']
+
+    def regenerate_qr_secret(self, request, queryset):
+        """重新產生 QR Code 簽章金鑰（舊的資訊站權杖立即失效）"""
+        for company in queryset:
+            company.qr_secret = generate_qr_secret()
+            company.save(update_fields=['qr_secret'])
+        self.message_user(request, f"已重新產生 {queryset.count()} 間公司的 QR Code 金鑰")
+    regenerate_qr_secret.short_description = '重新產生 QR Code 金鑰'
 
     def get_urls(self):
         """新增自訂 URL 路由"""
@@ -166,8 +191,8 @@ class LeaveRecordsAdmin(admin.ModelAdmin):
 
 
     actions = ['export_by_date_range']
-    search_fields = ['relation_id__employee_id__employee_id',
-                    'relation_id__employee_id__username']
+    # 匯出工作依相同欄位重新搜尋
+    search_fields = ADMIN_LEAVE_SEARCH_FIELDS
 
 
     @admin.action(description='匯出指定日期範圍的資料')
@@ -178,42 +203,28 @@ class LeaveRecordsAdmin(admin.ModelAdmin):
                 start_date = form.cleaned_data['start_date']
                 end_date = form.cleaned_data['end_date']
 
-                filtered = queryset.filter(start_time__date__range=(start_date, end_date)).order_by(
-                    'relation_id__employee_id__employee_id',
-                    'start_time'
-                )
-
-                wb = openpyxl.Workbook()
-                ws = wb.active
-                ws.title = "請假紀錄"
-
-                headers = ['員工編號', '員工姓名', '關聯編號', '日期', '請假開始時間', '請假結束時間', '請假總時數', '請假原因']
-                ws.append(headers)
-
-                for record in filtered:
-                    emp = record.relation_id.employee_id
-                    ws.append([
-                        emp.employee_id,
-                        emp.username,
-                        record.relation_id.id,
-                        record.start_time.strftime('%H:%M:%S') if record.start_time else '',
-                        record.end_time.strftime('%H:%M:%S') if record.end_time else '',
-                        record.leave_hours or '',
-                        record.leave_reason or '',
-                    ])
-
-                response = HttpResponse(
-                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                )
-                response['Content-Disposition'] = 'attachment; filename=attendance_filtered.xlsx'
-                wb.save(response)
-                return response
+                params = {
+                    'date_from': start_date.isoformat(),
+                    'date_to': end_date.isoformat(),
+                }
+                if request.POST.get('select_across') == '1':
+                    # 選取全部：保存變更清單的搜尋條件，由匯出工作重新查詢，不逐筆保存 ID
+                    params['search'] = request.GET.get(SEARCH_VAR, '')
+                else:
+                    # 勾選的記錄最多一頁
+                    params['leave_ids'] = list(queryset.filter(
+                        start_time__date__range=(start_date, end_date)
+                    ).order_by('id').values_list('id', flat=True))
+
+                _submit_export_job(self, request, 'admin_leave', params)
+                return None
         else:
             form = DateRangeForm()
 
         return render(request, 'admin/date_range_form.html', {
             'form': form,
             'queryset': queryset,
+            'select_across': request.POST.get('select_across', '0'),
             'action': 'export_by_date_range'
         })
 
@@ -240,6 +251,7 @@ class ApprovalRecordsAdmin(admin.ModelAdmin):
             if pending_count == 0 and leave.status == 'pending':
                 leave.status = 'approved'
                 leave.save()
+                add_leave_hours(leave)
 
                 # 扣除假別額度
                 from attendance.models import LeaveBalances
@@ -314,71 +326,18 @@ class AttendanceRecordsAdmin(admin.ModelAdmin):
                 start_date = form.cleaned_data['start_date']
                 end_date = form.cleaned_data['end_date']
 
-                # === 匯出 Excel 初始化 ===
-                wb = openpyxl.Workbook()
-
-                # === 出缺勤紀錄 Sheet ===
-                ws1 = wb.active
-                ws1.title = "出缺勤紀錄"
-
-                headers1 = ['員工編號', '員工姓名', '關聯編號', '日期', '簽到時間', '簽退時間', '簽到地點', '簽退地點', '工作時數']
-                ws1.append(headers1)
-
-                attendance_records = AttendanceRecords.objects.filter(
-                    date__range=(start_date, end_date)
-                ).order_by('relation_id__employee_id__employee_id', 'date')
-
-                for record in attendance_records:
-                    emp = record.relation_id.employee_id
-                    ws1.append([
-                        emp.employee_id,
-                        emp.username,
-                        record.relation_id.id,
-                        record.date.strftime('%Y-%m-%d') if record.date else '',
-                        record.checkin_time.strftime('%H:%M:%S') if record.checkin_time else '',
-                        record.checkout_time.strftime('%H:%M:%S') if record.checkout_time else '',
-                        record.checkin_location or '',
-                        record.checkout_location or '',
-                        record.work_hours or '',
-                    ])
-
-                # === 請假紀錄 Sheet ===
-                ws2 = wb.create_sheet(title="請假紀錄")
-
-                headers2 = ['員工編號', '員工姓名', '關聯編號', '請假日期', '開始時間', '結束時間', '請假時數', '請假原因']
-                ws2.append(headers2)
-
-                leave_records = LeaveRecords.objects.filter(
-                    start_time__date__range=(start_date, end_date)
-                ).order_by('relation_id__employee_id__employee_id', 'start_time')
-
-                for record in leave_records:
-                    emp = record.relation_id.employee_id
-                    leave_date = record.start_time.date() if record.start_time else ''
-                    ws2.append([
-                        emp.employee_id,
-                        emp.username,
-                        record.relation_id.id,
-                        leave_date.strftime('%Y-%m-%d') if leave_date else '',
-                        record.start_time.strftime('%H:%M:%S') if record.start_time else '',
-                        record.end_time.strftime('%H:%M:%S') if record.end_time else '',
-                        record.leave_hours or '',
-                        record.leave_reason or '',
-                    ])
-
-                # === 回傳 Excel 檔案 ===
-                response = HttpResponse(
-                    content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                )
-                response['Content-Disposition'] = 'attachment; filename=attendance_leave_summary.xlsx'
-                wb.save(response)
-                return response
+                _submit_export_job(self, request, 'admin_attendance_and_leave', {
+                    'date_from': start_date.isoformat(),
+                    'date_to': end_date.isoformat(),
+                })
+                return None
         else:
             form = DateRangeForm()
 
         return render(request, 'admin/date_range_form.html', {
             'form': form,
             'queryset': queryset,
+            'select_across': request.POST.get('select_across', '0'),
             'action': 'export_attendance_and_leave'
         })
 
@@ -656,3 +615,56 @@ class DepartmentsAdmin(admin.ModelAdmin):
     def employee_count(self, obj):
         return obj.get_employee_count()
     employee_count.short_description = '員工數'
+
+
+# ========== 背景匯出 Admin ==========
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    """匯出工作（由後台匯出動作與匯出 API 建立）"""
+    list_display = ('id', 'requested_by', 'kind', 'export_format', 'status', 'progress_display',
+                    'created_at', 'expires_at', 'download_link')
+    list_filter = ('status', 'kind', 'export_format')
+    search_fields = ['requested_by__username', 'requested_by__employee_id']
+    readonly_fields = [field.name for field in ExportJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).select_related('requested_by')
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(requested_by=request.user)
+
+    def progress_display(self, obj):
+        return '-' if obj.progress is None else f"{obj.progress}%"
+    progress_display.short_description = '進度'
+
+    def download_link(self, obj):
+        if obj.status != 'completed':
+            return '-'
+        return format_html('<a href="{}">下載</a>', reverse('admin:exportjob-download', args=[obj.id]))
+    download_link.short_description = '檔案'
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                '<int:job_id>/download/',
+                self.admin_site.admin_view(self.download),
+                name='exportjob-download',
+            ),
+        ]
+        return custom_urls + urls
+
+    def download(self, request, job_id):
+        """下載匯出檔案"""
+        job = self.get_queryset(request).filter(id=job_id, status='completed').first()
+        if job is None:
+            return HttpResponse('匯出工作不存在或尚未完成', status=404)
+        try:
+            file = export_jobs.open(job)
+        except FileNotFoundError:
+            return HttpResponse('匯出檔案已過期', status=410)
+        return FileResponse(file, as_attachment=True, filename=download_name(job))
@@ -0,0 +1,175 @@
+"""
+審批政策比對（程序層級快取）
+
+請假時依「公司 + 請假天數」找出適用的審批政策（ApprovalPolicy）。
+啟用中的政策依公司編譯成按 min_days 排序、互不重疊的區間表，
+查詢時以二分搜尋定位，不需查詢資料庫。
+
+優先順序沿用原本 order_by('company_id', 'min_days') 的結果（MySQL 將 NULL
+排在最前）：全域政策（company_id 為空）優先，全域政策未涵蓋的天數才使用
+公司政策；同一範圍內區間重疊時 min_days 較小的政策優先。
+依 min_days 排序後，每個政策只在「前面政策涵蓋範圍之外」的部分生效，
+而前面政策的起點都不大於目前政策的起點，因此生效範圍必為單一區間。
+
+- ApprovalPolicy 新增 / 修改 / 刪除時由 signals 標記失效，下一次查詢重建
+- 另設定存活時間（APPROVAL_POLICY_CACHE_TTL），讓多個 worker 程序最終一致
+"""
+import json
+import threading
+import time as _time
+from bisect import bisect_right
+from collections import namedtuple
+
+from django.conf import settings
+
+
+# 快取存活時間（秒），逾時自動重建
+CACHE_TTL_SECONDS = getattr(settings, 'APPROVAL_POLICY_CACHE_TTL', 300)
+
+# 沒有任何適用政策時的審批層級：只需主管審批
+DEFAULT_LEVELS = [{"level": 1, "role": "manager", "description": "直屬主管"}]
+DEFAULT_POLICY_NAME = '預設政策'
+
+# 全域政策的鍵
+GLOBAL = None
+
+# lower / upper 皆為天數；upper 為 None 表示無上限（含上限值）
+# lower_open=True 表示不含下限值（被前面的政策涵蓋）
+Segment = namedtuple('Segment', ['lower', 'lower_open', 'upper', 'policy_id', 'policy_name', 'levels'])
+
+
+def _levels(value):
+    """approval_levels 可能以 JSON 字串保存"""
+    return value if isinstance(value, list) else json.loads(value)
+
+
+def compile_segments(policies):
+    """
+    將同一公司的政策編譯成互不重疊的區間
+
+    Args:
+        policies: [(id, policy_name, min_days, max_days, approval_levels)]
+
+    Returns:
+        list: 依下限排序的 Segment
+    """
+    segments = []
+    reach = None    # 前面政策涵蓋到的最大天數（float('inf') 表示無上限）
+    for policy_id, policy_name, min_days, max_days, levels in sorted(policies, key=lambda p: (p[2], p[0])):
+        upper = float('inf') if max_days is None else max_days
+        if upper < min_days:
+            continue
+        if reach is None or reach < min_days:
+            lower, lower_open = min_days, False
+        elif reach < upper:
+            lower, lower_open = reach, True
+        else:
+            # 完全被前面的政策涵蓋
+            continue
+        segments.append(Segment(lower, lower_open, max_days, policy_id, policy_name, _levels(levels)))
+        reach = upper if reach is None else max(reach, upper)
+    return segments
+
+
+def _lookup(segments, keys, days):
+    # (天數, 0) 排在含下限 (天數, 0) 之後、不含下限 (天數, 1) 之前
+    index = bisect_right(keys, (days, 0)) - 1
+    if index < 0:
+        return None
+    segment = segments[index]
+    if segment.upper is not None and days > segment.upper:
+        return None
+    return segment
+
+
+class ApprovalPolicyMatcher:
+    """依公司編譯的審批政策區間表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._loaded_at = None
+        # 每次失效遞增，避免重建期間收到的失效通知被覆蓋
+        self._generation = 0
+
+    # ---------- 載入與失效 ----------
+
+    def invalidate(self):
+        """標記快取失效（下一次查詢時重建）"""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+
+    def load(self, policies=None):
+        """
+        編譯政策區間表
+
+        Args:
+            policies: [(id, company_id, policy_name, min_days, max_days, approval_levels)]；
+                      未提供時從資料庫讀取啟用中的政策
+        """
+        generation = self._generation
+        if policies is None:
+            from .models import ApprovalPolicy
+            policies = ApprovalPolicy.objects.filter(is_active=True).values_list(
+                'id', 'company_id', 'policy_name', 'min_days', 'max_days', 'approval_levels'
+            )
+
+        by_company = {}
+        for policy_id, company_id, *policy in policies:
+            by_company.setdefault(company_id, []).append((policy_id, *policy))
+
+        tables = {}
+        for company_id, rows in by_company.items():
+            segments = compile_segments(rows)
+            keys = [(segment.lower, int(segment.lower_open)) for segment in segments]
+            tables[company_id] = (segments, keys)
+
+        with self._lock:
+            self._tables = tables
+            if generation == self._generation:
+                self._loaded_at = _time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or _time.monotonic() - loaded_at > CACHE_TTL_SECONDS:
+            self.load()
+
+    # ---------- 查詢 ----------
+
+    def match(self, company_id, days):
+        """
+        找出適用的政策區間
+
+        Args:
+            company_id: 公司 ID
+            days: 請假天數
+
+        Returns:
+            Segment 或 None（沒有適用的政策）
+        """
+        self._ensure_loaded()
+        tables = self._tables
+        for key in (GLOBAL, company_id):
+            if key in tables:
+                segment = _lookup(*tables[key], days)
+                if segment:
+                    return segment
+        return None
+
+    def resolve(self, company_id, days):
+        """
+        取得審批層級設定（回傳共用的快取資料，呼叫端不可修改）
+
+        Returns:
+            tuple: (政策名稱, [{"level": 1, "role": "manager", ...}])；
+                   沒有適用的政策時為 (DEFAULT_POLICY_NAME, DEFAULT_LEVELS)
+        """
+        segment = self.match(company_id, days)
+        if segment is None:
+            return DEFAULT_POLICY_NAME, DEFAULT_LEVELS
+        return segment.policy_name, segment.levels
+
+
+# 程序層級單例
+approval_policies = ApprovalPolicyMatcher()
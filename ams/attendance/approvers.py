@@ -0,0 +1,211 @@
+"""
+審批人目錄（程序層級快取）
+
+請假、加班申請需要依「公司 + 審批角色」找出審批人。此模組將下列資料
+一次載入記憶體，查詢時不需存取資料庫：
+
+- Employees.role：各公司（依在職的 EmpCompanyRel）可擔任 manager / hr / ceo 的員工
+- ManagerialRelationship：生效中的主管關係
+- Departments.manager：部門主管
+
+申請人的主管依序取 EmpCompanyRel.direct_manager（直接取自任職關聯）、
+生效中的主管關係、部門主管，皆無時才從公司內的 manager 分派。
+
+同一角色有多位審批人時，依 APPROVER_ASSIGNMENT 分派：
+
+- round_robin（預設）：依序輪流，程序內計數（多個 worker 各自輪流，整體仍大致平均）
+- least_pending：待審件數最少者優先（讀取待審計數表），件數相同時依輪流順序
+
+公司內找不到該角色時，改用其他公司的同角色員工；沒有任何員工設定該角色時，
+沿用舊版以員工編號前綴（MGR / HR / CEO）辨識審批人的規則，相容尚未設定角色的資料。
+
+- 員工、部門、任職關聯、主管關係異動時由 signals 標記失效，下一次查詢重建
+- 另設定存活時間（APPROVER_DIRECTORY_TTL），讓多個 worker 程序最終一致
+"""
+import threading
+import time as _time
+from collections import namedtuple
+from datetime import date
+
+from django.conf import settings
+
+from .pending_counters import pending_counts
+
+
+# 目錄存活時間（秒），逾時自動重建
+CACHE_TTL_SECONDS = getattr(settings, 'APPROVER_DIRECTORY_TTL', 300)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_PENDING = 'least_pending'
+
+# 審批政策的角色 → Employees.role
+POLICY_ROLES = {
+    'manager': 'manager',
+    'hr': 'hr_admin',
+    'ceo': 'ceo',
+}
+
+# 舊版以員工編號前綴辨識審批人
+LEGACY_PREFIXES = {
+    'manager': 'MGR',
+    'hr': 'HR',
+    'ceo': 'CEO',
+}
+
+# 不分公司的角色名單
+ANY_COMPANY = None
+
+# 與 Employees 相容的 employee_id / username 屬性
+Approver = namedtuple('Approver', ['employee_id', 'username'])
+
+
+class ApproverDirectory:
+    """以 (公司, 角色) 為索引的審批人目錄"""
+
+    def __init__(self, strategy=None):
+        self.strategy = strategy or getattr(settings, 'APPROVER_ASSIGNMENT', ROUND_ROBIN)
+        self._lock = threading.Lock()
+        self._employees = {}
+        self._by_role = {}
+        self._reporting = {}
+        self._department_managers = {}
+        self._employee_departments = {}
+        self._turns = {}
+        self._loaded_at = None
+        # 每次失效遞增，避免重建期間收到的失效通知被覆蓋
+        self._generation = 0
+
+    # ---------- 載入與失效 ----------
+
+    def invalidate(self):
+        """標記目錄失效（下一次查詢時重建）"""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+
+    def load(self):
+        """從資料庫建立目錄"""
+        from .models import Departments, EmpCompanyRel, Employees, ManagerialRelationship
+
+        generation = self._generation
+        employees = {}
+        employee_roles = {}
+        employee_departments = {}
+        for employee_id, username, role, department_id in Employees.objects.filter(is_active=True).values_list(
+            'employee_id', 'username', 'role', 'department_id'
+        ):
+            employees[employee_id] = Approver(employee_id, username)
+            employee_roles[employee_id] = role
+            employee_departments[employee_id] = department_id
+
+        members_of = {}
+        for policy_role, role in POLICY_ROLES.items():
+            members = {e for e, r in employee_roles.items() if r == role}
+            if not members:
+                members = {e for e in employees if e.startswith(LEGACY_PREFIXES[policy_role])}
+            members_of[policy_role] = members
+
+        # 依在職的任職關聯建立公司內的角色名單
+        by_role = {(ANY_COMPANY, policy_role): sorted(members) for policy_role, members in members_of.items()}
+        for employee_id, company_id in EmpCompanyRel.objects.filter(
+            employment_status=True
+        ).values_list('employee_id', 'company_id'):
+            for policy_role, members in members_of.items():
+                if employee_id in members:
+                    by_role.setdefault((company_id, policy_role), set()).add(employee_id)
+        by_role = {key: sorted(members) for key, members in by_role.items()}
+
+        today = date.today()
+        reporting = dict(ManagerialRelationship.objects.filter(
+            effective_date__lte=today, end_date__isnull=True
+        ).order_by('effective_date', 'id').values_list('employee_id', 'manager_id'))
+
+        department_managers = dict(Departments.objects.filter(
+            is_active=True, manager__isnull=False
+        ).order_by().values_list('id', 'manager_id'))
+
+        with self._lock:
+            self._employees = employees
+            self._by_role = by_role
+            self._reporting = reporting
+            self._department_managers = department_managers
+            self._employee_departments = employee_departments
+            if generation == self._generation:
+                self._loaded_at = _time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or _time.monotonic() - loaded_at > CACHE_TTL_SECONDS:
+            self.load()
+
+    # ---------- 查詢 ----------
+
+    def candidates(self, company_id, role, exclude=None):
+        """
+        可擔任該角色的審批人（員工編號，依編號排序）
+
+        公司內沒有人時改用不分公司的名單。
+        """
+        self._ensure_loaded()
+        for key in ((company_id, role), (ANY_COMPANY, role)):
+            members = [e for e in self._by_role.get(key, ()) if e != exclude]
+            if members:
+                return key, members
+        return None, []
+
+    def _rotate(self, key, members):
+        """依輪流順序排列"""
+        with self._lock:
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+        start = turn % len(members)
+        return members[start:] + members[:start]
+
+    def assign(self, company_id, role, exclude=None, strategy=None):
+        """
+        從公司內可擔任該角色的審批人中分派一位
+
+        Args:
+            company_id: 公司 ID
+            role: 審批政策的角色（manager / hr / ceo）
+            exclude: 排除的員工編號（通常為申請人）
+            strategy: round_robin / least_pending；未提供時使用 APPROVER_ASSIGNMENT
+
+        Returns:
+            Approver 或 None（沒有可分派的審批人）
+        """
+        key, members = self.candidates(company_id, role, exclude=exclude)
+        if not members:
+            return None
+        ordered = self._rotate(key, members)
+        if (strategy or self.strategy) == LEAST_PENDING and len(ordered) > 1:
+            counts = {employee_id: sum(by_type.values()) for employee_id, by_type in pending_counts(ordered).items()}
+            # min() 取第一個最小值，件數相同時維持輪流順序
+            ordered = [min(ordered, key=lambda employee_id: counts.get(employee_id, 0))]
+        return self._employees[ordered[0]]
+
+    def manager_for(self, relation, exclude=None, strategy=None):
+        """
+        申請人的主管：直屬主管 → 生效中的主管關係 → 部門主管 → 公司內分派
+
+        Args:
+            relation: EmpCompanyRel 實例
+
+        Returns:
+            Approver 或 None
+        """
+        self._ensure_loaded()
+        employee_id = relation.employee_id_id
+        department_id = self._employee_departments.get(employee_id)
+        for manager_id in (
+            relation.direct_manager_id,
+            self._reporting.get(employee_id),
+            self._department_managers.get(department_id),
+        ):
+            if manager_id and manager_id != exclude and manager_id in self._employees:
+                return self._employees[manager_id]
+        return self.assign(relation.company_id_id, 'manager', exclude=exclude, strategy=strategy)
+
+
+# 程序層級單例
+approver_directory = ApproverDirectory()
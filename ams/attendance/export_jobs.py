@@ -0,0 +1,401 @@
+"""
+背景匯出工作
+
+大量匯出在請求內產生檔案會超過反向代理的逾時限制。匯出 API 與後台匯出
+改為建立 ExportJob，由背景 worker 逐列寫入檔案並回報進度：
+
+- 程序內 worker：EXPORT_JOBS_IN_PROCESS 為 True 時，建立工作的交易提交後
+  交給本程序的執行緒池（EXPORT_JOB_WORKERS 個執行緒）處理
+- 獨立 worker：`python manage.py run_export_jobs --watch` 處理等待中的工作
+
+相同申請人、內容、格式與參數的工作在等待中或處理中時以
+ExportJob.fingerprint（unique）去重，後到的請求取得同一個工作。
+
+完成的檔案存放於 EXPORT_JOB_DIR，保存 EXPORT_JOB_TTL 秒；過期檔案由
+run_export_jobs 清除。處理中超過 EXPORT_JOB_STALE_SECONDS 秒的工作視為
+worker 已中斷，重新排入等待。
+"""
+import hashlib
+import json
+import operator
+import os
+import threading
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import reduce
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import smart_split, unescape_string_literal
+
+from .exports import (
+    ADMIN_ATTENDANCE_COLUMNS, ADMIN_LEAVE_COLUMNS, ATTENDANCE_COLUMNS, ATTENDANCE_PARQUET_FIELDS,
+    EXPORT_CHUNK_SIZE, LEAVE_COLUMNS, LEAVE_PARQUET_FIELDS, OVERTIME_COLUMNS, OVERTIME_PARQUET_FIELDS,
+    iter_csv, iter_rows, write_parquet, write_xlsx
+)
+from .models import AttendanceRecords, ExportJob, LeaveRecords, OvertimeRecords
+
+
+# 處理中超過此秒數視為 worker 已中斷
+STALE_SECONDS = getattr(settings, 'EXPORT_JOB_STALE_SECONDS', 60 * 60)
+
+# XLSX 欄寬
+XLSX_COLUMN_WIDTH = 15
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+# ---------- 匯出內容 ----------
+
+def attendance_export_queryset(params):
+    """出勤記錄（params: relation_ids, date_from, date_to）"""
+    return AttendanceRecords.objects.filter(
+        relation_id__in=params['relation_ids'],
+        date__gte=_parse_date(params['date_from']).date(),
+        date__lte=_parse_date(params['date_to']).date()
+    ).select_related('relation_id__employee_id').order_by('date', 'relation_id')
+
+
+def leave_export_queryset(params):
+    """請假記錄（params: relation_ids, date_from, date_to）"""
+    return LeaveRecords.objects.filter(
+        relation_id__in=params['relation_ids'],
+        start_time__gte=_parse_date(params['date_from']),
+        start_time__lte=_parse_date(params['date_to'])
+    ).select_related('relation_id__employee_id').order_by('start_time')
+
+
+def overtime_export_queryset(params):
+    """加班記錄（params: relation_ids, date_from, date_to）"""
+    return OvertimeRecords.objects.filter(
+        relation_id__in=params['relation_ids'],
+        date__gte=_parse_date(params['date_from']).date(),
+        date__lte=_parse_date(params['date_to']).date()
+    ).select_related('relation_id__employee_id').order_by('date', 'relation_id', 'start_time')
+
+
+# 後台請假記錄的搜尋欄位（LeaveRecordsAdmin.search_fields）
+ADMIN_LEAVE_SEARCH_FIELDS = ['relation_id__employee_id__employee_id', 'relation_id__employee_id__username']
+
+
+def _admin_search(queryset, search, fields):
+    """與後台變更清單相同的搜尋：每個詞須符合任一欄位（不分大小寫的部分比對）"""
+    for term in smart_split(search):
+        if term[0] in {'"', "'"} and term[0] == term[-1]:
+            term = unescape_string_literal(term)
+        queryset = queryset.filter(reduce(operator.or_, (Q(**{f'{field}__icontains': term}) for field in fields)))
+    return queryset
+
+
+def _admin_leave_queryset(params):
+    """
+    後台選取的請假記錄
+
+    params: date_from、date_to，以及下列其一
+    - leave_ids: 勾選的記錄（最多一頁）
+    - search: 「選取全部」時變更清單的搜尋字串，不逐筆保存 ID
+    """
+    queryset = LeaveRecords.objects.filter(start_time__date__range=(params['date_from'], params['date_to']))
+    if 'leave_ids' in params:
+        queryset = queryset.filter(id__in=params['leave_ids'])
+    else:
+        queryset = _admin_search(queryset, params.get('search', ''), ADMIN_LEAVE_SEARCH_FIELDS)
+    return queryset.select_related('relation_id__employee_id').order_by(
+        'relation_id__employee_id__employee_id', 'start_time'
+    )
+
+
+def _admin_attendance_and_leave_sheets(params):
+    date_range = (params['date_from'], params['date_to'])
+    return [
+        ("出缺勤紀錄", AttendanceRecords.objects.filter(date__range=date_range).select_related(
+            'relation_id__employee_id'
+        ).order_by('relation_id__employee_id__employee_id', 'date'), ADMIN_ATTENDANCE_COLUMNS),
+        ("請假紀錄", LeaveRecords.objects.filter(start_time__date__range=date_range).select_related(
+            'relation_id__employee_id'
+        ).order_by('relation_id__employee_id__employee_id', 'start_time'), ADMIN_LEAVE_COLUMNS),
+    ]
+
+
+# 匯出內容
+# - filename: 下載檔名（不含副檔名）
+# - formats: 支援的格式
+# - sheets: params -> [(工作表名稱, queryset, 欄位)]；CSV 與 Parquet 只支援單一工作表
+# - parquet_fields: Parquet 欄位定義
+ExportKind = namedtuple('ExportKind', ['filename', 'formats', 'sheets', 'parquet_fields'])
+
+EXPORT_KINDS = {
+    'attendance': ExportKind(
+        'attendance_export', ('csv', 'xlsx', 'parquet'),
+        lambda params: [("出勤記錄", attendance_export_queryset(params), ATTENDANCE_COLUMNS)],
+        ATTENDANCE_PARQUET_FIELDS
+    ),
+    'leave': ExportKind(
+        'leave_export', ('csv', 'xlsx', 'parquet'),
+        lambda params: [("請假記錄", leave_export_queryset(params), LEAVE_COLUMNS)],
+        LEAVE_PARQUET_FIELDS
+    ),
+    'overtime': ExportKind(
+        'overtime_export', ('csv', 'xlsx', 'parquet'),
+        lambda params: [("加班記錄", overtime_export_queryset(params), OVERTIME_COLUMNS)],
+        OVERTIME_PARQUET_FIELDS
+    ),
+    'admin_leave': ExportKind(
+        'attendance_filtered', ('xlsx',),
+        lambda params: [("請假紀錄", _admin_leave_queryset(params), ADMIN_LEAVE_COLUMNS)],
+        None
+    ),
+    'admin_attendance_and_leave': ExportKind(
+        'attendance_leave_summary', ('xlsx',),
+        _admin_attendance_and_leave_sheets,
+        None
+    ),
+}
+
+
+def download_name(job):
+    return f"{EXPORT_KINDS[job.kind].filename}.{job.export_format}"
+
+
+def _fingerprint(user, kind, export_format, params):
+    payload = json.dumps([user.pk, kind, export_format, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ExportJobQueue:
+    """匯出工作的建立、執行與清除"""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    # ---------- 設定 ----------
+
+    @property
+    def in_process(self):
+        return getattr(settings, 'EXPORT_JOBS_IN_PROCESS', True)
+
+    @property
+    def ttl(self):
+        return timedelta(seconds=getattr(settings, 'EXPORT_JOB_TTL', 24 * 60 * 60))
+
+    @property
+    def directory(self):
+        directory = self._directory or getattr(settings, 'EXPORT_JOB_DIR', None)
+        if not directory:
+            directory = os.path.join(settings.BASE_DIR, 'var', 'exports')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def path(self, job):
+        return os.path.join(self.directory, job.file_name)
+
+    # ---------- 建立 ----------
+
+    def submit(self, user, kind, export_format, params):
+        """
+        建立匯出工作；已有相同的等待中 / 處理中工作時直接回傳該工作
+
+        Args:
+            user: 申請人
+            kind: 匯出內容（EXPORT_KINDS 的鍵）
+            export_format: csv / xlsx / parquet
+            params: 匯出參數（需可 JSON 序列化）
+
+        Returns:
+            tuple: (ExportJob, 是否新建立)
+
+        Raises:
+            ValueError: 不支援的匯出內容或格式
+        """
+        if kind not in EXPORT_KINDS or export_format not in EXPORT_KINDS[kind].formats:
+            raise ValueError(f"不支援的匯出：{kind} / {export_format}")
+
+        fingerprint = _fingerprint(user, kind, export_format, params)
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    job = ExportJob.objects.create(
+                        requested_by=user,
+                        kind=kind,
+                        export_format=export_format,
+                        params=params,
+                        fingerprint=fingerprint
+                    )
+            except IntegrityError:
+                existing = ExportJob.objects.filter(fingerprint=fingerprint).first()
+                if existing is not None:
+                    return existing, False
+                # 既有工作剛好完成並釋放去重鍵：重試建立
+                continue
+
+            job_id = job.id
+            transaction.on_commit(lambda: self.dispatch(job_id))
+            return job, True
+
+        raise IntegrityError('無法建立匯出工作')
+
+    def dispatch(self, job_id):
+        """交給程序內執行緒池處理（停用時由 run_export_jobs 處理）"""
+        if not self.in_process:
+            return
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'EXPORT_JOB_WORKERS', 2),
+                    thread_name_prefix='export-job'
+                )
+        self._executor.submit(self._run_in_thread, job_id)
+
+    # ---------- 執行 ----------
+
+    def _run_in_thread(self, job_id):
+        close_old_connections()
+        try:
+            self.run(job_id)
+        except Exception as e:
+            print(f"匯出工作錯誤: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def run(self, job_id):
+        """
+        執行等待中的工作
+
+        Returns:
+            bool: 是否由本次呼叫執行（已被其他 worker 取走時為 False）
+        """
+        claimed = ExportJob.objects.filter(id=job_id, status='pending').update(
+            status='running',
+            started_at=timezone.now()
+        )
+        if not claimed:
+            return False
+
+        job = ExportJob.objects.get(id=job_id)
+        file_name = f"{job.id}-{uuid.uuid4().hex}.{job.export_format}"
+        path = os.path.join(self.directory, file_name)
+        try:
+            self._write(job, path)
+        except Exception as e:
+            if os.path.exists(path):
+                os.remove(path)
+            ExportJob.objects.filter(id=job.id).update(
+                status='failed',
+                fingerprint=None,
+                error_message=str(e),
+                finished_at=timezone.now()
+            )
+            print(f"匯出工作 #{job.id} 失敗: {str(e)}")
+            return True
+
+        now = timezone.now()
+        ExportJob.objects.filter(id=job.id).update(
+            status='completed',
+            fingerprint=None,
+            file_name=file_name,
+            file_size=os.path.getsize(path),
+            finished_at=now,
+            expires_at=now + self.ttl
+        )
+        return True
+
+    def _write(self, job, path):
+        export_kind = EXPORT_KINDS[job.kind]
+        sheets = export_kind.sheets(job.params)
+        total = sum(queryset.count() for _, queryset, _ in sheets)
+        ExportJob.objects.filter(id=job.id).update(total_rows=total)
+
+        def update_progress(rows):
+            ExportJob.objects.filter(id=job.id).update(processed_rows=rows)
+
+        if job.export_format == 'parquet':
+            (_, queryset, _), = sheets
+            with open(path, 'wb') as output:
+                write_parquet(queryset, export_kind.parquet_fields, output=output, progress=update_progress)
+            return
+
+        counter = {'rows': 0}
+
+        def rows_with_progress(queryset, columns):
+            for row in iter_rows(queryset, columns):
+                yield row
+                counter['rows'] += 1
+                if counter['rows'] % EXPORT_CHUNK_SIZE == 0:
+                    update_progress(counter['rows'])
+
+        with open(path, 'wb') as output:
+            if job.export_format == 'csv':
+                (_, queryset, columns), = sheets
+                for chunk in iter_csv(rows_with_progress(queryset, columns), [h for h, _ in columns]):
+                    output.write(chunk)
+            else:
+                write_xlsx(
+                    [
+                        (title, [h for h, _ in columns], rows_with_progress(queryset, columns))
+                        for title, queryset, columns in sheets
+                    ],
+                    column_width=XLSX_COLUMN_WIDTH,
+                    output=output
+                )
+
+        update_progress(counter['rows'])
+
+    def run_pending(self, limit=None):
+        """
+        依建立順序執行等待中的工作
+
+        Returns:
+            int: 執行的工作數
+        """
+        count = 0
+        while limit is None or count < limit:
+            job_id = ExportJob.objects.filter(status='pending').order_by('id').values_list(
+                'id', flat=True
+            ).first()
+            if job_id is None:
+                break
+            if self.run(job_id):
+                count += 1
+        return count
+
+    # ---------- 清除 ----------
+
+    def requeue_stale(self):
+        """處理中過久（worker 已中斷）的工作重新排入等待"""
+        cutoff = timezone.now() - timedelta(seconds=STALE_SECONDS)
+        return ExportJob.objects.filter(status='running', started_at__lt=cutoff).update(
+            status='pending',
+            processed_rows=0
+        )
+
+    def purge_expired(self):
+        """
+        刪除過期檔案並標記工作為已過期
+
+        Returns:
+            int: 清除的工作數
+        """
+        expired = ExportJob.objects.filter(status='completed', expires_at__lte=timezone.now())
+        count = 0
+        for job in expired.only('id', 'file_name'):
+            path = self.path(job)
+            if os.path.exists(path):
+                os.remove(path)
+            count += ExportJob.objects.filter(id=job.id, status='completed').update(status='expired')
+        return count
+
+    def open(self, job):
+        """開啟已完成工作的檔案（檔案不存在時拋出 FileNotFoundError）"""
+        return open(self.path(job), 'rb')
+
+
+# 程序層級的共用佇列
+export_jobs = ExportJobQueue()
@@ -0,0 +1,325 @@
+"""
+資料匯出
+
+欄位定義（標題與取值函式）由各匯出格式共用，查詢以 iterator(chunk_size)
+分批讀取，記憶體用量與匯出筆數無關：
+
+- CSV：StreamingHttpResponse 逐批輸出
+- XLSX：openpyxl write-only 工作簿逐列寫入，存入暫存檔（超過
+  XLSX_SPOOL_MAX_SIZE 改寫入磁碟）後以 FileResponse 分段回傳
+
+- Parquet：供薪資與 BI 系統載入的具型別欄位（布林、定點小數、日期時間），
+  由 values_list 逐批讀取並以 row group 為單位寫入（需安裝 pyarrow）
+
+背景匯出工作（attendance.export_jobs）以相同的函式將檔案寫入磁碟。
+"""
+import csv
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+
+
+# 每次自資料庫讀取的筆數
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+# 每次輸出的列數
+CSV_ROWS_PER_WRITE = 500
+
+CSV_BOM = '\ufeff'
+
+# XLSX 暫存檔保留在記憶體的上限（位元組）
+XLSX_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Parquet 每個 row group 的列數（寫入前保留在記憶體中）
+PARQUET_ROW_GROUP_SIZE = getattr(settings, 'EXPORT_PARQUET_ROW_GROUP_SIZE', 50000)
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+
+def _yes_no(value):
+    return '是' if value else '否'
+
+
+def _optional_str(value):
+    return str(value) if value else ''
+
+
+def _time_or_blank(value):
+    return value.strftime('%H:%M:%S') if value else ''
+
+
+# 出勤記錄匯出欄位（查詢需 select_related('relation_id__employee_id')）
+ATTENDANCE_COLUMNS = [
+    ('日期', lambda r: str(r.date)),
+    ('員工編號', lambda r: r.relation_id.employee_id.employee_id),
+    ('員工姓名', lambda r: r.relation_id.employee_id.username),
+    ('上班時間', lambda r: _optional_str(r.checkin_time)),
+    ('下班時間', lambda r: _optional_str(r.checkout_time)),
+    ('工時', lambda r: r.work_hours),
+    ('是否遲到', lambda r: _yes_no(r.is_late)),
+    ('遲到分鐘', lambda r: r.late_minutes),
+    ('是否早退', lambda r: _yes_no(r.is_early_leave)),
+    ('早退分鐘', lambda r: r.early_leave_minutes),
+    ('是否補打卡', lambda r: _yes_no(r.is_makeup)),
+]
+
+# 請假記錄匯出欄位（查詢需 select_related('relation_id__employee_id')）
+LEAVE_COLUMNS = [
+    ('員工編號', lambda r: r.relation_id.employee_id.employee_id),
+    ('員工姓名', lambda r: r.relation_id.employee_id.username),
+    ('假別', lambda r: r.get_leave_type_display()),
+    ('開始時間', lambda r: str(r.start_time)),
+    ('結束時間', lambda r: str(r.end_time)),
+    ('請假時數', lambda r: r.leave_hours),
+    ('狀態', lambda r: r.get_status_display()),
+    ('請假原因', lambda r: r.leave_reason or ''),
+]
+
+# 加班記錄匯出欄位（查詢需 select_related('relation_id__employee_id')）
+OVERTIME_COLUMNS = [
+    ('日期', lambda r: str(r.date)),
+    ('員工編號', lambda r: r.relation_id.employee_id.employee_id),
+    ('員工姓名', lambda r: r.relation_id.employee_id.username),
+    ('開始時間', lambda r: str(r.start_time)),
+    ('結束時間', lambda r: str(r.end_time)),
+    ('加班時數', lambda r: r.overtime_hours),
+    ('補償方式', lambda r: r.get_compensation_type_display()),
+    ('補休時數', lambda r: r.compensatory_hours),
+    ('加班費時數', lambda r: r.pay_hours),
+    ('狀態', lambda r: r.get_status_display()),
+    ('加班原因', lambda r: r.reason or ''),
+]
+
+# Parquet 匯出欄位：(欄位名稱, values_list 路徑, 型別)
+# 型別：string / int32 / int64 / bool / date / time / timestamp / ('decimal', 位數, 小數位數)
+ATTENDANCE_PARQUET_FIELDS = [
+    ('date', 'date', 'date'),
+    ('relation_id', 'relation_id', 'int64'),
+    ('employee_id', 'relation_id__employee_id__employee_id', 'string'),
+    ('employee_name', 'relation_id__employee_id__username', 'string'),
+    ('checkin_time', 'checkin_time', 'timestamp'),
+    ('checkout_time', 'checkout_time', 'timestamp'),
+    ('work_hours', 'work_hours', ('decimal', 5, 2)),
+    ('is_late', 'is_late', 'bool'),
+    ('late_minutes', 'late_minutes', 'int32'),
+    ('is_early_leave', 'is_early_leave', 'bool'),
+    ('early_leave_minutes', 'early_leave_minutes', 'int32'),
+    ('is_makeup', 'is_makeup', 'bool'),
+]
+
+LEAVE_PARQUET_FIELDS = [
+    ('relation_id', 'relation_id', 'int64'),
+    ('employee_id', 'relation_id__employee_id__employee_id', 'string'),
+    ('employee_name', 'relation_id__employee_id__username', 'string'),
+    ('leave_type', 'leave_type', 'string'),
+    ('start_time', 'start_time', 'timestamp'),
+    ('end_time', 'end_time', 'timestamp'),
+    ('leave_hours', 'leave_hours', ('decimal', 5, 2)),
+    ('status', 'status', 'string'),
+    ('leave_reason', 'leave_reason', 'string'),
+]
+
+OVERTIME_PARQUET_FIELDS = [
+    ('date', 'date', 'date'),
+    ('relation_id', 'relation_id', 'int64'),
+    ('employee_id', 'relation_id__employee_id__employee_id', 'string'),
+    ('employee_name', 'relation_id__employee_id__username', 'string'),
+    ('start_time', 'start_time', 'time'),
+    ('end_time', 'end_time', 'time'),
+    ('overtime_hours', 'overtime_hours', ('decimal', 5, 2)),
+    ('compensation_type', 'compensation_type', 'string'),
+    ('compensatory_hours', 'compensatory_hours', ('decimal', 5, 2)),
+    ('pay_hours', 'pay_hours', ('decimal', 5, 2)),
+    ('status', 'status', 'string'),
+    ('reason', 'reason', 'string'),
+]
+
+# 後台匯出欄位
+ADMIN_ATTENDANCE_COLUMNS = [
+    ('員工編號', lambda r: r.relation_id.employee_id.employee_id),
+    ('員工姓名', lambda r: r.relation_id.employee_id.username),
+    ('關聯編號', lambda r: r.relation_id_id),
+    ('日期', lambda r: r.date.strftime('%Y-%m-%d') if r.date else ''),
+    ('簽到時間', lambda r: _time_or_blank(r.checkin_time)),
+    ('簽退時間', lambda r: _time_or_blank(r.checkout_time)),
+    ('簽到地點', lambda r: r.checkin_location or ''),
+    ('簽退地點', lambda r: r.checkout_location or ''),
+    ('工作時數', lambda r: r.work_hours or ''),
+]
+
+ADMIN_LEAVE_COLUMNS = [
+    ('員工編號', lambda r: r.relation_id.employee_id.employee_id),
+    ('員工姓名', lambda r: r.relation_id.employee_id.username),
+    ('關聯編號', lambda r: r.relation_id_id),
+    ('請假日期', lambda r: r.start_time.strftime('%Y-%m-%d') if r.start_time else ''),
+    ('開始時間', lambda r: _time_or_blank(r.start_time)),
+    ('結束時間', lambda r: _time_or_blank(r.end_time)),
+    ('請假時數', lambda r: r.leave_hours or ''),
+    ('請假原因', lambda r: r.leave_reason or ''),
+]
+
+
+def iter_rows(queryset, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """逐筆產生資料列（分批查詢，不快取 queryset）"""
+    for record in queryset.iterator(chunk_size=chunk_size):
+        yield [get(record) for _, get in columns]
+
+
+class _Echo:
+    """csv.writer 的輸出目標：直接回傳寫入的字串"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, headers):
+    """
+    產生 CSV 內容（UTF-8 位元組），BOM 只在開頭輸出一次，方便 Excel 辨識編碼
+    """
+    writer = csv.writer(_Echo())
+    yield (CSV_BOM + writer.writerow(headers)).encode('utf-8')
+
+    buffer = []
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= CSV_ROWS_PER_WRITE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def csv_response(queryset, columns, filename):
+    """以串流回應匯出 CSV"""
+    headers = [header for header, _ in columns]
+    response = StreamingHttpResponse(
+        iter_csv(iter_rows(queryset, columns), headers),
+        content_type='text/csv; charset=utf-8-sig'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx(sheets, column_width=None, output=None):
+    """
+    以 write-only 工作簿逐列寫入 XLSX
+
+    Args:
+        sheets: [(工作表名稱, 標題列, 資料列 iterable)]
+        column_width: 欄寬（選填）
+        output: 寫入的檔案物件（選填，預設為暫存檔）
+
+    Returns:
+        已寫入並移到開頭的檔案物件
+
+    Raises:
+        ImportError: 未安裝 openpyxl
+    """
+    import openpyxl
+    from openpyxl.utils import get_column_letter
+
+    wb = openpyxl.Workbook(write_only=True)
+    for title, headers, rows in sheets:
+        ws = wb.create_sheet(title=title)
+        if column_width:
+            for col in range(1, len(headers) + 1):
+                ws.column_dimensions[get_column_letter(col)].width = column_width
+        ws.append(headers)
+        for row in rows:
+            ws.append(row)
+
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def xlsx_response(sheets, filename, column_width=None):
+    """以 FileResponse 分段回傳 XLSX（sheets 格式同 write_xlsx）"""
+    response = FileResponse(write_xlsx(sheets, column_width), content_type=XLSX_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def sheet(title, queryset, columns):
+    """由欄位定義建立 write_xlsx 的工作表參數"""
+    return title, [header for header, _ in columns], iter_rows(queryset, columns)
+
+
+def _arrow_type(pa, spec):
+    if isinstance(spec, tuple):
+        _, precision, scale = spec
+        return pa.decimal128(precision, scale)
+    return {
+        'string': pa.string(),
+        'int32': pa.int32(),
+        'int64': pa.int64(),
+        'bool': pa.bool_(),
+        'date': pa.date32(),
+        'time': pa.time64('us'),
+        'timestamp': pa.timestamp('us'),
+    }[spec]
+
+
+def write_parquet(queryset, fields, output=None, progress=None, row_group_size=PARQUET_ROW_GROUP_SIZE):
+    """
+    以 values_list 逐批讀取並寫入 Parquet，每 row_group_size 列寫出一個 row group
+
+    Args:
+        queryset: 查詢（只讀取 fields 指定的欄位）
+        fields: [(欄位名稱, values_list 路徑, 型別)]
+        output: 寫入的檔案物件（選填，預設為暫存檔）
+        progress: 每寫出一個 row group 後以累計列數呼叫（選填）
+
+    Returns:
+        已寫入並移到開頭的檔案物件
+
+    Raises:
+        ImportError: 未安裝 pyarrow
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([pa.field(name, _arrow_type(pa, spec)) for name, _, spec in fields])
+    rows = queryset.values_list(*[path for _, path, _ in fields]).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    if output is None:
+        output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_MAX_SIZE)
+
+    def write(writer, batch):
+        columns = zip(*batch)
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        ))
+
+    written = 0
+    with pq.ParquetWriter(output, schema, compression='snappy') as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                write(writer, batch)
+                written += len(batch)
+                batch = []
+                if progress:
+                    progress(written)
+        if batch:
+            write(writer, batch)
+            written += len(batch)
+            if progress:
+                progress(written)
+
+    output.seek(0)
+    return output
+
+
+def parquet_response(queryset, fields, filename):
+    """以 FileResponse 分段回傳 Parquet"""
+    response = FileResponse(write_parquet(queryset, fields), content_type=PARQUET_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,195 @@
+"""
+打卡地點（公司）地理圍欄索引
+
+將所有 Companies 依經緯度切成網格存放於記憶體中，打卡時以
+「網格 → 邊界框預篩 → Haversine 精算」三段式查詢取代資料庫的
+浮點數等值比對。
+
+- 第一次查詢時載入（程序啟動後的第一筆打卡）
+- Companies 新增 / 修改 / 刪除時由 signals 標記失效，下一次查詢重建
+- 另設定存活時間（GEOFENCE_INDEX_TTL），讓多個 worker 程序的索引最終一致
+"""
+import threading
+import time as _time
+from collections import namedtuple
+from math import cos, floor, radians
+
+from django.conf import settings
+
+from .utils import calculate_distance, label_geofences
+
+
+# 每 1 度緯度約 111.32 公里
+METERS_PER_DEGREE = 111320.0
+
+# 網格邊長（度），0.05 度約 5.5 公里
+CELL_SIZE_DEGREES = getattr(settings, 'GEOFENCE_CELL_SIZE_DEGREES', 0.05)
+
+# QR Code 座標與公司座標的容許誤差（公尺），吸收不同裝置的小數位數捨入差異
+QR_MATCH_TOLERANCE_METERS = getattr(settings, 'GEOFENCE_QR_TOLERANCE_METERS', 30.0)
+
+# 索引存活時間（秒），逾時自動重建
+INDEX_TTL_SECONDS = getattr(settings, 'GEOFENCE_INDEX_TTL', 300)
+
+
+# qr_secret 供驗證資訊站輪替 QR Code（attendance.qr_tokens）
+Site = namedtuple('Site', ['id', 'name', 'latitude', 'longitude', 'radius', 'qr_secret'], defaults=(None,))
+
+
+def _cell(lat, lng):
+    """座標所屬網格"""
+    return (floor(lat / CELL_SIZE_DEGREES), floor(lng / CELL_SIZE_DEGREES))
+
+
+def _bounding_box(lat, lng, meters):
+    """以 (lat, lng) 為中心、半徑 meters 的邊界框（度）"""
+    dlat = meters / METERS_PER_DEGREE
+    # 高緯度時經度間距縮小，避免除以 0
+    dlng = meters / (METERS_PER_DEGREE * max(cos(radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+class GeofenceIndex:
+    """公司地理圍欄的記憶體網格索引"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._sites = {}
+        self._max_radius = 0.0
+        self._loaded_at = None
+        # 每次失效遞增，避免重建期間收到的失效通知被覆蓋
+        self._generation = 0
+
+    # ---------- 載入與失效 ----------
+
+    def invalidate(self):
+        """標記索引失效（下一次查詢時重建）"""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+
+    def load(self, sites=None):
+        """
+        建立索引
+
+        Args:
+            sites: Site 序列；未提供時從資料庫讀取所有公司
+        """
+        generation = self._generation
+        if sites is None:
+            from .models import Companies
+            sites = [
+                Site(c['id'], c['name'], float(c['latitude']), float(c['longitude']),
+                     float(c['radius']) if c['radius'] else 2000.0, c['qr_secret'])
+                for c in Companies.objects.values('id', 'name', 'latitude', 'longitude', 'radius', 'qr_secret')
+            ]
+
+        cells = {}
+        by_id = {}
+        for site in sites:
+            by_id[site.id] = site
+            cells.setdefault(_cell(site.latitude, site.longitude), []).append(site)
+
+        with self._lock:
+            self._cells = cells
+            self._sites = by_id
+            self._max_radius = max((s.radius for s in sites), default=0.0)
+            if generation == self._generation:
+                self._loaded_at = _time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or _time.monotonic() - loaded_at > INDEX_TTL_SECONDS:
+            self.load()
+
+    # ---------- 查詢 ----------
+
+    def get(self, company_id):
+        """依公司 ID 取得 Site"""
+        self._ensure_loaded()
+        try:
+            return self._sites.get(int(company_id))
+        except (TypeError, ValueError):
+            return None
+
+    def _candidates(self, lat, lng, meters):
+        """網格 + 邊界框預篩，回傳可能落在範圍內的 Site"""
+        min_lat, max_lat, min_lng, max_lng = _bounding_box(lat, lng, meters)
+        min_row, min_col = _cell(min_lat, min_lng)
+        max_row, max_col = _cell(max_lat, max_lng)
+
+        cells = self._cells
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for site in cells.get((row, col), ()):
+                    if min_lat <= site.latitude <= max_lat and min_lng <= site.longitude <= max_lng:
+                        yield site
+
+    def nearest(self, lat, lng, max_distance=None):
+        """
+        找出距離 (lat, lng) 最近且在 max_distance 公尺內的公司
+
+        Returns:
+            tuple: (Site, 距離公尺)；找不到時為 (None, None)
+        """
+        if max_distance is None:
+            max_distance = QR_MATCH_TOLERANCE_METERS
+        self._ensure_loaded()
+
+        lat, lng = float(lat), float(lng)
+        best, best_distance = None, None
+        for site in self._candidates(lat, lng, max_distance):
+            distance = calculate_distance(lat, lng, site.latitude, site.longitude)
+            if distance <= max_distance and (best_distance is None or distance < best_distance):
+                best, best_distance = site, distance
+        return best, best_distance
+
+    def resolve_qr(self, qr_lat, qr_lng):
+        """依 QR Code 上的座標解析公司（容許小數位數捨入誤差）"""
+        site, _ = self.nearest(qr_lat, qr_lng, QR_MATCH_TOLERANCE_METERS)
+        return site
+
+    def covering(self, lat, lng, max_radius=None):
+        """
+        列出打卡半徑涵蓋 (lat, lng) 的所有公司
+
+        Returns:
+            list: [(Site, 距離公尺), ...]，依距離由近到遠排序
+        """
+        self._ensure_loaded()
+        if max_radius is None:
+            max_radius = self._max_radius
+
+        lat, lng = float(lat), float(lng)
+        matches = []
+        for site in self._candidates(lat, lng, max_radius):
+            distance = calculate_distance(lat, lng, site.latitude, site.longitude)
+            if distance <= site.radius:
+                matches.append((site, distance))
+        matches.sort(key=lambda item: item[1])
+        return matches
+
+    def label(self, lats, lngs):
+        """
+        批次判定多個座標所屬的公司（稽核、匯入等大量座標使用）
+
+        Returns:
+            list: [(Site 或 None, 與最近公司的距離公尺), ...]
+        """
+        self._ensure_loaded()
+        sites = list(self._sites.values())
+        labels, distances = label_geofences(
+            lats, lngs,
+            [s.latitude for s in sites],
+            [s.longitude for s in sites],
+            [s.radius for s in sites],
+        )
+        return [
+            (sites[label] if label is not None else None, distance)
+            for label, distance in zip(labels, distances)
+        ]
+
+
+# 程序層級的共用索引
+geofence_index = GeofenceIndex()
@@ -0,0 +1,143 @@
+"""
+冪等鍵（Idempotency-Key）支援
+
+行動裝置網路不穩時，App 會重送打卡與各類申請請求。請求帶有
+`Idempotency-Key` 標頭時：
+
+- 第一次請求：記錄鍵值後執行 view，並保存回應
+- 重送（相同鍵值、相同內容）：直接回傳保存的回應，不再執行 view
+- 第一次請求尚在處理中：回傳 409，App 稍後再重試
+- 相同鍵值但請求內容不同：回傳 422
+
+鍵值以使用者為範圍，保存 IDEMPOTENCY_KEY_TTL 秒（預設 24 小時）；
+過期記錄由 `python manage.py purge_idempotency_keys` 清除。
+未帶標頭的請求行為不變。
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .responses import error_response, validation_error_response
+
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+
+# 鍵值保存時間（秒）
+KEY_TTL_SECONDS = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+# 處理中的記錄超過此秒數視為中斷（程序當機），允許重新執行
+IN_FLIGHT_TIMEOUT_SECONDS = getattr(settings, 'IDEMPOTENCY_IN_FLIGHT_TIMEOUT', 60)
+
+
+def _fingerprint(request, args, kwargs):
+    """方法、路徑與請求內容的 SHA-256"""
+    payload = json.dumps(
+        [request.method, request.path, request.data, args, kwargs],
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _claim(user, key, fingerprint):
+    """
+    取得鍵值的執行權
+
+    Returns:
+        tuple: (已取得執行權的記錄, None) 或 (None, 既有記錄)
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    request_fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=KEY_TTL_SECONDS)
+                ), None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if existing is None:
+                continue
+
+            abandoned = (
+                existing.status_code is None
+                and existing.created_at < now - timedelta(seconds=IN_FLIGHT_TIMEOUT_SECONDS)
+            )
+            if existing.expires_at > now and not abandoned:
+                return None, existing
+
+            # 已過期或已中斷：刪除後重新取得
+            IdempotencyKey.objects.filter(pk=existing.pk, created_at=existing.created_at).delete()
+    return None, IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def idempotent(view_func):
+    """
+    為 API view 加上 Idempotency-Key 支援
+
+    須放在 @api_view / @permission_classes 之下（緊貼 view 函式）：
+
+        @api_view(['POST'])
+        @permission_classes([IsAuthenticated])
+        @idempotent
+        def clock_in(request):
+            ...
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_func(request, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return validation_error_response(f"{HEADER} 長度不可超過 {MAX_KEY_LENGTH} 個字元")
+
+        fingerprint = _fingerprint(request, args, kwargs)
+        record, existing = _claim(request.user, key, fingerprint)
+
+        if record is None:
+            if existing is None or existing.status_code is None:
+                return error_response(
+                    "相同的請求正在處理中，請稍後再試",
+                    code="IDEMPOTENCY_IN_PROGRESS",
+                    status_code=status.HTTP_409_CONFLICT
+                )
+            if existing.request_fingerprint != fingerprint:
+                return error_response(
+                    f"{HEADER} 已用於內容不同的請求",
+                    code="IDEMPOTENCY_KEY_REUSED",
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            response = Response(existing.response_body, status=existing.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        # 伺服器錯誤不保存，讓 App 重試時重新執行
+        if response.status_code >= 500 or not isinstance(response, Response):
+            record.delete()
+            return response
+
+        IdempotencyKey.objects.filter(pk=record.pk).update(
+            status_code=response.status_code,
+            response_body=response.data
+        )
+        return response
+
+    return wrapper
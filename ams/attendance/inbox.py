@@ -0,0 +1,148 @@
+"""
+待審批收件匣
+
+請假（ApprovalRecords）、加班（OvertimeApproval）、補打卡（MakeupClockApproval）
+三種待審記錄以相同欄位投影後 UNION ALL 成一個查詢，依送出時間由舊到新排序，
+以 (submitted_at, item_type, approval_id) 作為 keyset 游標分頁；申請人、日期、
+時數等欄位在同一個查詢中 JOIN 取得，不需逐筆查詢關聯。
+
+各類型的待審件數讀取審批人的待審計數列（attendance.pending_counters）。
+"""
+from datetime import datetime
+
+from django.db.models import CharField, DecimalField, F, Value
+from django.db.models.functions import TruncDate
+
+from .models import (
+    ApprovalRecords, LeaveRecords, MakeupClockApproval, MakeupClockRequest, OvertimeApproval, OvertimeRecords
+)
+from .pagination import decode_cursor, encode_cursor, keyset_filter
+from .pending_counters import pending_counts
+
+
+INBOX_PAGE_SIZE = 50
+INBOX_MAX_PAGE_SIZE = 200
+
+# 排序欄位（游標內容）
+ORDERING = ('submitted_at', 'item_type', 'approval_id')
+
+# 類型 → (審批模型, 申請外鍵, 申請模型)
+SOURCES = {
+    'leave': (ApprovalRecords, 'leave_id', LeaveRecords),
+    'overtime': (OvertimeApproval, 'overtime_id', OvertimeRecords),
+    'makeup': (MakeupClockApproval, 'request_id', MakeupClockRequest),
+}
+TYPES = tuple(SOURCES)
+
+# 各申請的分類（假別 / 補償方式 / 補打卡類型）顯示名稱
+CATEGORY_LABELS = {
+    'leave': dict(LeaveRecords.LEAVE_TYPES),
+    'overtime': dict(OvertimeRecords.COMPENSATION_CHOICES),
+    'makeup': dict(MakeupClockRequest.MAKEUP_TYPE_CHOICES),
+}
+
+
+def _columns(item_type):
+    """
+    各類型投影成相同欄位
+
+    UNION 依 SELECT 順序對應欄位，三個分支需以相同順序 annotate
+    （欄位名稱不可與模型欄位相同）。
+    """
+    fk = SOURCES[item_type][1]
+    if item_type == 'leave':
+        day, hours, category, reason = (
+            TruncDate(f'{fk}__start_time'), F(f'{fk}__leave_hours'), F(f'{fk}__leave_type'), F(f'{fk}__leave_reason')
+        )
+    elif item_type == 'overtime':
+        day, hours, category, reason = (
+            F(f'{fk}__date'), F(f'{fk}__overtime_hours'), F(f'{fk}__compensation_type'), F(f'{fk}__reason')
+        )
+    else:
+        day, hours, category, reason = (
+            F(f'{fk}__date'), Value(None, output_field=DecimalField(max_digits=6, decimal_places=2)),
+            F(f'{fk}__makeup_type'), F(f'{fk}__reason')
+        )
+    return {
+        'submitted_at': F('created_at'),
+        'item_type': Value(item_type, output_field=CharField()),
+        'approval_id': F('id'),
+        'application_id': F(fk),
+        'level': F('approval_level'),
+        'applicant_id': F(f'{fk}__relation_id__employee_id'),
+        'applicant_name': F(f'{fk}__relation_id__employee_id__username'),
+        'day': day,
+        'hours': hours,
+        'category': category,
+        'reason': reason,
+    }
+
+
+def _branch(employee_id, item_type, after):
+    model = SOURCES[item_type][0]
+    columns = _columns(item_type)
+    queryset = model.objects.filter(approver_id=employee_id, status='pending').annotate(**columns)
+    if after:
+        queryset = queryset.filter(keyset_filter(ORDERING, after, descending=False))
+    # 子查詢不可帶 ORDER BY（模型預設排序）
+    return queryset.order_by().values(*columns)
+
+
+def decode_inbox_cursor(cursor):
+    """
+    解碼收件匣游標
+
+    Raises:
+        InvalidCursor / TypeError / ValueError: 格式錯誤
+    """
+    submitted_at, item_type, approval_id = decode_cursor(cursor, len(ORDERING))
+    return datetime.fromisoformat(submitted_at), str(item_type), int(approval_id)
+
+
+def inbox_page(employee_id, types=TYPES, after=None, limit=INBOX_PAGE_SIZE):
+    """
+    待審批收件匣的一頁
+
+    Args:
+        employee_id: 審批人員工編號
+        types: 要列出的類型
+        after: 上一頁最後一筆的 (submitted_at, item_type, approval_id)
+        limit: 每頁筆數
+
+    Returns:
+        dict: items / counts / has_more / next_cursor
+    """
+    branches = [_branch(employee_id, item_type, after) for item_type in TYPES if item_type in types]
+    rows = []
+    if branches:
+        queryset = branches[0].union(*branches[1:], all=True) if len(branches) > 1 else branches[0]
+        # 多取一筆判斷是否還有下一頁
+        rows = list(queryset.order_by(*ORDERING)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [
+        {
+            'type': row['item_type'],
+            'approval_id': row['approval_id'],
+            'application_id': row['application_id'],
+            'approval_level': row['level'],
+            'submitted_at': row['submitted_at'],
+            'applicant': {'employee_id': row['applicant_id'], 'name': row['applicant_name']},
+            'date': str(row['day']) if row['day'] else None,
+            'hours': float(row['hours']) if row['hours'] is not None else None,
+            'category': row['category'],
+            'category_display': CATEGORY_LABELS[row['item_type']].get(row['category'], row['category']),
+            'reason': row['reason'],
+        }
+        for row in rows
+    ]
+
+    counts = pending_counts([employee_id])[employee_id]
+    return {
+        'count': len(items),
+        'items': items,
+        'counts': {**counts, 'total': sum(counts.values())},
+        'has_more': has_more,
+        'next_cursor': encode_cursor([rows[-1][field] for field in ORDERING]) if has_more else None
+    }
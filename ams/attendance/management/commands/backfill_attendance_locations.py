@@ -0,0 +1,96 @@
+"""
+回填出勤記錄的打卡座標與距離欄位
+
+解析既有記錄的 checkin_location / checkout_location（"lat, lng"），
+寫入 checkin_latitude 等結構化欄位，並計算與公司的距離。
+依主鍵分批處理，可重複執行（只處理尚未回填的記錄）。
+
+用法：
+    python manage.py backfill_attendance_locations
+    python manage.py backfill_attendance_locations --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from attendance.geofence import geofence_index
+from attendance.models import AttendanceRecords
+from attendance.utils import calculate_distances, parse_location
+
+
+LOCATION_FIELDS = [
+    'checkin_latitude', 'checkin_longitude', 'checkin_distance',
+    'checkout_latitude', 'checkout_longitude', 'checkout_distance',
+]
+
+
+class Command(BaseCommand):
+    help = '回填出勤記錄的打卡座標與距離欄位'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='每批處理筆數')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = AttendanceRecords.objects.filter(
+            Q(checkin_latitude__isnull=True) | Q(checkout_latitude__isnull=True)
+        ).order_by('id')
+
+        last_id = 0
+        scanned = updated = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).values(
+                'id', 'relation_id__company_id', 'checkin_time', 'checkout_time',
+                'checkin_location', 'checkout_location', *LOCATION_FIELDS
+            )[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            scanned += len(rows)
+
+            records = self._backfill(rows)
+            if records:
+                AttendanceRecords.objects.bulk_update(records, LOCATION_FIELDS)
+                updated += len(records)
+
+            self.stdout.write(f"已掃描 {scanned} 筆，已回填 {updated} 筆（至 ID {last_id}）")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：共回填 {updated} 筆"))
+
+    def _backfill(self, rows):
+        """解析一批記錄的打卡位置，回傳需更新的記錄（距離以向量化方式一次計算）"""
+        # (記錄, 欄位前綴, 緯度, 經度, 公司)
+        points = []
+        for row in rows:
+            site = geofence_index.get(row['relation_id__company_id'])
+            # 帶入目前的值，bulk_update 時不會覆寫已回填的欄位
+            record = AttendanceRecords(id=row['id'], **{name: row[name] for name in LOCATION_FIELDS})
+
+            if row['checkin_latitude'] is None:
+                lat, lng = parse_location(row['checkin_location'])
+                if lat is not None:
+                    points.append((record, 'checkin', lat, lng, site))
+
+            # 下班時間與上班時間相同表示尚未下班打卡
+            if row['checkout_latitude'] is None and row['checkout_time'] > row['checkin_time']:
+                lat, lng = parse_location(row['checkout_location'])
+                if lat is not None:
+                    points.append((record, 'checkout', lat, lng, site))
+
+        located = [point for point in points if point[4] is not None]
+        distances = calculate_distances(
+            [point[2] for point in located],
+            [point[3] for point in located],
+            [point[4].latitude for point in located],
+            [point[4].longitude for point in located],
+        ) if located else []
+        distance_of = {id(point): round(distance, 2) for point, distance in zip(located, distances)}
+
+        records = {}
+        for point in points:
+            record, prefix, lat, lng, _ = point
+            setattr(record, f'{prefix}_latitude', lat)
+            setattr(record, f'{prefix}_longitude', lng)
+            setattr(record, f'{prefix}_distance', distance_of.get(id(point)))
+            records[record.id] = record
+
+        return list(records.values())
@@ -0,0 +1,39 @@
+"""
+將打卡緩衝佇列寫入資料庫
+
+用法：
+    python manage.py drain_punch_queue            # 處理一次（含當機殘留的區段）後結束
+    python manage.py drain_punch_queue --watch    # 持續執行，作為獨立的 flusher 程序
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from attendance.punch_queue import punch_queue
+
+
+class Command(BaseCommand):
+    help = '將打卡緩衝佇列（本機日誌）中的打卡寫入出勤記錄'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='持續執行，定期寫入')
+        parser.add_argument('--interval', type=float, default=2.0, help='--watch 模式的間隔秒數')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"佇列目錄：{punch_queue.directory}")
+        self.stdout.write(f"待寫入：{punch_queue.pending_count()} 筆")
+
+        while True:
+            close_old_connections()
+            result = punch_queue.flush()
+            if result is None:
+                self.stdout.write(self.style.WARNING('其他 flusher 正在處理，稍後重試'))
+            elif result['committed'] or result['rejected'] or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"已寫入 {result['committed']} 筆，拒絕 {result['rejected']} 筆"
+                ))
+
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
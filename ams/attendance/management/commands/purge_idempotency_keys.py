@@ -0,0 +1,18 @@
+"""
+清除過期的冪等鍵記錄
+
+用法（建議每日排程執行）：
+    python manage.py purge_idempotency_keys
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from attendance.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = '清除過期的冪等鍵（Idempotency-Key）記錄'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f"已清除 {deleted} 筆過期記錄"))
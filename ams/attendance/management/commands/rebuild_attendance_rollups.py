@@ -0,0 +1,69 @@
+"""
+以原始資料重建出勤月統計（AttendanceMonthlyRollup）
+
+用法：
+    python manage.py rebuild_attendance_rollups                    # 所有有資料的月份
+    python manage.py rebuild_attendance_rollups --year 2025 --month 3
+    python manage.py rebuild_attendance_rollups --year 2025        # 整年
+
+部署新增月統計表後須執行一次；之後僅在統計與原始資料不一致時使用
+（例如直接以 SQL 或 bulk_update 修改出勤記錄）。
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.models import (
+    AttendanceMonthlyRollup, AttendanceRecords, LeaveRecords, OvertimeRecords
+)
+from attendance.report_cache import report_cache
+from attendance.rollups import rebuild_month
+
+
+class Command(BaseCommand):
+    help = '以出勤、請假、加班記錄重建出勤月統計'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='只重建指定年份')
+        parser.add_argument('--month', type=int, help='只重建指定月份（需搭配 --year）')
+
+    def handle(self, *args, **options):
+        year, month = options['year'], options['month']
+        if month is not None and year is None:
+            raise CommandError('--month 需搭配 --year 使用')
+        if month is not None and not 1 <= month <= 12:
+            raise CommandError('--month 必須介於 1 到 12')
+
+        if month is not None:
+            periods = [(year, month)]
+        else:
+            periods = sorted(self._periods_with_data(year))
+
+        total = 0
+        for period_year, period_month in periods:
+            count = rebuild_month(period_year, period_month)
+            total += count
+            self.stdout.write(f"{period_year}-{period_month:02d}：{count} 筆")
+
+        # 部門報表讀取月統計
+        report_cache.clear()
+        self.stdout.write(self.style.SUCCESS(f"已重建 {len(periods)} 個月份，共 {total} 筆月統計"))
+
+    def _periods_with_data(self, year=None):
+        """有出勤、已核准請假 / 加班或既有統計列的 (年, 月)"""
+        attendance = AttendanceRecords.objects.all()
+        leaves = LeaveRecords.objects.filter(status='approved')
+        overtimes = OvertimeRecords.objects.filter(status='approved')
+        rollups = AttendanceMonthlyRollup.objects.all()
+        if year is not None:
+            attendance = attendance.filter(date__year=year)
+            leaves = leaves.filter(start_time__year=year)
+            overtimes = overtimes.filter(date__year=year)
+            rollups = rollups.filter(year=year)
+
+        periods = set(rollups.values_list('year', 'month').distinct())
+        for value in attendance.dates('date', 'month'):
+            periods.add((value.year, value.month))
+        for value in leaves.datetimes('start_time', 'month'):
+            periods.add((value.year, value.month))
+        for value in overtimes.dates('date', 'month'):
+            periods.add((value.year, value.month))
+        return periods
@@ -0,0 +1,20 @@
+"""
+以審批記錄修正審批人待審件數（PendingApprovalCounter）
+
+用法：
+    python manage.py reconcile_pending_counters
+
+部署新增待審計數表後須執行一次；之後僅在計數與審批記錄不一致時使用
+（例如直接以 SQL、bulk_update 或 QuerySet.update 修改審批狀態）。
+"""
+from django.core.management.base import BaseCommand
+
+from attendance.pending_counters import reconcile
+
+
+class Command(BaseCommand):
+    help = '以待審的請假、加班、補打卡審批記錄修正各審批人的待審件數'
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        self.stdout.write(self.style.SUCCESS(f"已修正 {fixed} 位審批人的待審件數"))
@@ -0,0 +1,42 @@
+"""
+執行背景匯出工作並清除過期檔案
+
+用法：
+    python manage.py run_export_jobs            # 處理目前等待中的工作後結束（可排程執行）
+    python manage.py run_export_jobs --watch    # 持續執行，作為獨立的匯出 worker 程序
+
+EXPORT_JOBS_IN_PROCESS 為 False 時匯出工作只由此指令處理；
+為 True 時仍建議每日排程執行一次以清除過期檔案。
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from attendance.export_jobs import export_jobs
+
+
+class Command(BaseCommand):
+    help = '執行等待中的匯出工作並清除過期的匯出檔案'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true', help='持續執行，定期處理新工作')
+        parser.add_argument('--interval', type=float, default=2.0, help='--watch 模式的間隔秒數')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"檔案目錄：{export_jobs.directory}")
+
+        while True:
+            close_old_connections()
+            requeued = export_jobs.requeue_stale()
+            purged = export_jobs.purge_expired()
+            completed = export_jobs.run_pending()
+
+            if requeued or purged or completed or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"執行 {completed} 個工作，清除 {purged} 個過期檔案，重新排入 {requeued} 個中斷的工作"
+                ))
+
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
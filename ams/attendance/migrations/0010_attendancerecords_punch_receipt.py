@@ -0,0 +1,26 @@
+# 打卡緩衝佇列：出勤記錄新增收據編號
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_phase3_departments_roles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='punch_receipt',
+            field=models.CharField(
+                blank=True,
+                help_text='由打卡緩衝佇列寫入的記錄，對應回傳給 App 的收據編號',
+                max_length=48,
+                null=True,
+                unique=True,
+                verbose_name='緩衝打卡收據'
+            ),
+        ),
+    ]
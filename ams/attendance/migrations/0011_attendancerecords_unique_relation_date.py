@@ -0,0 +1,60 @@
+# 出勤記錄：每位員工每天只允許一筆（relation_id, date 唯一約束）
+# Generated manually
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def merge_duplicate_records(apps, schema_editor):
+    """
+    合併同一員工同一天的重複出勤記錄
+
+    保留最早上班打卡的一筆，下班打卡資訊取最晚下班的一筆，
+    補打卡申請改為指向保留的記錄，其餘記錄刪除。
+    """
+    AttendanceRecords = apps.get_model('attendance', 'AttendanceRecords')
+    MakeupClockRequest = apps.get_model('attendance', 'MakeupClockRequest')
+
+    duplicates = (
+        AttendanceRecords.objects.values('relation_id', 'date')
+        .annotate(total=models.Count('id'))
+        .filter(total__gt=1)
+    )
+
+    for dup in duplicates:
+        records = list(
+            AttendanceRecords.objects.filter(relation_id=dup['relation_id'], date=dup['date'])
+            .order_by('checkin_time', 'id')
+        )
+        keep, others = records[0], records[1:]
+        latest = max(records, key=lambda r: (r.checkout_time, r.id))
+
+        keep.checkout_time = latest.checkout_time
+        keep.checkout_location = latest.checkout_location
+        keep.is_early_leave = latest.is_early_leave
+        keep.early_leave_minutes = latest.early_leave_minutes
+        if keep.checkin_time and keep.checkout_time and keep.checkout_time > keep.checkin_time:
+            hours = (keep.checkout_time - keep.checkin_time).total_seconds() / 3600
+            keep.work_hours = Decimal(str(round(hours, 2)))
+        keep.is_makeup = any(r.is_makeup for r in records)
+        keep.save()
+
+        other_ids = [r.id for r in others]
+        MakeupClockRequest.objects.filter(attendance_record_id__in=other_ids).update(attendance_record_id=keep.id)
+        AttendanceRecords.objects.filter(id__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_attendancerecords_punch_receipt'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_records, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendancerecords',
+            constraint=models.UniqueConstraint(fields=('relation_id', 'date'), name='uniq_attendance_relation_date'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# 冪等鍵：重送的打卡 / 申請請求直接回傳第一次的回應
+# Generated manually
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0011_attendancerecords_unique_relation_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, verbose_name='冪等鍵')),
+                ('request_fingerprint', models.CharField(
+                    help_text='方法、路徑與請求內容的 SHA-256，防止同一個鍵被用於不同請求',
+                    max_length=64,
+                    verbose_name='請求指紋'
+                )),
+                ('status_code', models.PositiveSmallIntegerField(
+                    blank=True,
+                    help_text='空值表示請求處理中',
+                    null=True,
+                    verbose_name='回應狀態碼'
+                )),
+                ('response_body', models.JSONField(
+                    blank=True,
+                    encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    null=True,
+                    verbose_name='回應內容'
+                )),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='到期時間')),
+                ('user', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='idempotency_keys',
+                    to=settings.AUTH_USER_MODEL,
+                    verbose_name='使用者'
+                )),
+            ],
+            options={
+                'verbose_name': '冪等鍵',
+                'verbose_name_plural': '冪等鍵記錄',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencykey',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='uniq_idempotency_user_key'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# 出勤記錄新增打卡座標與距離欄位（供打卡位置稽核查詢）
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0012_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkin_latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='上班打卡緯度'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkin_longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='上班打卡經度'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkin_distance',
+            field=models.FloatField(blank=True, null=True, verbose_name='上班打卡距離（公尺）'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkout_latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='下班打卡緯度'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkout_longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='下班打卡經度'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecords',
+            name='checkout_distance',
+            field=models.FloatField(blank=True, null=True, verbose_name='下班打卡距離（公尺）'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecords',
+            index=models.Index(fields=['date', 'checkin_distance'], name='attendance_checkin_dist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecords',
+            index=models.Index(fields=['date', 'checkout_distance'], name='attendance_checkout_dist_idx'),
+        ),
+    ]
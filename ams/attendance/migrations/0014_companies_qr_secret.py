@@ -0,0 +1,42 @@
+# 公司新增 QR Code 簽章金鑰（資訊站輪替 QR Code）
+# Generated manually
+
+import secrets
+
+import attendance.models
+from django.db import migrations, models
+
+
+def populate_qr_secrets(apps, schema_editor):
+    """既有公司各自產生不同的金鑰"""
+    Companies = apps.get_model('attendance', 'Companies')
+    for company in Companies.objects.filter(qr_secret__isnull=True):
+        company.qr_secret = secrets.token_hex(32)
+        company.save(update_fields=['qr_secret'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0013_attendancerecords_gps_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companies',
+            name='qr_secret',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='QR Code 簽章金鑰'),
+        ),
+        migrations.RunPython(populate_qr_secrets, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='companies',
+            name='qr_secret',
+            field=models.CharField(
+                default=attendance.models.generate_qr_secret,
+                editable=False,
+                help_text='簽署資訊站輪替 QR Code，外洩時可於後台重新產生',
+                max_length=64,
+                verbose_name='QR Code 簽章金鑰'
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# 出勤月統計（增量維護，部署後執行 rebuild_attendance_rollups 建立既有資料）
+# Generated manually
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0014_companies_qr_secret'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceMonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(verbose_name='年度')),
+                ('month', models.IntegerField(verbose_name='月份')),
+                ('days_present', models.IntegerField(default=0, verbose_name='出勤天數')),
+                ('late_count', models.IntegerField(default=0, verbose_name='遲到次數')),
+                ('late_minutes', models.IntegerField(default=0, verbose_name='遲到分鐘數')),
+                ('early_leave_count', models.IntegerField(default=0, verbose_name='早退次數')),
+                ('early_leave_minutes', models.IntegerField(default=0, verbose_name='早退分鐘數')),
+                ('makeup_count', models.IntegerField(default=0, verbose_name='補打卡次數')),
+                ('work_hours', models.DecimalField(decimal_places=2, default=0, max_digits=8, verbose_name='工作時數')),
+                ('leave_hours', models.DecimalField(decimal_places=2, default=0, max_digits=8, verbose_name='已核准請假時數')),
+                ('overtime_hours', models.DecimalField(decimal_places=2, default=0, max_digits=8, verbose_name='已核准加班時數')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('relation_id', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='monthly_rollups',
+                    to='attendance.empcompanyrel',
+                    verbose_name='員工-公司關聯'
+                )),
+            ],
+            options={
+                'verbose_name': '出勤月統計',
+                'verbose_name_plural': '出勤月統計',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='attendancemonthlyrollup',
+            constraint=models.UniqueConstraint(fields=('relation_id', 'year', 'month'), name='uniq_rollup_relation_month'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancemonthlyrollup',
+            index=models.Index(fields=['year', 'month'], name='rollup_period_idx'),
+        ),
+    ]
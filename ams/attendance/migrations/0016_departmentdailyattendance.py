@@ -0,0 +1,42 @@
+# 部門每日出勤計數（主管儀表板）
+# Generated manually
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0015_attendancemonthlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentDailyAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('expected_headcount', models.IntegerField(default=0, verbose_name='應出勤人數')),
+                ('checked_in_count', models.IntegerField(default=0, verbose_name='已打卡人數')),
+                ('late_count', models.IntegerField(default=0, verbose_name='遲到人數')),
+                ('early_leave_count', models.IntegerField(default=0, verbose_name='早退人數')),
+                ('checked_in_relations', models.JSONField(default=list, help_text='已排序的 EmpCompanyRel ID 列表', verbose_name='已打卡關聯 ID')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('department', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='daily_attendance',
+                    to='attendance.departments',
+                    verbose_name='部門'
+                )),
+            ],
+            options={
+                'verbose_name': '部門每日出勤計數',
+                'verbose_name_plural': '部門每日出勤計數',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='departmentdailyattendance',
+            constraint=models.UniqueConstraint(fields=('department', 'date'), name='uniq_department_daily'),
+        ),
+    ]
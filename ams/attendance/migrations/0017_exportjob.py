@@ -0,0 +1,48 @@
+# 背景匯出工作
+# Generated manually
+
+from django.conf import settings
+from django.db import migrations, models
+import django.core.serializers.json
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0016_departmentdailyattendance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('attendance', '出勤記錄'), ('leave', '請假記錄'), ('admin_leave', '請假紀錄（後台）'), ('admin_attendance_and_leave', '出缺勤與請假紀錄（後台）')], max_length=32, verbose_name='匯出內容')),
+                ('export_format', models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel')], max_length=8, verbose_name='格式')),
+                ('params', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='匯出參數')),
+                ('fingerprint', models.CharField(blank=True, help_text='申請人、內容、格式與參數的 SHA-256；僅在等待中或處理中時保留，相同的匯出請求共用同一個工作', max_length=64, null=True, unique=True, verbose_name='去重鍵')),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '處理中'), ('completed', '已完成'), ('failed', '失敗'), ('expired', '已過期')], db_index=True, default='pending', max_length=16, verbose_name='狀態')),
+                ('total_rows', models.PositiveIntegerField(blank=True, null=True, verbose_name='總筆數')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='已處理筆數')),
+                ('file_name', models.CharField(blank=True, max_length=255, verbose_name='檔案名稱')),
+                ('file_size', models.PositiveBigIntegerField(blank=True, null=True, verbose_name='檔案大小')),
+                ('error_message', models.TextField(blank=True, verbose_name='錯誤訊息')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='建立時間')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始時間')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成時間')),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='到期時間')),
+                ('requested_by', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='export_jobs',
+                    to=settings.AUTH_USER_MODEL,
+                    verbose_name='申請人'
+                )),
+            ],
+            options={
+                'verbose_name': '匯出工作',
+                'verbose_name_plural': '匯出工作',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
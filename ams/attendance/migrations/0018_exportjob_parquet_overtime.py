@@ -0,0 +1,24 @@
+# 匯出工作：加班記錄與 Parquet 格式
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0017_exportjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='kind',
+            field=models.CharField(choices=[('attendance', '出勤記錄'), ('leave', '請假記錄'), ('overtime', '加班記錄'), ('admin_leave', '請假紀錄（後台）'), ('admin_attendance_and_leave', '出缺勤與請假紀錄（後台）')], max_length=32, verbose_name='匯出內容'),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='export_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel'), ('parquet', 'Parquet')], max_length=8, verbose_name='格式'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# 出勤異常清單的涵蓋索引
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0018_exportjob_parquet_overtime'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancerecords',
+            index=models.Index(fields=['relation_id', 'date', 'is_late', 'is_early_leave'], name='attendance_anomaly_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# 審批收件匣與待審件數的索引
+# Generated manually
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0019_attendancerecords_anomaly_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='approvalrecords',
+            index=models.Index(fields=['approver_id', 'status', 'created_at'], name='approval_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='overtimeapproval',
+            index=models.Index(fields=['approver_id', 'status', 'created_at'], name='overtime_approval_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='makeupclockapproval',
+            index=models.Index(fields=['approver_id', 'status', 'created_at'], name='makeup_approval_inbox_idx'),
+        ),
+    ]
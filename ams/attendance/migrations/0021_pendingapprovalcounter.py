@@ -0,0 +1,38 @@
+# 審批人待審件數計數表
+# Generated manually
+#
+# 部署後執行一次 `python manage.py reconcile_pending_counters` 建立既有待審記錄的計數。
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0020_approval_inbox_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingApprovalCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leave_count', models.IntegerField(default=0, verbose_name='待審請假')),
+                ('overtime_count', models.IntegerField(default=0, verbose_name='待審加班')),
+                ('makeup_count', models.IntegerField(default=0, verbose_name='待審補打卡')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新時間')),
+                ('approver', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='pending_counter',
+                    to=settings.AUTH_USER_MODEL,
+                    verbose_name='審批人'
+                )),
+            ],
+            options={
+                'verbose_name': '待審件數',
+                'verbose_name_plural': '待審件數',
+            },
+        ),
+    ]
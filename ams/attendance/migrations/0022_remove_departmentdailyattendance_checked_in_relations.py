@@ -0,0 +1,18 @@
+# 部門每日計數改以 F() 累加，已打卡名單由出勤記錄（每人每天唯一）判斷
+# Generated manually
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0021_pendingapprovalcounter'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='departmentdailyattendance',
+            name='checked_in_relations',
+        ),
+    ]
@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
 from datetime import time
 from decimal import Decimal
+import secrets
 
 
 # Phase 3 新增：角色選項
@@ -78,6 +80,22 @@ class Employees(AbstractUser):
         return False
         
 
+class PendingCountedApproval:
+    """
+    審批記錄共用行為：待審件數（PendingApprovalCounter）由 post_save signal 更新，
+    儲存時包在交易中，使審批記錄與計數同時成功或同時回滾
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+
+def generate_qr_secret():
+    """產生公司的 QR Code 簽章金鑰"""
+    return secrets.token_hex(32)
+
+
 class Companies(models.Model):
     name = models.CharField(verbose_name=("公司名稱"), max_length=50)
     # 注意：欄位名為 address（與資料庫匹配），待遷移時改為 location
@@ -92,6 +110,13 @@ class Companies(models.Model):
         help_text="經度範圍：-180 到 180"
     )
     radius = models.FloatField(verbose_name=("GPS合法範圍半徑"), default=2000.0)
+    qr_secret = models.CharField(
+        verbose_name="QR Code 簽章金鑰",
+        max_length=64,
+        default=generate_qr_secret,
+        editable=False,
+        help_text="簽署資訊站輪替 QR Code，外洩時可於後台重新產生"
+    )
 
     class Meta:
         verbose_name_plural = "公司"
@@ -374,16 +399,42 @@ class AttendanceRecords(models.Model):
         default=False,
         help_text="此記錄是否由補打卡產生/修改"
     )
+    punch_receipt = models.CharField(
+        verbose_name="緩衝打卡收據",
+        max_length=48,
+        unique=True,
+        null=True,
+        blank=True,
+        help_text="由打卡緩衝佇列寫入的記錄，對應回傳給 App 的收據編號"
+    )
+
+    # 打卡 GPS 座標與距公司距離（補打卡、尚未下班打卡時為空值）
+    checkin_latitude = models.FloatField(verbose_name="上班打卡緯度", null=True, blank=True)
+    checkin_longitude = models.FloatField(verbose_name="上班打卡經度", null=True, blank=True)
+    checkin_distance = models.FloatField(verbose_name="上班打卡距離（公尺）", null=True, blank=True)
+    checkout_latitude = models.FloatField(verbose_name="下班打卡緯度", null=True, blank=True)
+    checkout_longitude = models.FloatField(verbose_name="下班打卡經度", null=True, blank=True)
+    checkout_distance = models.FloatField(verbose_name="下班打卡距離（公尺）", null=True, blank=True)
 
     class Meta:
         verbose_name_plural = "出缺勤紀錄"
         indexes = [
             models.Index(fields=['relation_id', 'date']),
             models.Index(fields=['is_late']),
+            # 打卡位置稽核（日期區間內距離超過門檻）
+            models.Index(fields=['date', 'checkin_distance'], name='attendance_checkin_dist_idx'),
+            models.Index(fields=['date', 'checkout_distance'], name='attendance_checkout_dist_idx'),
+            # 出勤異常清單：依員工與日期區間掃描，遲到 / 早退旗標由索引直接判斷
+            #（MySQL 不支援部分索引，改以涵蓋旗標的複合索引）
+            models.Index(fields=['relation_id', 'date', 'is_late', 'is_early_leave'], name='attendance_anomaly_idx'),
+        ]
+        constraints = [
+            # 每位員工每天只會有一筆出勤記錄
+            models.UniqueConstraint(fields=['relation_id', 'date'], name='uniq_attendance_relation_date'),
         ]
 
 
-class ApprovalRecords(models.Model):
+class ApprovalRecords(PendingCountedApproval, models.Model):
     """審批記錄表 - Phase 2 Week 4 新增"""
 
     # 審批狀態
@@ -427,6 +478,8 @@ class ApprovalRecords(models.Model):
         indexes = [
             models.Index(fields=['leave_id']),
             models.Index(fields=['approver_id', 'status']),
+            # 審批收件匣：依審批人、狀態篩選並依送出時間排序
+            models.Index(fields=['approver_id', 'status', 'created_at'], name='approval_inbox_idx'),
         ]
 
     def __str__(self):
@@ -661,7 +714,7 @@ class MakeupClockRequest(models.Model):
         return f"{self.relation_id.employee_id.username} - {self.date} - {self.get_makeup_type_display()}"
 
 
-class MakeupClockApproval(models.Model):
+class MakeupClockApproval(PendingCountedApproval, models.Model):
     """補打卡審批記錄 - Phase 1 新增"""
 
     STATUS_CHOICES = [
@@ -701,6 +754,9 @@ class MakeupClockApproval(models.Model):
     class Meta:
         verbose_name_plural = "補打卡審批記錄"
         ordering = ['approval_level', '-created_at']
+        indexes = [
+            models.Index(fields=['approver_id', 'status', 'created_at'], name='makeup_approval_inbox_idx'),
+        ]
 
     def __str__(self):
         return f"補打卡審批 #{self.id} - {self.get_status_display()}"
@@ -822,7 +878,7 @@ class OvertimeRecords(models.Model):
         return f"{self.relation_id.employee_id.username} - {self.date} ({self.overtime_hours}h)"
 
 
-class OvertimeApproval(models.Model):
+class OvertimeApproval(PendingCountedApproval, models.Model):
     """加班審批記錄 - Phase 2 新增"""
 
     STATUS_CHOICES = [
@@ -863,6 +919,9 @@ class OvertimeApproval(models.Model):
         verbose_name = "加班審批記錄"
         verbose_name_plural = "加班審批記錄"
         ordering = ['approval_level', '-created_at']
+        indexes = [
+            models.Index(fields=['approver_id', 'status', 'created_at'], name='overtime_approval_inbox_idx'),
+        ]
 
     def __str__(self):
         return f"審批 #{self.id} - {self.overtime_id} ({self.get_status_display()})"
@@ -926,3 +985,243 @@ class Notifications(models.Model):
     def __str__(self):
         return f"{self.recipient_id.username} - {self.title} ({'已讀' if self.is_read else '未讀'})"
 
+
+
+# =====================================================
+# 冪等鍵（Idempotency-Key）
+# =====================================================
+
+class IdempotencyKey(models.Model):
+    """
+    冪等鍵記錄表
+
+    行動裝置網路不穩時會重送打卡 / 申請請求；帶相同 Idempotency-Key 的重送
+    直接回傳第一次的回應，不重複執行寫入。
+    """
+
+    user = models.ForeignKey(
+        Employees,
+        on_delete=models.CASCADE,
+        verbose_name="使用者",
+        related_name="idempotency_keys"
+    )
+    key = models.CharField(verbose_name="冪等鍵", max_length=64)
+    request_fingerprint = models.CharField(
+        verbose_name="請求指紋",
+        max_length=64,
+        help_text="方法、路徑與請求內容的 SHA-256，防止同一個鍵被用於不同請求"
+    )
+    status_code = models.PositiveSmallIntegerField(
+        verbose_name="回應狀態碼",
+        null=True,
+        blank=True,
+        help_text="空值表示請求處理中"
+    )
+    response_body = models.JSONField(
+        verbose_name="回應內容",
+        null=True,
+        blank=True,
+        encoder=DjangoJSONEncoder
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="建立時間")
+    expires_at = models.DateTimeField(verbose_name="到期時間", db_index=True)
+
+    class Meta:
+        verbose_name = "冪等鍵"
+        verbose_name_plural = "冪等鍵記錄"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='uniq_idempotency_user_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.key}"
+
+
+# =====================================================
+# 出勤月統計（增量維護）
+# =====================================================
+
+class AttendanceMonthlyRollup(models.Model):
+    """
+    員工每月出勤統計
+
+    由打卡、下班打卡、補打卡與請假 / 加班核准時增量更新（attendance.rollups），
+    報表讀取一筆即可，不需掃描當月所有出勤記錄。
+    資料不一致時以 `python manage.py rebuild_attendance_rollups` 重建。
+    """
+
+    relation_id = models.ForeignKey(
+        EmpCompanyRel,
+        on_delete=models.CASCADE,
+        verbose_name="員工-公司關聯",
+        related_name="monthly_rollups"
+    )
+    year = models.IntegerField(verbose_name="年度")
+    month = models.IntegerField(verbose_name="月份")
+    days_present = models.IntegerField(verbose_name="出勤天數", default=0)
+    late_count = models.IntegerField(verbose_name="遲到次數", default=0)
+    late_minutes = models.IntegerField(verbose_name="遲到分鐘數", default=0)
+    early_leave_count = models.IntegerField(verbose_name="早退次數", default=0)
+    early_leave_minutes = models.IntegerField(verbose_name="早退分鐘數", default=0)
+    makeup_count = models.IntegerField(verbose_name="補打卡次數", default=0)
+    work_hours = models.DecimalField(verbose_name="工作時數", max_digits=8, decimal_places=2, default=0)
+    leave_hours = models.DecimalField(verbose_name="已核准請假時數", max_digits=8, decimal_places=2, default=0)
+    overtime_hours = models.DecimalField(verbose_name="已核准加班時數", max_digits=8, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新時間")
+
+    class Meta:
+        verbose_name = "出勤月統計"
+        verbose_name_plural = "出勤月統計"
+        constraints = [
+            models.UniqueConstraint(fields=['relation_id', 'year', 'month'], name='uniq_rollup_relation_month'),
+        ]
+        indexes = [
+            models.Index(fields=['year', 'month'], name='rollup_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.relation_id_id} - {self.year}/{self.month:02d}"
+
+
+class DepartmentDailyAttendance(models.Model):
+    """
+    部門每日出勤計數
+
+    打卡寫入時與月統計一併以 F() 累加（attendance.rollups），主管儀表板讀取一筆即可。
+    當天第一次被打卡或查詢時，由出勤記錄計算初始值建立。出勤記錄每人每天
+    唯一（uniq_relation_date），個別員工是否已打卡直接查詢出勤記錄。
+    """
+
+    department = models.ForeignKey(
+        Departments,
+        on_delete=models.CASCADE,
+        verbose_name="部門",
+        related_name="daily_attendance"
+    )
+    date = models.DateField(verbose_name="日期")
+    expected_headcount = models.IntegerField(verbose_name="應出勤人數", default=0)
+    checked_in_count = models.IntegerField(verbose_name="已打卡人數", default=0)
+    late_count = models.IntegerField(verbose_name="遲到人數", default=0)
+    early_leave_count = models.IntegerField(verbose_name="早退人數", default=0)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新時間")
+
+    class Meta:
+        verbose_name = "部門每日出勤計數"
+        verbose_name_plural = "部門每日出勤計數"
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'date'], name='uniq_department_daily'),
+        ]
+
+    def __str__(self):
+        return f"{self.department_id} - {self.date}"
+
+
+class ExportJob(models.Model):
+    """
+    背景匯出工作
+
+    大量匯出改由背景 worker 產生檔案（attendance.export_jobs），
+    API 查詢進度並於完成後下載；檔案保存 EXPORT_JOB_TTL 秒後清除。
+    """
+
+    KIND_CHOICES = [
+        ('attendance', '出勤記錄'),
+        ('leave', '請假記錄'),
+        ('overtime', '加班記錄'),
+        ('admin_leave', '請假紀錄（後台）'),
+        ('admin_attendance_and_leave', '出缺勤與請假紀錄（後台）'),
+    ]
+
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel'),
+        ('parquet', 'Parquet'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', '等待中'),
+        ('running', '處理中'),
+        ('completed', '已完成'),
+        ('failed', '失敗'),
+        ('expired', '已過期'),
+    ]
+
+    requested_by = models.ForeignKey(
+        Employees,
+        on_delete=models.CASCADE,
+        verbose_name="申請人",
+        related_name="export_jobs"
+    )
+    kind = models.CharField(verbose_name="匯出內容", max_length=32, choices=KIND_CHOICES)
+    export_format = models.CharField(verbose_name="格式", max_length=8, choices=FORMAT_CHOICES)
+    params = models.JSONField(verbose_name="匯出參數", default=dict, encoder=DjangoJSONEncoder)
+    fingerprint = models.CharField(
+        verbose_name="去重鍵",
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        help_text="申請人、內容、格式與參數的 SHA-256；僅在等待中或處理中時保留，相同的匯出請求共用同一個工作"
+    )
+    status = models.CharField(
+        verbose_name="狀態",
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default='pending',
+        db_index=True
+    )
+    total_rows = models.PositiveIntegerField(verbose_name="總筆數", null=True, blank=True)
+    processed_rows = models.PositiveIntegerField(verbose_name="已處理筆數", default=0)
+    file_name = models.CharField(verbose_name="檔案名稱", max_length=255, blank=True)
+    file_size = models.PositiveBigIntegerField(verbose_name="檔案大小", null=True, blank=True)
+    error_message = models.TextField(verbose_name="錯誤訊息", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="建立時間")
+    started_at = models.DateTimeField(verbose_name="開始時間", null=True, blank=True)
+    finished_at = models.DateTimeField(verbose_name="完成時間", null=True, blank=True)
+    expires_at = models.DateTimeField(verbose_name="到期時間", null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = "匯出工作"
+        verbose_name_plural = "匯出工作"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"#{self.id} {self.get_kind_display()} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        """進度百分比（尚未計算總筆數時為 None）"""
+        if self.status == 'completed':
+            return 100
+        if not self.total_rows:
+            return None if self.total_rows is None else 0
+        return min(100, self.processed_rows * 100 // self.total_rows)
+
+
+class PendingApprovalCounter(models.Model):
+    """
+    審批人待審件數
+
+    審批記錄新增、狀態或審批人異動、刪除時增量更新（attendance.pending_counters），
+    主管儀表板與待審徽章讀取一筆即可，不需每次 COUNT 三張審批表。
+    資料不一致時以 `python manage.py reconcile_pending_counters` 修正。
+    """
+
+    approver = models.OneToOneField(
+        Employees,
+        on_delete=models.CASCADE,
+        verbose_name="審批人",
+        related_name="pending_counter",
+        to_field="employee_id"
+    )
+    leave_count = models.IntegerField(verbose_name="待審請假", default=0)
+    overtime_count = models.IntegerField(verbose_name="待審加班", default=0)
+    makeup_count = models.IntegerField(verbose_name="待審補打卡", default=0)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新時間")
+
+    class Meta:
+        verbose_name = "待審件數"
+        verbose_name_plural = "待審件數"
+
+    def __str__(self):
+        return f"{self.approver_id} ({self.leave_count}/{self.overtime_count}/{self.makeup_count})"
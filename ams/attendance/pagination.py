@@ -0,0 +1,74 @@
+"""
+Keyset（cursor）分頁
+
+以上一頁最後一筆的排序欄位值作為游標，下一頁以
+WHERE (date, id) < (上一頁最後的 date, id) 取代 OFFSET，查詢成本與頁數無關，
+翻頁期間新增的資料也不會造成重複或遺漏。
+
+游標為排序欄位值（JSON 陣列）的 URL-safe base64 編碼，對前端不透明。
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """游標格式錯誤"""
+
+
+def encode_cursor(values):
+    """將排序欄位值編碼為游標"""
+    payload = json.dumps(list(values), default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """
+    解碼游標
+
+    Args:
+        cursor: encode_cursor 產生的字串
+        size: 排序欄位數
+
+    Returns:
+        list: 排序欄位值（日期等型別為字串，需由呼叫端轉換）
+
+    Raises:
+        InvalidCursor: 格式錯誤
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def keyset_filter(fields, values, descending=True):
+    """
+    排序位置在游標之後的條件
+
+    例如 fields=('date', 'id')、descending=True：
+        date < d OR (date = d AND id < i)
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for index, field in enumerate(fields):
+        equal = {fields[i]: values[i] for i in range(index)}
+        condition |= Q(**equal, **{f'{field}__{lookup}': values[index]})
+    return condition
+
+
+def parse_limit(value, default, maximum):
+    """每頁筆數（無效時使用預設值，超過上限時取上限）"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    if limit < 1:
+        return default
+    return min(limit, maximum)
@@ -0,0 +1,181 @@
+"""
+審批人待審件數（PendingApprovalCounter）的增量維護
+
+審批記錄載入時（post_init）記住「目前計入哪位審批人的待審件數」，
+儲存（post_save）或刪除（post_delete）時與新狀態比較，只以 F() 累加差額：
+
+- 新增待審記錄：審批人 +1
+- 狀態由 pending 改為其他：原審批人 -1
+- 待審記錄改派審批人：原審批人 -1、新審批人 +1
+
+審批記錄的 save() 包在交易中（models.PendingCountedApproval），計數與記錄一併提交或回滾。
+bulk_update 與 QuerySet.update 不會觸發 signals，呼叫端需自行呼叫 sync() 或 adjust()。
+資料不一致時以 `python manage.py reconcile_pending_counters` 修正（reconcile()）。
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import ApprovalRecords, MakeupClockApproval, OvertimeApproval, PendingApprovalCounter
+
+
+# 類型 → 計數欄位
+FIELDS = {
+    'leave': 'leave_count',
+    'overtime': 'overtime_count',
+    'makeup': 'makeup_count',
+}
+
+MODEL_TYPES = {
+    ApprovalRecords: 'leave',
+    OvertimeApproval: 'overtime',
+    MakeupClockApproval: 'makeup',
+}
+
+# 記錄目前計入的審批人（None 表示不計入）
+_COUNTED = '_pending_counted_approver'
+
+
+def _counted(instance):
+    """此審批記錄應計入的審批人"""
+    return instance.approver_id_id if instance.status == 'pending' else None
+
+
+def remember(instance):
+    """記住目前計入的審批人（post_init；延遲載入的欄位不觸發查詢）"""
+    if 'status' in instance.__dict__ and 'approver_id_id' in instance.__dict__:
+        setattr(instance, _COUNTED, _counted(instance))
+
+
+def _diff(instance, deltas, created=False, deleted=False):
+    if not created and not hasattr(instance, _COUNTED):
+        # 以 only() / defer() 載入且未含狀態欄位，無法得知原狀態，交由 reconcile 修正
+        return
+    item_type = MODEL_TYPES[type(instance)]
+    before = None if created else getattr(instance, _COUNTED)
+    after = None if deleted else _counted(instance)
+    if before != after:
+        if before:
+            deltas[(before, item_type)] = deltas.get((before, item_type), 0) - 1
+        if after:
+            deltas[(after, item_type)] = deltas.get((after, item_type), 0) + 1
+    setattr(instance, _COUNTED, after)
+
+
+def record_save(instance, created=False):
+    """審批記錄儲存後（post_save）"""
+    deltas = {}
+    _diff(instance, deltas, created=created)
+    adjust(deltas)
+
+
+def record_delete(instance):
+    """審批記錄刪除後（post_delete）"""
+    deltas = {}
+    _diff(instance, deltas, deleted=True)
+    adjust(deltas)
+
+
+def sync(instances):
+    """bulk_update 之後，依各筆記錄載入時與目前的狀態更新計數（同一審批人合併為一次更新）"""
+    deltas = {}
+    for instance in instances:
+        _diff(instance, deltas)
+    adjust(deltas)
+
+
+def adjust(deltas):
+    """
+    以 F() 累加差額；計數列不存在時建立
+
+    計數列不存在表示件數皆為 0，只以正差額建立；全為負差額時略過（例如審批人
+    刪除時連鎖刪除其審批記錄，計數列已隨審批人刪除）。
+
+    Args:
+        deltas: {(審批人員工編號, 類型): 差額}
+    """
+    by_approver = {}
+    for (approver_id, item_type), delta in deltas.items():
+        if delta:
+            values = by_approver.setdefault(approver_id, {})
+            values[FIELDS[item_type]] = values.get(FIELDS[item_type], 0) + delta
+
+    for approver_id, values in by_approver.items():
+        updates = {name: F(name) + value for name, value in values.items()}
+        updates['updated_at'] = timezone.now()
+        if PendingApprovalCounter.objects.filter(approver_id=approver_id).update(**updates):
+            continue
+        initial = {name: value for name, value in values.items() if value > 0}
+        if not initial:
+            continue
+        try:
+            with transaction.atomic():
+                PendingApprovalCounter.objects.create(approver_id=approver_id, **initial)
+        except IntegrityError:
+            # 同時有其他請求建立了同一列
+            PendingApprovalCounter.objects.filter(approver_id=approver_id).update(**updates)
+
+
+def pending_counts(employee_ids):
+    """
+    各審批人的待審件數（讀取計數表，一次查詢）
+
+    Returns:
+        dict: {employee_id: {'leave': 件數, 'overtime': 件數, 'makeup': 件數}}
+    """
+    counts = {employee_id: dict.fromkeys(FIELDS, 0) for employee_id in employee_ids}
+    for row in PendingApprovalCounter.objects.filter(approver_id__in=counts).values('approver_id', *FIELDS.values()):
+        # 計數偏差時不顯示負數（以 reconcile 修正）
+        counts[row['approver_id']] = {item_type: max(row[field], 0) for item_type, field in FIELDS.items()}
+    return counts
+
+
+def actual_counts():
+    """
+    以審批表重新計算各審批人的待審件數（每種審批一次 GROUP BY）
+
+    Returns:
+        dict: {employee_id: {'leave_count': 件數, ...}}
+    """
+    counts = {}
+    for model, item_type in MODEL_TYPES.items():
+        rows = model.objects.filter(status='pending').order_by().values('approver_id').annotate(count=Count('id'))
+        for row in rows:
+            counts.setdefault(row['approver_id'], dict.fromkeys(FIELDS.values(), 0))[FIELDS[item_type]] = row['count']
+    return counts
+
+
+def reconcile():
+    """
+    以審批表修正計數表
+
+    在同一交易中鎖定既有計數列後重新計算，期間的累加會等待交易完成。
+
+    Returns:
+        int: 修正（含新建、歸零）的計數列數
+    """
+    fixed = 0
+    with transaction.atomic():
+        counters = {counter.approver_id: counter for counter in PendingApprovalCounter.objects.select_for_update()}
+        expected = actual_counts()
+        now = timezone.now()
+
+        changed = []
+        for approver_id, counter in counters.items():
+            values = expected.pop(approver_id, dict.fromkeys(FIELDS.values(), 0))
+            if any(getattr(counter, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(counter, field, value)
+                counter.updated_at = now
+                changed.append(counter)
+        PendingApprovalCounter.objects.bulk_update(changed, [*FIELDS.values(), 'updated_at'])
+        fixed += len(changed)
+
+        # 尚無計數列的審批人
+        missing = [
+            PendingApprovalCounter(approver_id=approver_id, **values)
+            for approver_id, values in expected.items()
+        ]
+        PendingApprovalCounter.objects.bulk_create(missing)
+        fixed += len(missing)
+    return fixed
@@ -0,0 +1,75 @@
+"""
+當日已打卡名單（程序層級）
+
+記錄今天已經上班打卡的關聯 ID，重複打卡（連按、網路重送）
+可直接在記憶體中判定 ALREADY_CLOCKED_IN，不必查詢資料庫。
+
+此名單只作為快速判定：名單中沒有的關聯仍會嘗試寫入，
+由 AttendanceRecords 的 (relation_id, date) 唯一約束做最終把關。
+
+名單是程序層級的，其他 worker 或後台刪除、合併記錄時本程序不會收到
+通知，因此名單命中只是提示：拒絕打卡前以 is_clocked_in() 向資料庫
+（及緩衝佇列）確認，確認不到時移出名單。
+"""
+import threading
+
+
+class DailyPresence:
+    """單日已打卡的關聯 ID 集合，跨日自動清空"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._relation_ids = set()
+
+    def _roll(self, day):
+        # 呼叫前須持有 self._lock
+        if day != self._day:
+            self._day = day
+            self._relation_ids = set()
+
+    def contains(self, relation_id, day):
+        """是否已知該關聯在 day 已打卡"""
+        with self._lock:
+            return day == self._day and int(relation_id) in self._relation_ids
+
+    def add(self, relation_id, day):
+        """記錄該關聯在 day 已打卡（只保留最新的一天）"""
+        with self._lock:
+            if self._day is not None and day < self._day:
+                return
+            self._roll(day)
+            self._relation_ids.add(int(relation_id))
+
+    def is_clocked_in(self, relation_id, day):
+        """
+        該關聯在 day 是否已打卡（名單命中時向資料庫確認）
+
+        Returns:
+            bool: 名單未命中時為 False，不查詢資料庫
+        """
+        if not self.contains(relation_id, day):
+            return False
+
+        from .models import AttendanceRecords
+        from .punch_queue import punch_queue
+
+        if (AttendanceRecords.objects.filter(relation_id=relation_id, date=day).exists()
+                or punch_queue.has_pending(relation_id, day)):
+            return True
+        # 記錄已被其他程序刪除或合併
+        self.discard(relation_id, day)
+        return False
+
+    def discard(self, relation_id, day):
+        """出勤記錄被刪除時移除"""
+        with self._lock:
+            if day == self._day:
+                self._relation_ids.discard(int(relation_id))
+
+    def __len__(self):
+        return len(self._relation_ids)
+
+
+# 程序層級的共用名單
+daily_presence = DailyPresence()
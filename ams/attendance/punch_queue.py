@@ -0,0 +1,411 @@
+"""
+打卡緩衝佇列（write-behind）
+
+上班尖峰時段（08:55–09:05）大量打卡同時寫入資料庫，容易耗盡連線數。
+啟用 PUNCH_QUEUE_ENABLED 後，clock_in 在完成 QR Code 與 GPS 驗證後
+只將打卡寫入本機的追加式日誌（fsync 後才回應），並立即回傳收據編號；
+背景 flusher 再批次計算遲到並以 bulk_create 寫入 AttendanceRecords。
+
+檔案配置（PUNCH_QUEUE_DIR）：
+- queue.log                 目前寫入中的日誌（每行一筆 JSON）
+- flushing-<序號>.log       已被 flusher 取走、尚待寫入資料庫的區段
+- rejected-<YYYYMMDD>.log   寫入時被拒絕的收據（重複打卡、無效關聯）
+- flush.lock                確保同一時間只有一個 flusher 在處理
+
+程序當機後殘留的 flushing-*.log 會在下一次 flush 時一併處理；
+已寫入資料庫的收據（AttendanceRecords.punch_receipt）會被略過，
+因此重複處理同一區段是安全的。
+
+收據查詢不重新讀取整份日誌：每個程序記住各日誌檔（以 inode 識別，
+改名為區段後不變）已讀取的位置與其中的收據，每次查詢只讀取新追加的
+內容；區段刪除後一併移除。
+"""
+import fcntl
+import glob
+import json
+import os
+import threading
+import time as _time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .punches import build_checkin, insert_checkins
+from .schedules import schedule_resolver
+
+
+ACTIVE_LOG = 'queue.log'
+SEGMENT_PATTERN = 'flushing-*.log'
+REJECTED_PATTERN = 'rejected-*.log'
+FLUSH_LOCK = 'flush.lock'
+
+# 被拒絕收據的保留天數
+REJECTED_RETENTION_DAYS = 7
+
+
+class PunchQueue:
+    """以本機追加式日誌實作的打卡緩衝佇列"""
+
+    def __init__(self, directory=None):
+        self._directory = directory
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        # 待寫入收據索引：inode -> {'head': 第一行, 'offset': 已讀位置, 'receipts': {收據: 關聯 ID}}
+        self._index_lock = threading.Lock()
+        self._logs = {}
+        self._pending = Counter()  # (關聯 ID, YYYYMMDD) -> 待寫入筆數
+
+    # ---------- 設定 ----------
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'PUNCH_QUEUE_ENABLED', False)
+
+    @property
+    def directory(self):
+        directory = self._directory or getattr(settings, 'PUNCH_QUEUE_DIR', None)
+        if not directory:
+            directory = os.path.join(settings.BASE_DIR, 'var', 'punch_queue')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # ---------- 寫入 ----------
+
+    def enqueue(self, relation_id, punch_time, location, distance=None):
+        """
+        將已驗證的上班打卡寫入日誌
+
+        Args:
+            relation_id: 員工-公司關聯 ID
+            punch_time: 打卡時間（後端產生）
+            location: 打卡位置字串（"lat, lng"）
+            distance: 與公司的距離（公尺）
+
+        Returns:
+            str: 收據編號（YYYYMMDD-<uuid>）
+        """
+        receipt = f"{punch_time:%Y%m%d}-{uuid.uuid4().hex}"
+        entry = {
+            'receipt': receipt,
+            'relation_id': int(relation_id),
+            'punch_time': punch_time.isoformat(),
+            'location': location,
+            'distance': distance,
+        }
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+
+        path = self._path(ACTIVE_LOG)
+        while True:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                # 取得鎖之前檔案可能已被 flusher 改名，此時須重新開啟新的日誌
+                try:
+                    if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+                os.write(fd, line)
+                os.fsync(fd)
+                break
+            finally:
+                os.close(fd)
+
+        self.ensure_flusher()
+        return receipt
+
+    # ---------- 查詢 ----------
+
+    def status(self, receipt):
+        """
+        查詢收據狀態
+
+        Returns:
+            dict: {'status': committed / rejected / pending / unknown, 'relation_id': 關聯 ID, ...}
+        """
+        from .models import AttendanceRecords
+
+        record = AttendanceRecords.objects.filter(punch_receipt=receipt).values(
+            'id', 'relation_id', 'date', 'checkin_time', 'is_late', 'late_minutes'
+        ).first()
+        if record:
+            return {'status': 'committed', 'relation_id': record['relation_id'], 'record': record}
+
+        rejection = self._find_rejection(receipt)
+        if rejection:
+            return {
+                'status': 'rejected', 'relation_id': rejection['relation_id'],
+                'code': rejection['code'], 'message': rejection['message']
+            }
+
+        with self._index_lock:
+            self._refresh_index()
+            for log in self._logs.values():
+                if receipt in log['receipts']:
+                    return {'status': 'pending', 'relation_id': log['receipts'][receipt]}
+
+        return {'status': 'unknown'}
+
+    def _find_rejection(self, receipt):
+        day = receipt.split('-', 1)[0]
+        for entry in self._read_entries(self._path(f'rejected-{day}.log')):
+            if entry.get('receipt') == receipt:
+                return entry
+        return None
+
+    def pending_count(self):
+        """尚未寫入資料庫的打卡筆數"""
+        with self._index_lock:
+            self._refresh_index()
+            return sum(len(log['receipts']) for log in self._logs.values())
+
+    def has_pending(self, relation_id, day):
+        """該關聯在 day 是否有尚未寫入資料庫的打卡"""
+        if not self.enabled:
+            return False
+        with self._index_lock:
+            self._refresh_index()
+            return self._pending[(int(relation_id), f"{day:%Y%m%d}")] > 0
+
+    def _refresh_index(self):
+        """讀取各日誌新追加的內容；呼叫前須持有 self._index_lock"""
+        paths = [self._path(ACTIVE_LOG)] + glob.glob(self._path(SEGMENT_PATTERN))
+        current = set()
+        for path in paths:
+            try:
+                with open(path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    inode = (stat.st_dev, stat.st_ino)
+                    log = self._logs.get(inode)
+                    # inode 可能在區段刪除後被新檔案重用，以第一行確認是同一份日誌
+                    if log is not None and f.readline() != log['head']:
+                        self._drop_log(inode)
+                        log = None
+                    if log is None:
+                        f.seek(0)
+                        log = self._logs[inode] = {'head': f.readline(), 'offset': 0, 'receipts': {}}
+                    f.seek(log['offset'])
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            current.add(inode)
+
+            # 只處理完整的行，寫入中的最後一行留待下次讀取
+            complete = data[:data.rfind(b'\n') + 1]
+            log['offset'] += len(complete)
+            for line in complete.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                log['receipts'][entry['receipt']] = entry['relation_id']
+                self._pending[(entry['relation_id'], entry['receipt'].split('-', 1)[0])] += 1
+
+        # 已刪除的區段
+        for inode in set(self._logs) - current:
+            self._drop_log(inode)
+
+    def _drop_log(self, inode):
+        for receipt, relation_id in self._logs.pop(inode)['receipts'].items():
+            key = (relation_id, receipt.split('-', 1)[0])
+            self._pending[key] -= 1
+            if self._pending[key] <= 0:
+                del self._pending[key]
+
+    @staticmethod
+    def _read_entries(path):
+        """讀取日誌；寫入中斷造成的不完整行會被略過"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    # ---------- 寫入資料庫 ----------
+
+    def _claim_active_log(self):
+        """將目前的日誌改名為待處理區段，新的打卡會寫入新的 queue.log"""
+        path = self._path(ACTIVE_LOG)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size == 0:
+                return None
+            segment = self._path(f'flushing-{_time.time_ns()}.log')
+            os.rename(path, segment)
+            return segment
+        except FileNotFoundError:
+            return None
+        finally:
+            os.close(fd)
+
+    def flush(self):
+        """
+        將日誌中的打卡寫入資料庫
+
+        Returns:
+            dict: {'committed': 寫入筆數, 'rejected': 拒絕筆數}；
+            其他 flusher 正在處理時回傳 None
+        """
+        lock_fd = os.open(self._path(FLUSH_LOCK), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            self._claim_active_log()
+
+            totals = {'committed': 0, 'rejected': 0}
+            # 依序處理（包含先前當機殘留的區段）
+            for segment in sorted(glob.glob(self._path(SEGMENT_PATTERN))):
+                result = self._flush_segment(segment)
+                totals['committed'] += result['committed']
+                totals['rejected'] += result['rejected']
+                os.remove(segment)
+
+            self._purge_rejections()
+            return totals
+        finally:
+            os.close(lock_fd)
+
+    def _flush_segment(self, segment):
+        from .models import AttendanceRecords, EmpCompanyRel
+
+        entries = self._read_entries(segment)
+        if not entries:
+            return {'committed': 0, 'rejected': 0}
+
+        # 已寫入的收據（寫入後、刪除區段前當機的情況）
+        receipts = [e['receipt'] for e in entries]
+        committed = set(
+            AttendanceRecords.objects.filter(punch_receipt__in=receipts)
+            .values_list('punch_receipt', flat=True)
+        )
+        entries = [e for e in entries if e['receipt'] not in committed]
+        for entry in entries:
+            entry['punch_time'] = datetime.fromisoformat(entry['punch_time'])
+
+        # 一次取回關聯與班表
+        relation_ids = {e['relation_id'] for e in entries}
+        relations = EmpCompanyRel.objects.in_bulk(relation_ids)
+        schedules = schedule_resolver.resolve_many(relations.values())
+
+        # 已存在的打卡（同一員工同一天只允許一筆）
+        dates = {e['punch_time'].date() for e in entries}
+        clocked_in = set(
+            AttendanceRecords.objects.filter(relation_id__in=relation_ids, date__in=dates)
+            .values_list('relation_id', 'date')
+        )
+
+        records = []
+        rejections = []
+        for entry in entries:
+            relation = relations.get(entry['relation_id'])
+            punch_time = entry['punch_time']
+            today = punch_time.date()
+
+            if relation is None:
+                rejections.append(_rejection(entry, 'RELATION_NOT_FOUND', '無效的員工關聯'))
+                continue
+            if (relation.id, today) in clocked_in:
+                rejections.append(_rejection(entry, 'ALREADY_CLOCKED_IN', '今天已經打過卡'))
+                continue
+            clocked_in.add((relation.id, today))
+
+            records.append(build_checkin(
+                relation,
+                schedules[relation.id],
+                punch_time,
+                entry['location'],
+                distance=entry.get('distance'),
+                punch_receipt=entry['receipt'],
+            ))
+
+        records, conflicts = insert_checkins(records)
+        # 期間有其他途徑（補打卡等）寫入同一天的記錄
+        rejections.extend(
+            {'receipt': r.punch_receipt, 'relation_id': r.relation_id_id,
+             'code': 'ALREADY_CLOCKED_IN', 'message': '今天已經打過卡'}
+            for r in conflicts
+        )
+
+        self._record_rejections(rejections)
+        return {'committed': len(records), 'rejected': len(rejections)}
+
+    def _record_rejections(self, rejections):
+        by_day = {}
+        for rejection in rejections:
+            by_day.setdefault(rejection['receipt'].split('-', 1)[0], []).append(rejection)
+
+        for day, items in by_day.items():
+            existing = {e.get('receipt') for e in self._read_entries(self._path(f'rejected-{day}.log'))}
+            lines = ''.join(
+                json.dumps(item, ensure_ascii=False) + '\n'
+                for item in items if item['receipt'] not in existing
+            )
+            if lines:
+                with open(self._path(f'rejected-{day}.log'), 'a', encoding='utf-8') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def _purge_rejections(self):
+        cutoff = (timezone.now() - timedelta(days=REJECTED_RETENTION_DAYS)).strftime('%Y%m%d')
+        for path in glob.glob(self._path(REJECTED_PATTERN)):
+            day = os.path.basename(path)[len('rejected-'):-len('.log')]
+            if day < cutoff:
+                os.remove(path)
+
+    # ---------- 背景 flusher ----------
+
+    def ensure_flusher(self):
+        """啟動本程序的背景 flusher（若尚未啟動）"""
+        if not getattr(settings, 'PUNCH_QUEUE_IN_PROCESS_FLUSHER', True):
+            return
+        with self._flusher_lock:
+            if self._flusher and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(
+                target=self._run_flusher, name='punch-queue-flusher', daemon=True
+            )
+            self._flusher.start()
+
+    def _run_flusher(self):
+        interval = getattr(settings, 'PUNCH_QUEUE_FLUSH_INTERVAL', 2.0)
+        while True:
+            _time.sleep(interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"打卡緩衝寫入錯誤: {str(e)}")
+            finally:
+                close_old_connections()
+
+
+def _rejection(entry, code, message):
+    return {'receipt': entry['receipt'], 'relation_id': entry['relation_id'], 'code': code, 'message': message}
+
+
+# 程序層級的共用佇列
+punch_queue = PunchQueue()
@@ -0,0 +1,113 @@
+"""
+上班打卡記錄的建立與批次寫入
+
+供打卡緩衝佇列、資訊站批次打卡等批次寫入路徑共用。
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from .models import AttendanceRecords
+from .presence import daily_presence
+from .report_cache import report_cache
+from .rollups import add_attendance_records
+from .utils import evaluate_lateness, parse_location
+
+
+# bulk_create 每批筆數
+BULK_BATCH_SIZE = 500
+
+
+def build_checkin(relation, schedule, punch_time, location, distance=None, **extra):
+    """
+    建立（尚未寫入的）上班打卡記錄，並依班表判定遲到
+
+    Args:
+        relation: EmpCompanyRel 實例
+        schedule: 適用班表（可為 None）
+        punch_time: 上班打卡時間
+        location: 打卡位置字串（"lat, lng"）
+        distance: 與公司的距離（公尺）
+        **extra: 其他 AttendanceRecords 欄位
+
+    Returns:
+        AttendanceRecords: 未儲存的記錄
+    """
+    work_date = punch_time.date()
+    is_late, late_minutes = evaluate_lateness(schedule, punch_time, work_date)
+    latitude, longitude = parse_location(location)
+
+    return AttendanceRecords(
+        relation_id=relation,
+        date=work_date,
+        checkin_time=punch_time,
+        checkout_time=punch_time,  # 初始設定為相同時間
+        checkin_location=location,
+        checkout_location=location,
+        checkin_latitude=latitude,
+        checkin_longitude=longitude,
+        checkin_distance=distance,
+        work_hours=Decimal('0.00'),
+        schedule=schedule,
+        is_late=is_late,
+        late_minutes=late_minutes,
+        **extra
+    )
+
+
+def insert_checkins(records):
+    """
+    批次寫入上班打卡記錄
+
+    先以單次 bulk_create 寫入；若與既有記錄衝突（(relation_id, date) 唯一約束），
+    改為逐筆寫入並回報衝突的記錄。月統計與記錄在同一個交易中更新。
+
+    Returns:
+        tuple: (已寫入的記錄, 衝突的記錄)
+    """
+    try:
+        with transaction.atomic():
+            AttendanceRecords.objects.bulk_create(records, batch_size=BULK_BATCH_SIZE)
+            add_attendance_records(records)
+            # bulk_create 不會觸發 post_save
+            report_cache.invalidate_records((record.relation_id_id, record.date) for record in records)
+        created, conflicts = list(records), []
+        _fill_primary_keys(created)
+    except IntegrityError:
+        created, conflicts = [], []
+        for record in records:
+            # bulk_create 回滾前可能已設定主鍵
+            record.pk = None
+            record._state.adding = True
+            try:
+                with transaction.atomic():
+                    record.save(force_insert=True)
+                    add_attendance_records([record])
+                created.append(record)
+            except IntegrityError:
+                conflicts.append(record)
+
+    for record in created:
+        daily_presence.add(record.relation_id_id, record.date)
+    for record in conflicts:
+        daily_presence.add(record.relation_id_id, record.date)
+
+    return created, conflicts
+
+
+def _fill_primary_keys(records):
+    """MySQL 的 bulk_create 不會回填主鍵，改以 (relation_id, date) 查回"""
+    missing = [record for record in records if record.pk is None]
+    if not missing:
+        return
+
+    ids = {
+        (relation_id, work_date): pk
+        for pk, relation_id, work_date in AttendanceRecords.objects.filter(
+            relation_id__in={r.relation_id_id for r in missing},
+            date__in={r.date for r in missing},
+        ).values_list('id', 'relation_id', 'date')
+    }
+    for record in missing:
+        record.pk = ids.get((record.relation_id_id, record.date))
+        record._state.adding = False
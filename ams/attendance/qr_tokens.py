@@ -0,0 +1,97 @@
+"""
+資訊站輪替 QR Code（HMAC 簽章）
+
+印出的靜態 QR Code 內含公司座標，任何人拍照即可重複使用。
+資訊站改為顯示每 QR_TOKEN_WINDOW_SECONDS 秒更換一次的權杖：
+
+    v1.<company_id>.<時間窗>.<簽章>
+
+簽章為 HMAC-SHA256(公司 qr_secret, "v1.<company_id>.<時間窗>")。
+驗證時從記憶體地理圍欄索引取得公司（含金鑰），以 compare_digest
+比對簽章，打卡時不需查詢 Companies。為吸收掃描與網路延遲，
+前 QR_TOKEN_GRACE_WINDOWS 個時間窗的權杖仍視為有效。
+"""
+import hashlib
+import hmac
+import time as _time
+
+from django.conf import settings
+
+from .geofence import geofence_index
+
+
+TOKEN_VERSION = 'v1'
+
+# 權杖更換週期（秒）
+WINDOW_SECONDS = getattr(settings, 'QR_TOKEN_WINDOW_SECONDS', 30)
+
+# 過期後仍接受的時間窗數
+GRACE_WINDOWS = getattr(settings, 'QR_TOKEN_GRACE_WINDOWS', 1)
+
+# QR Code 內容類型（與 CompaniesAdmin.download_qrcode 的靜態 QR Code 區分）
+QR_PAYLOAD_TYPE = 'attendance_clock_token'
+
+
+class InvalidQRToken(Exception):
+    """權杖無效或已過期"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def current_window(now=None):
+    """目前的時間窗編號"""
+    return int((now if now is not None else _time.time()) // WINDOW_SECONDS)
+
+
+def _sign(secret, company_id, window):
+    message = f"{TOKEN_VERSION}.{company_id}.{window}".encode('utf-8')
+    return hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()[:32]
+
+
+def issue_token(site, now=None):
+    """
+    產生公司目前時間窗的權杖
+
+    Args:
+        site: geofence.Site（需含 qr_secret）
+        now: UNIX 時間（秒），測試用
+
+    Returns:
+        tuple: (權杖, 本時間窗結束的 UNIX 時間)
+    """
+    window = current_window(now)
+    token = f"{TOKEN_VERSION}.{site.id}.{window}.{_sign(site.qr_secret, site.id, window)}"
+    return token, (window + 1) * WINDOW_SECONDS
+
+
+def verify_token(token, now=None):
+    """
+    驗證權杖並回傳對應的公司
+
+    Returns:
+        geofence.Site
+
+    Raises:
+        InvalidQRToken: 格式錯誤、簽章不符（INVALID_QR_CODE）或已過期（QR_CODE_EXPIRED）
+    """
+    try:
+        version, company_id, window, signature = str(token).split('.')
+        company_id, window = int(company_id), int(window)
+    except ValueError:
+        raise InvalidQRToken('INVALID_QR_CODE', '無效的 QR Code')
+
+    site = geofence_index.get(company_id)
+    if version != TOKEN_VERSION or site is None or not site.qr_secret:
+        raise InvalidQRToken('INVALID_QR_CODE', '無效的 QR Code')
+
+    if not hmac.compare_digest(signature, _sign(site.qr_secret, company_id, window)):
+        raise InvalidQRToken('INVALID_QR_CODE', '無效的 QR Code')
+
+    latest = current_window(now)
+    if window > latest or window < latest - GRACE_WINDOWS:
+        raise InvalidQRToken('QR_CODE_EXPIRED', 'QR Code 已過期，請重新掃描')
+
+    return site
@@ -0,0 +1,172 @@
+"""
+報表結果快取
+
+報表 API（出勤摘要、異常清單、部門報表、主管儀表板）以
+(endpoint, 範圍, 期間與參數) 為鍵，將回應資料存入 Django cache。
+
+每筆快取附帶依賴標籤（tag）的版本；出勤、請假、加班記錄異動時，由
+signals 更新受影響標籤的版本，讀取時版本不符即視為失效：
+
+- emp:<員工編號>:<YYYY-MM> / emp:<員工編號>：個人報表（單月 / 不限月份）
+- dept:<部門 ID|none>:<YYYY-MM> / dept:<部門 ID|none>:<YYYY-MM-DD>：部門報表、儀表板
+- all:<YYYY-MM> / all:<YYYY-MM-DD>：HR / CEO 的全公司範圍
+- org：員工、部門、任職關聯異動（影響報表涵蓋的人員）
+
+已結束的期間保存 REPORT_CACHE_CLOSED_TTL 秒（預設 30 天），
+進行中的期間保存 REPORT_CACHE_TTL 秒（預設 5 分鐘）。LocMemCache 的
+標籤失效無法通知其他程序，已結束的期間同樣只保存 REPORT_CACHE_TTL 秒。
+標籤版本於交易提交後才更新，避免讀到未提交資料的結果被快取。
+"""
+import hashlib
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import EmpCompanyRel
+
+
+# 使用的快取（settings.CACHES 的別名）
+CACHE_ALIAS = getattr(settings, 'REPORT_CACHE_ALIAS', 'default')
+
+# 進行中期間的保存秒數（標籤失效為主，TTL 為保險）
+OPEN_PERIOD_TTL = getattr(settings, 'REPORT_CACHE_TTL', 5 * 60)
+
+# 已結束期間的保存秒數（只用於共用快取）
+CLOSED_PERIOD_TTL = getattr(settings, 'REPORT_CACHE_CLOSED_TTL', 30 * 24 * 60 * 60)
+
+KEY_PREFIX = 'report'
+
+# 所有快取共用的標籤，用於整體清除
+GLOBAL_TAG = 'global'
+
+
+def month_period(day):
+    return f"{day:%Y-%m}"
+
+
+def day_period(day):
+    return f"{day:%Y-%m-%d}"
+
+
+def employee_tag(employee_id, period=None):
+    return f"emp:{employee_id}:{period}" if period else f"emp:{employee_id}"
+
+
+def department_tag(department_id, period):
+    return f"dept:{department_id if department_id is not None else 'none'}:{period}"
+
+
+class ReportCache:
+    """以標籤版本失效的報表快取"""
+
+    def __init__(self, alias=CACHE_ALIAS):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def closed_period_ttl(self):
+        """已結束期間的保存秒數；LocMemCache 無法跨程序失效，與進行中期間相同"""
+        if isinstance(self.cache, LocMemCache):
+            return OPEN_PERIOD_TTL
+        return CLOSED_PERIOD_TTL
+
+    def _tag_key(self, tag):
+        return f"{KEY_PREFIX}:tag:{tag}"
+
+    def _entry_key(self, endpoint, scope, params):
+        digest = hashlib.sha1(repr(params).encode('utf-8')).hexdigest()
+        return f"{KEY_PREFIX}:{endpoint}:{scope}:{digest}"
+
+    def _versions(self, tags):
+        """目前的標籤版本；不存在的標籤建立新版本"""
+        keys = [self._tag_key(tag) for tag in tags]
+        versions = self.cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                self.cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = self.cache.get(key)
+        return versions
+
+    def get_or_compute(self, endpoint, scope, params, tags, compute, period_end):
+        """
+        取得快取的報表資料；不存在或已失效時呼叫 compute() 計算並保存
+
+        Args:
+            endpoint: 報表名稱
+            scope: 查詢範圍（例如使用者員工編號）
+            params: 期間與其他查詢參數（需可 repr）
+            tags: 依賴標籤
+            compute: 計算報表資料的函式（回傳值需可序列化）
+            period_end: 期間最後一天；早於今天視為已結束的期間
+        """
+        key = self._entry_key(endpoint, scope, params)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if self.cache.get_many(list(entry['versions'])) == entry['versions']:
+                return entry['data']
+
+        # 先取版本再計算：計算期間若有異動，保存的版本即已過時
+        versions = self._versions([GLOBAL_TAG, *tags])
+        data = compute()
+        timeout = self.closed_period_ttl if period_end < date.today() else OPEN_PERIOD_TTL
+        self.cache.set(key, {'versions': versions, 'data': data}, timeout)
+        return data
+
+    def invalidate(self, tags):
+        """更新標籤版本（交易提交後執行）"""
+        tags = set(tags)
+        if not tags:
+            return
+        transaction.on_commit(
+            lambda: self.cache.set_many({self._tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+        )
+
+    def invalidate_records(self, records, daily=True):
+        """
+        出勤、請假或加班記錄異動
+
+        Args:
+            records: [(relation_id, 日期)]
+            daily: 是否影響日報（儀表板）；請假與加班為 False
+        """
+        records = list(records)
+        if not records:
+            return
+        owners = {
+            relation_id: (employee_id, department_id)
+            for relation_id, employee_id, department_id in EmpCompanyRel.objects.filter(
+                id__in={relation_id for relation_id, _ in records}
+            ).values_list('id', 'employee_id', 'employee_id__department_id')
+        }
+
+        tags = set()
+        for relation_id, day in records:
+            if relation_id not in owners:
+                continue
+            employee_id, department_id = owners[relation_id]
+            periods = [month_period(day)] + ([day_period(day)] if daily else [])
+            tags.add(employee_tag(employee_id))
+            tags.add(employee_tag(employee_id, month_period(day)))
+            for period in periods:
+                tags.add(department_tag(department_id, period))
+                tags.add(f"all:{period}")
+        self.invalidate(tags)
+
+    def invalidate_organization(self):
+        """員工、部門或任職關聯異動"""
+        self.invalidate(['org'])
+
+    def clear(self):
+        """使所有報表快取失效"""
+        self.invalidate([GLOBAL_TAG])
+
+
+# 程序層級單例
+report_cache = ReportCache()
@@ -0,0 +1,237 @@
+"""
+出勤報表彙總引擎
+
+以「每個來源資料表一次條件式彙總查詢（依關聯分組）」取代逐位員工查詢：
+
+- AttendanceRecords：出勤天數、遲到 / 早退次數與分鐘數、補打卡次數、工時
+- LeaveRecords：已核准請假時數（依請假開始時間歸屬月份）
+- OvertimeRecords：已核准加班時數
+
+各查詢結果在記憶體中依 relation_id 合併，查詢數與員工人數無關。
+
+個人多月份摘要（summarize_months）則以單一查詢完成：以員工的任職關聯為
+外層，出勤記錄以條件式彙總逐月計算，請假與加班以子查詢併入。
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, FilteredRelation, OuterRef, Q, Subquery, Sum
+
+from .models import AttendanceRecords, LeaveRecords, OvertimeRecords
+
+
+def attendance_aggregates(prefix='', condition=None):
+    """
+    出勤記錄的條件式彙總欄位
+
+    Args:
+        prefix: 出勤記錄的關聯路徑（例如 'period_records__'）
+        condition: 額外限定的條件（例如月份範圍）
+    """
+    def only(**flags):
+        flag = Q(**{f'{prefix}{name}': value for name, value in flags.items()})
+        return flag & condition if condition is not None else flag
+
+    return {
+        'total_days': Count(f'{prefix}id', filter=condition),
+        'late_count': Count(f'{prefix}id', filter=only(is_late=True)),
+        'late_minutes_total': Sum(f'{prefix}late_minutes', filter=only(is_late=True)),
+        'early_leave_count': Count(f'{prefix}id', filter=only(is_early_leave=True)),
+        'early_leave_minutes_total': Sum(f'{prefix}early_leave_minutes', filter=only(is_early_leave=True)),
+        'makeup_count': Count(f'{prefix}id', filter=only(is_makeup=True)),
+        'total_work_hours': Sum(f'{prefix}work_hours', filter=condition),
+    }
+
+
+# 出勤記錄的彙總欄位
+ATTENDANCE_AGGREGATES = attendance_aggregates()
+
+
+def empty_summary():
+    """沒有任何記錄時的彙總結果"""
+    return {
+        'total_days': 0,
+        'late_count': 0,
+        'late_minutes_total': 0,
+        'early_leave_count': 0,
+        'early_leave_minutes_total': 0,
+        'makeup_count': 0,
+        'total_work_hours': Decimal('0'),
+        'leave_hours': Decimal('0'),
+        'overtime_hours': Decimal('0'),
+    }
+
+
+def grouped_aggregate(queryset, group_by, aggregates):
+    """
+    依 group_by 分組執行一次彙總查詢
+
+    Returns:
+        dict: {分組值: {彙總欄位: 值}}
+    """
+    rows = queryset.order_by().values(group_by).annotate(**aggregates)
+    return {row.pop(group_by): row for row in rows}
+
+
+def _for_relations(queryset, relation_ids):
+    """relation_ids 為 None 時不限定關聯（重建全部統計）"""
+    if relation_ids is None:
+        return queryset
+    return queryset.filter(relation_id__in=relation_ids)
+
+
+def _datetime_range(start_date, end_date):
+    """[start_date 00:00, end_date 隔天 00:00) 的 DateTimeField 查詢範圍"""
+    return datetime.combine(start_date, time.min), datetime.combine(end_date + timedelta(days=1), time.min)
+
+
+def attendance_totals(relation_ids, start_date, end_date):
+    """出勤記錄彙總（依關聯分組）"""
+    return grouped_aggregate(
+        _for_relations(AttendanceRecords.objects, relation_ids).filter(
+            date__gte=start_date,
+            date__lte=end_date
+        ),
+        'relation_id',
+        ATTENDANCE_AGGREGATES
+    )
+
+
+def leave_totals(relation_ids, start_date, end_date):
+    """已核准請假時數（依關聯分組，以請假開始時間歸屬）"""
+    range_start, range_end = _datetime_range(start_date, end_date)
+    return grouped_aggregate(
+        _for_relations(LeaveRecords.objects, relation_ids).filter(
+            start_time__gte=range_start,
+            start_time__lt=range_end,
+            status='approved'
+        ),
+        'relation_id',
+        {'leave_hours': Sum('leave_hours')}
+    )
+
+
+def overtime_totals(relation_ids, start_date, end_date):
+    """已核准加班時數（依關聯分組）"""
+    return grouped_aggregate(
+        _for_relations(OvertimeRecords.objects, relation_ids).filter(
+            date__gte=start_date,
+            date__lte=end_date,
+            status='approved'
+        ),
+        'relation_id',
+        {'overtime_hours': Sum('overtime_hours')}
+    )
+
+
+def summarize_relations(relation_ids, start_date, end_date):
+    """
+    彙總多位員工在期間內的出勤、請假與加班（共三次查詢）
+
+    Args:
+        relation_ids: EmpCompanyRel ID 序列；None 表示所有有資料的關聯
+        start_date: 開始日期（含）
+        end_date: 結束日期（含）
+
+    Returns:
+        dict: {relation_id: 彙總結果（欄位同 empty_summary）}
+    """
+    summaries = {}
+    if relation_ids is not None:
+        relation_ids = list(relation_ids)
+        summaries = {relation_id: empty_summary() for relation_id in relation_ids}
+        if not relation_ids:
+            return summaries
+
+    for totals in (
+        attendance_totals(relation_ids, start_date, end_date),
+        leave_totals(relation_ids, start_date, end_date),
+        overtime_totals(relation_ids, start_date, end_date),
+    ):
+        for relation_id, values in totals.items():
+            summary = summaries.setdefault(relation_id, empty_summary())
+            for name, value in values.items():
+                if value is not None:
+                    summary[name] = value
+
+    return summaries
+
+
+def month_range(year, month):
+    """月份的半開區間 [第一天, 下個月第一天)"""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def months_between(start, end):
+    """start 到 end（含）的 (年, 月) 列表；start、end 為 (年, 月)"""
+    periods = []
+    year, month = start
+    while (year, month) <= tuple(end):
+        periods.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+def _hours_subquery(queryset, field):
+    """外層任職關聯在範圍內的時數合計（純量子查詢）"""
+    return Subquery(
+        queryset.filter(relation_id=OuterRef('pk'))
+        .order_by()
+        .values('relation_id')
+        .annotate(total=Sum(field))
+        .values('total')
+    )
+
+
+def summarize_months(relations, periods):
+    """
+    以單一查詢彙總多個月份的出勤、請假與加班
+
+    外層為任職關聯（通常一筆），出勤記錄以 FilteredRelation 限定在整個
+    期間後 LEFT JOIN，每個月份各一組條件式彙總欄位；已核准請假（依開始
+    時間歸屬）與加班時數以相關子查詢併入。沒有記錄的月份仍會回傳。
+
+    Args:
+        relations: EmpCompanyRel 查詢（例如某員工的所有任職關聯）
+        periods: 連續的 [(年, 月)]
+
+    Returns:
+        dict: {(年, 月): 彙總結果（欄位同 empty_summary，多筆關聯合併）}
+    """
+    range_start = month_range(*periods[0])[0]
+    range_end = month_range(*periods[-1])[1]
+
+    annotations = {}
+    for index, (year, month) in enumerate(periods):
+        start, end = month_range(year, month)
+        in_month = Q(period_records__date__gte=start, period_records__date__lt=end)
+        for name, aggregate in attendance_aggregates('period_records__', in_month).items():
+            annotations[f'{name}__{index}'] = aggregate
+
+        range_from, range_to = datetime.combine(start, time.min), datetime.combine(end, time.min)
+        annotations[f'leave_hours__{index}'] = _hours_subquery(
+            LeaveRecords.objects.filter(start_time__gte=range_from, start_time__lt=range_to, status='approved'),
+            'leave_hours'
+        )
+        annotations[f'overtime_hours__{index}'] = _hours_subquery(
+            OvertimeRecords.objects.filter(date__gte=start, date__lt=end, status='approved'),
+            'overtime_hours'
+        )
+
+    rows = relations.annotate(
+        period_records=FilteredRelation(
+            'attendance_records',
+            condition=Q(attendance_records__date__gte=range_start, attendance_records__date__lt=range_end)
+        )
+    ).order_by().values('pk').annotate(**annotations)
+
+    summaries = {period: empty_summary() for period in periods}
+    for row in rows:
+        for key, value in row.items():
+            if key == 'pk' or value is None:
+                continue
+            name, index = key.rsplit('__', 1)
+            summaries[periods[int(index)]][name] += value
+    return summaries
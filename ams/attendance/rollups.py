@@ -0,0 +1,377 @@
+"""
+出勤統計的增量維護
+
+- AttendanceMonthlyRollup：每位員工每月一列，供報表讀取
+- DepartmentDailyAttendance：每個部門每天一列，供主管儀表板讀取
+
+寫入路徑在變更出勤記錄前後各取一次快照（snapshot），由
+apply_attendance_change 計算差額後更新兩種統計；請假與加班則在核准時
+累加月統計的時數。更新須與出勤記錄的寫入位於同一個交易中。
+
+- 新增記錄：add_attendance_records([record])
+- 修改記錄：before = snapshot(record) → 修改並儲存 → apply_attendance_change(before, snapshot(record))
+- 刪除記錄：由 signals 處理
+
+bulk_update、後台直接修改等未經上述路徑的寫入可能造成偏差：月統計以
+`python manage.py rebuild_attendance_rollups` 重建；部門每日計數刪除該日
+的列即可，下次打卡或查詢時會由出勤記錄重新計算。
+"""
+from calendar import monthrange
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import (
+    AttendanceMonthlyRollup, AttendanceRecords, DepartmentDailyAttendance,
+    EmpCompanyRel, Employees
+)
+from .reports import empty_summary, summarize_relations
+
+
+# 出勤記錄在某個時間點的統計貢獻
+AttendanceSnapshot = namedtuple('AttendanceSnapshot', ['relation_id', 'date', 'values'])
+
+
+def snapshot(record):
+    """
+    出勤記錄對統計的貢獻
+
+    Returns:
+        AttendanceSnapshot: values 為 {月統計欄位: 值}
+    """
+    return AttendanceSnapshot(record.relation_id_id, record.date, {
+        'days_present': 1,
+        'late_count': 1 if record.is_late else 0,
+        'late_minutes': record.late_minutes if record.is_late else 0,
+        'early_leave_count': 1 if record.is_early_leave else 0,
+        'early_leave_minutes': record.early_leave_minutes if record.is_early_leave else 0,
+        'makeup_count': 1 if record.is_makeup else 0,
+        'work_hours': Decimal(str(record.work_hours or 0)),
+    })
+
+
+def _add(deltas, key, values, sign):
+    bucket = deltas.setdefault(key, {})
+    for name, value in values.items():
+        bucket[name] = bucket.get(name, 0) + sign * value
+
+
+def _apply(changes):
+    """
+    套用 (before, after) 快照差額到月統計與部門每日計數
+
+    Args:
+        changes: [(before, after)]，新增時 before 為 None，刪除時 after 為 None
+    """
+    monthly = {}
+    for before, after in changes:
+        for item, sign in ((before, -1), (after, 1)):
+            if item is not None:
+                key = (item.relation_id, item.date.year, item.date.month)
+                _add(monthly, key, item.values, sign)
+    _bump(monthly)
+    # 部門計數列由整個部門共用，放在交易的最後更新，縮短列鎖持有的時間
+    _update_department_days(changes)
+
+
+def apply_attendance_change(before, after):
+    """依前後快照的差額更新統計（before / after 可為 None）"""
+    _apply([(before, after)])
+
+
+def add_attendance_records(records):
+    """新增的出勤記錄（同一統計列只更新一次）"""
+    _apply([(None, snapshot(record)) for record in records])
+
+
+def add_leave_hours(leave):
+    """請假核准時累加請假時數（依請假開始時間歸屬月份）"""
+    key = (leave.relation_id_id, leave.start_time.year, leave.start_time.month)
+    _bump({key: {'leave_hours': leave.leave_hours}})
+
+
+def add_overtime_hours(overtime):
+    """加班核准時累加加班時數"""
+    key = (overtime.relation_id_id, overtime.date.year, overtime.date.month)
+    _bump({key: {'overtime_hours': overtime.overtime_hours}})
+
+
+def add_approved_records(leaves=(), overtimes=()):
+    """批次核准時累加請假與加班時數（同一月份的差額合併為一次更新）"""
+    deltas = {}
+    for leave in leaves:
+        key = (leave.relation_id_id, leave.start_time.year, leave.start_time.month)
+        _add(deltas, key, {'leave_hours': leave.leave_hours}, 1)
+    for overtime in overtimes:
+        key = (overtime.relation_id_id, overtime.date.year, overtime.date.month)
+        _add(deltas, key, {'overtime_hours': overtime.overtime_hours}, 1)
+    _bump(deltas)
+
+
+def _bump(deltas):
+    """
+    以 F() 累加差額；統計列不存在時建立
+
+    統計列不存在而差額含負值（扣除既有貢獻）時不以差額建立，改由原始資料
+    重建該員工當月的統計；呼叫端皆在寫入原始資料後才更新統計，重建結果已
+    包含本次異動。
+    """
+    for (relation_id, year, month), values in deltas.items():
+        values = {name: value for name, value in values.items() if value}
+        if not values:
+            continue
+
+        lookup = {'relation_id_id': relation_id, 'year': year, 'month': month}
+        updates = {name: F(name) + value for name, value in values.items()}
+        updates['updated_at'] = timezone.now()
+        if AttendanceMonthlyRollup.objects.filter(**lookup).update(**updates):
+            continue
+        if any(value < 0 for value in values.values()):
+            rebuild_month(year, month, [relation_id])
+            continue
+        try:
+            with transaction.atomic():
+                AttendanceMonthlyRollup.objects.create(**lookup, **values)
+        except IntegrityError:
+            # 同時有其他請求建立了同一列
+            AttendanceMonthlyRollup.objects.filter(**lookup).update(**updates)
+
+
+def monthly_summaries(relation_ids, year, month):
+    """
+    讀取月統計（一次查詢），格式同 reports.summarize_relations
+
+    Returns:
+        dict: {relation_id: 彙總結果}；沒有統計列的關聯為全 0
+    """
+    summaries = {relation_id: empty_summary() for relation_id in relation_ids}
+    rollups = AttendanceMonthlyRollup.objects.filter(
+        relation_id__in=list(summaries), year=year, month=month
+    )
+    for rollup in rollups:
+        summaries[rollup.relation_id_id].update({
+            'total_days': rollup.days_present,
+            'late_count': rollup.late_count,
+            'late_minutes_total': rollup.late_minutes,
+            'early_leave_count': rollup.early_leave_count,
+            'early_leave_minutes_total': rollup.early_leave_minutes,
+            'makeup_count': rollup.makeup_count,
+            'total_work_hours': rollup.work_hours,
+            'leave_hours': rollup.leave_hours,
+            'overtime_hours': rollup.overtime_hours,
+        })
+    return summaries
+
+
+def rebuild_month(year, month, relation_ids=None):
+    """
+    以出勤、請假、加班原始資料重建某月的統計
+
+    Args:
+        relation_ids: 限定的關聯 ID；None 表示全部
+
+    Returns:
+        int: 重建的統計列數
+    """
+    start_date = date(year, month, 1)
+    end_date = date(year, month, monthrange(year, month)[1])
+    summaries = summarize_relations(relation_ids, start_date, end_date)
+
+    rollups = [
+        AttendanceMonthlyRollup(
+            relation_id_id=relation_id,
+            year=year,
+            month=month,
+            days_present=summary['total_days'],
+            late_count=summary['late_count'],
+            late_minutes=summary['late_minutes_total'],
+            early_leave_count=summary['early_leave_count'],
+            early_leave_minutes=summary['early_leave_minutes_total'],
+            makeup_count=summary['makeup_count'],
+            work_hours=summary['total_work_hours'],
+            leave_hours=summary['leave_hours'],
+            overtime_hours=summary['overtime_hours'],
+        )
+        for relation_id, summary in summaries.items()
+        if summary['total_days'] or summary['leave_hours'] or summary['overtime_hours']
+    ]
+
+    with transaction.atomic():
+        existing = AttendanceMonthlyRollup.objects.filter(year=year, month=month)
+        if relation_ids is not None:
+            existing = existing.filter(relation_id__in=relation_ids)
+        existing.delete()
+        AttendanceMonthlyRollup.objects.bulk_create(rollups, batch_size=500)
+
+    return len(rollups)
+
+
+# =====================================================
+# 部門每日出勤計數
+# =====================================================
+
+def _count_department_days(department_ids, day):
+    """
+    由出勤記錄計算部門當天的計數（建立計數列時使用）
+
+    Returns:
+        dict: {department_id: DepartmentDailyAttendance 欄位}
+    """
+    counters = {
+        department_id: {
+            'department_id': department_id,
+            'date': day,
+            'expected_headcount': 0,
+            'checked_in_count': 0,
+            'late_count': 0,
+            'early_leave_count': 0,
+        }
+        for department_id in department_ids
+    }
+
+    headcounts = Employees.objects.filter(
+        department_id__in=department_ids, is_active=True
+    ).order_by().values('department_id').annotate(total=Count('employee_id'))
+    for row in headcounts:
+        counters[row['department_id']]['expected_headcount'] = row['total']
+
+    # 與應出勤人數同樣以員工計：在多家公司任職的員工當天任一筆記錄即計為已打卡
+    employee = 'relation_id__employee_id'
+    records = AttendanceRecords.objects.filter(
+        date=day, relation_id__employee_id__department_id__in=department_ids
+    ).order_by().values('relation_id__employee_id__department_id').annotate(
+        checked_in=Count(employee, distinct=True),
+        late=Count(employee, filter=Q(is_late=True), distinct=True),
+        early_leave=Count(employee, filter=Q(is_early_leave=True), distinct=True),
+    )
+    for row in records:
+        counters[row['relation_id__employee_id__department_id']].update({
+            'checked_in_count': row['checked_in'],
+            'late_count': row['late'],
+            'early_leave_count': row['early_leave'],
+        })
+    return counters
+
+
+def department_days(department_ids, day):
+    """
+    讀取部門當天的計數；尚未建立的由出勤記錄計算後建立
+
+    Returns:
+        list: DepartmentDailyAttendance
+    """
+    department_ids = set(department_ids)
+    rows = list(DepartmentDailyAttendance.objects.filter(department_id__in=department_ids, date=day))
+    missing = department_ids - {row.department_id for row in rows}
+    if missing:
+        DepartmentDailyAttendance.objects.bulk_create(
+            [DepartmentDailyAttendance(**fields) for fields in _count_department_days(missing, day).values()],
+            ignore_conflicts=True
+        )
+        rows += DepartmentDailyAttendance.objects.filter(department_id__in=missing, date=day)
+    return rows
+
+
+def _update_department_days(changes):
+    """
+    依快照差額以 F() 累加部門每日計數（已打卡、遲到、早退人數）
+
+    計數與應出勤人數同樣以員工為單位。只有一個任職關聯的員工，出勤記錄
+    每人每天唯一，新增即已打卡人數 +1、刪除即 -1，不需讀取或鎖定計數列；
+    在多家公司任職的員工另外讀取其他關聯當天的記錄，當天任一筆記錄即計為
+    已打卡（遲到、早退同理）。下班打卡通常差額全為 0，不會寫入計數列。
+    """
+    relation_ids = {
+        item.relation_id for pair in changes for item in pair if item is not None
+    }
+    if not relation_ids:
+        return
+    relations = {}
+    relation_counts = {}
+    for relation_id, employee_id, department_id, relation_count in EmpCompanyRel.objects.filter(
+        id__in=relation_ids
+    ).annotate(relation_count=Count('employee_id__employee')).values_list(
+        'id', 'employee_id', 'employee_id__department_id', 'relation_count'
+    ):
+        relations[relation_id] = (employee_id, department_id)
+        relation_counts[employee_id] = relation_count
+
+    # {(employee_id, date): [部門, 異動前的記錄, 異動後的記錄, 異動的關聯]}，記錄為 (打卡, 遲到, 早退)
+    people = {}
+    for before, after in changes:
+        for index, item in ((1, before), (2, after)):
+            if item is None or item.relation_id not in relations:
+                continue
+            employee_id, department_id = relations[item.relation_id]
+            if department_id is None:
+                continue
+            person = people.setdefault((employee_id, item.date), [department_id, [], [], set()])
+            person[index].append((1, item.values['late_count'], item.values['early_leave_count']))
+            person[3].add(item.relation_id)
+
+    # 多個任職關聯的員工：其他關聯當天的記錄在異動前後都存在
+    shared = [key for key in people if relation_counts[key[0]] > 1]
+    if shared:
+        records = AttendanceRecords.objects.filter(
+            relation_id__employee_id__in={employee_id for employee_id, _ in shared},
+            date__in={day for _, day in shared}
+        ).values_list('relation_id', 'relation_id__employee_id', 'date', 'is_late', 'is_early_leave')
+        for relation_id, employee_id, day, is_late, is_early_leave in records:
+            person = people.get((employee_id, day))
+            if person is None or relation_id in person[3]:
+                continue
+            flags = (1, int(is_late), int(is_early_leave))
+            person[1].append(flags)
+            person[2].append(flags)
+
+    # {(department_id, date): {'checked_in_count': ±n, 'late_count': ±n, 'early_leave_count': ±n}}
+    deltas = {}
+    for (_, day), (department_id, before, after, _) in people.items():
+        was, now = _any_of(before), _any_of(after)
+        _add(deltas, (department_id, day), {
+            name: now[i] - was[i] for i, name in enumerate(('checked_in_count', 'late_count', 'early_leave_count'))
+        }, 1)
+
+    # 依部門與日期排序，多個部門同時更新時的鎖定順序一致
+    for (department_id, day), values in sorted(deltas.items()):
+        values = {name: value for name, value in values.items() if value}
+        if not values:
+            continue
+
+        lookup = {'department_id': department_id, 'date': day}
+        updates = {name: F(name) + value for name, value in values.items()}
+        updates['updated_at'] = timezone.now()
+        if DepartmentDailyAttendance.objects.filter(**lookup).update(**updates):
+            continue
+        try:
+            with transaction.atomic():
+                # 由出勤記錄計算，已包含本交易中的異動
+                fields = _count_department_days([department_id], day)[department_id]
+                DepartmentDailyAttendance.objects.create(**fields)
+        except IntegrityError:
+            # 同時有其他請求建立了同一列（其計算不含本交易尚未提交的異動）
+            DepartmentDailyAttendance.objects.filter(**lookup).update(**updates)
+
+
+def _any_of(records):
+    """員工當天的 (已打卡, 遲到, 早退)：任一筆記錄符合即為 1"""
+    return [max(column) for column in zip(*records)] if records else [0, 0, 0]
+
+
+def refresh_expected_headcount(day):
+    """員工部門或在職狀態異動後，重新計算該日各部門的應出勤人數"""
+    rows = list(DepartmentDailyAttendance.objects.filter(date=day))
+    if not rows:
+        return
+    headcounts = dict(
+        Employees.objects.filter(
+            department_id__in=[row.department_id for row in rows], is_active=True
+        ).order_by().values('department_id').annotate(total=Count('employee_id')).values_list('department_id', 'total')
+    )
+    for row in rows:
+        row.expected_headcount = headcounts.get(row.department_id, 0)
+    DepartmentDailyAttendance.objects.bulk_update(rows, ['expected_headcount'])
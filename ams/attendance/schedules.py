@@ -0,0 +1,166 @@
+"""
+員工適用班表解析與快取
+
+員工適用的班表為「員工專屬班表（EmpCompanyRel.work_schedule）」，
+未設定時改用公司的預設班表（is_default=True 且啟用中）。
+此模組以關聯 ID 為鍵，將解析結果快取在程序記憶體中，
+打卡判定遲到時不再需要額外查詢資料庫。
+
+- WorkSchedule 異動：清除全部快取（預設班表可能影響整間公司）
+- EmpCompanyRel 異動：清除該關聯的快取
+- 另設定存活時間（SCHEDULE_CACHE_TTL），讓多個 worker 程序最終一致
+"""
+import threading
+import time as _time
+
+from django.conf import settings
+from django.db.models import Q
+
+
+CACHE_TTL_SECONDS = getattr(settings, 'SCHEDULE_CACHE_TTL', 300)
+
+# 區分「尚未快取」與「查無班表（None）」
+_MISSING = object()
+
+
+class ScheduleResolver:
+    """員工適用班表解析器（程序層級快取）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_relation = {}
+        self._by_id = {}
+        self._loaded_at = _time.monotonic()
+        # 每次失效遞增，避免查詢期間收到的失效通知被舊資料覆蓋
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- 失效 ----------
+
+    def invalidate_relation(self, relation_id):
+        """清除單一關聯的快取"""
+        with self._lock:
+            self._generation += 1
+            self._by_relation.pop(relation_id, None)
+
+    def invalidate_all(self):
+        """清除全部快取"""
+        with self._lock:
+            self._generation += 1
+            self._by_relation = {}
+            self._by_id = {}
+            self._loaded_at = _time.monotonic()
+
+    def _expire_if_stale(self):
+        if _time.monotonic() - self._loaded_at > CACHE_TTL_SECONDS:
+            self.invalidate_all()
+
+    # ---------- 查詢 ----------
+
+    def resolve(self, relation):
+        """
+        取得員工適用的班表
+
+        Args:
+            relation: EmpCompanyRel 實例
+
+        Returns:
+            WorkSchedule 或 None（公司未設定預設班表）
+        """
+        return self.resolve_many([relation])[relation.id]
+
+    def resolve_many(self, relations):
+        """
+        批次取得多位員工適用的班表（未命中的部分合併成一次查詢）
+
+        Args:
+            relations: EmpCompanyRel 實例序列
+
+        Returns:
+            dict: {relation_id: WorkSchedule 或 None}
+        """
+        from .models import WorkSchedule
+
+        self._expire_if_stale()
+        generation = self._generation
+
+        result = {}
+        missing = []
+        for relation in relations:
+            schedule = self._by_relation.get(relation.id, _MISSING)
+            if schedule is _MISSING:
+                missing.append(relation)
+            else:
+                result[relation.id] = schedule
+
+        with self._lock:
+            self.hits += len(result)
+            self.misses += len(missing)
+
+        if not missing:
+            return result
+
+        # 員工專屬班表與公司預設班表合併查詢
+        own_ids = {r.work_schedule_id for r in missing if r.work_schedule_id}
+        company_ids = {r.company_id_id for r in missing}
+        schedules = WorkSchedule.objects.filter(
+            Q(id__in=own_ids) | Q(company_id__in=company_ids, is_default=True, is_active=True)
+        ).order_by('company_id', 'name')
+
+        by_id = {}
+        defaults = {}
+        for schedule in schedules:
+            by_id[schedule.id] = schedule
+            if schedule.is_default and schedule.is_active and schedule.company_id_id in company_ids:
+                # 同一公司有多個預設班表時取排序第一個（與 .first() 行為一致）
+                defaults.setdefault(schedule.company_id_id, schedule)
+
+        resolved = {}
+        for relation in missing:
+            schedule = by_id.get(relation.work_schedule_id) if relation.work_schedule_id else None
+            resolved[relation.id] = schedule or defaults.get(relation.company_id_id)
+
+        with self._lock:
+            if generation == self._generation:
+                self._by_relation.update(resolved)
+                self._by_id.update(by_id)
+
+        result.update(resolved)
+        return result
+
+    def get_schedule(self, schedule_id):
+        """依班表 ID 取得班表（供下班打卡判定早退）"""
+        from .models import WorkSchedule
+
+        if not schedule_id:
+            return None
+
+        self._expire_if_stale()
+        schedule = self._by_id.get(schedule_id)
+        if schedule is not None:
+            with self._lock:
+                self.hits += 1
+            return schedule
+
+        generation = self._generation
+        schedule = WorkSchedule.objects.filter(id=schedule_id).first()
+        with self._lock:
+            self.misses += 1
+            if schedule is not None and generation == self._generation:
+                self._by_id[schedule_id] = schedule
+        return schedule
+
+    def stats(self):
+        """快取命中統計"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'cached_relations': len(self._by_relation),
+        }
+
+
+# 程序層級的共用解析器
+schedule_resolver = ScheduleResolver()
@@ -21,7 +21,7 @@ class EmployeesSerializer(serializers.ModelSerializer):
 class CompaniesSerializer(serializers.ModelSerializer):
     class Meta:
         model = Companies
-        fields = '__all__'
+        exclude = ['qr_secret']
 
 class EmpCompanyRelSerializer(serializers.ModelSerializer):
 
@@ -0,0 +1,174 @@
+"""
+出勤系統 signals：維護各項程序層級快取與報表快取
+"""
+from datetime import date
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .approval_policies import approval_policies
+from .approvers import approver_directory
+from .geofence import geofence_index
+from .models import (
+    ApprovalPolicy, ApprovalRecords, AttendanceRecords, Companies, Departments, EmpCompanyRel, Employees,
+    LeaveRecords, MakeupClockApproval, ManagerialRelationship, OvertimeApproval, OvertimeRecords, WorkSchedule
+)
+from . import pending_counters
+from .presence import daily_presence
+from .report_cache import report_cache
+from .rollups import apply_attendance_change, refresh_expected_headcount, snapshot
+from .schedules import schedule_resolver
+
+
+@receiver([post_save, post_delete], sender=Companies)
+def invalidate_geofence_index(sender, **kwargs):
+    """公司座標或範圍異動時，重建地理圍欄索引"""
+    geofence_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=ApprovalPolicy)
+def invalidate_approval_policies(sender, **kwargs):
+    """審批政策異動時，重建政策區間表"""
+    approval_policies.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Employees)
+@receiver([post_save, post_delete], sender=EmpCompanyRel)
+@receiver([post_save, post_delete], sender=Departments)
+@receiver([post_save, post_delete], sender=ManagerialRelationship)
+def invalidate_approver_directory(sender, update_fields=None, **kwargs):
+    """角色、任職、部門主管或主管關係異動時，重建審批人目錄（登入只更新 last_login，略過）"""
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    approver_directory.invalidate()
+
+
+@receiver([post_save, post_delete], sender=WorkSchedule)
+def invalidate_schedule_cache(sender, **kwargs):
+    """班表異動可能影響整間公司的預設班表，清除全部快取"""
+    schedule_resolver.invalidate_all()
+
+
+@receiver([post_save, post_delete], sender=EmpCompanyRel)
+def invalidate_relation_schedule(sender, instance, **kwargs):
+    """員工專屬班表或所屬公司異動"""
+    schedule_resolver.invalidate_relation(instance.id)
+
+
+@receiver(post_delete, sender=AttendanceRecords)
+def forget_daily_presence(sender, instance, **kwargs):
+    """出勤記錄刪除後，允許該員工當天重新打卡"""
+    daily_presence.discard(instance.relation_id_id, instance.date)
+
+
+@receiver(post_delete, sender=AttendanceRecords)
+def subtract_monthly_rollup(sender, instance, origin=None, **kwargs):
+    """
+    出勤記錄刪除後，從月統計與部門每日計數扣除該筆記錄
+
+    由公司、員工或任職關聯連鎖刪除時略過：該關聯的月統計會一併刪除，
+    此時再寫入統計列會參照到已刪除的關聯。
+    """
+    if origin is not None:
+        origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+        if origin_model is not AttendanceRecords:
+            return
+    apply_attendance_change(snapshot(instance), None)
+
+
+# 員工載入時的 (部門, 在職狀態)，儲存時比對是否影響部門應出勤人數
+_HEADCOUNT_STATE = '_headcount_state'
+_HEADCOUNT_FIELDS = {'department', 'department_id', 'is_active'}
+
+
+def _headcount_state(instance):
+    return instance.department_id, instance.is_active
+
+
+@receiver(post_init, sender=Employees)
+def remember_headcount_state(sender, instance, **kwargs):
+    """記住員工載入時的部門與在職狀態（延遲載入的欄位不觸發查詢）"""
+    if 'department_id' in instance.__dict__ and 'is_active' in instance.__dict__:
+        setattr(instance, _HEADCOUNT_STATE, _headcount_state(instance))
+
+
+@receiver([post_save, post_delete], sender=Employees)
+def refresh_department_headcount(sender, instance, signal, created=False, update_fields=None, **kwargs):
+    """
+    員工部門或在職狀態異動時，更新今天的部門應出勤人數
+
+    其他欄位的儲存（個人資料、角色）不重新計算；登入只更新 last_login，
+    報表快取也不失效。
+    """
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    report_cache.invalidate_organization()
+
+    before = getattr(instance, _HEADCOUNT_STATE, None)
+    if signal is post_delete:
+        department_id, is_active = before or _headcount_state(instance)
+        if department_id is not None and is_active:
+            refresh_expected_headcount(date.today())
+        return
+    if update_fields and not _HEADCOUNT_FIELDS & set(update_fields):
+        return
+
+    after = _headcount_state(instance)
+    setattr(instance, _HEADCOUNT_STATE, after)
+    if created:
+        changed = after[0] is not None and after[1]
+    else:
+        # 以 only() / defer() 載入、未含這兩個欄位時無法比對，一律重新計算
+        changed = before is None or before != after
+    if changed:
+        refresh_expected_headcount(date.today())
+
+
+@receiver([post_save, post_delete], sender=EmpCompanyRel)
+@receiver([post_save, post_delete], sender=Departments)
+def invalidate_organization_reports(sender, **kwargs):
+    """任職關聯或部門異動，影響報表涵蓋的人員"""
+    report_cache.invalidate_organization()
+
+
+@receiver([post_save, post_delete], sender=AttendanceRecords)
+def invalidate_attendance_reports(sender, instance, **kwargs):
+    """出勤記錄異動：失效該員工、部門當月與當天的報表"""
+    report_cache.invalidate_records([(instance.relation_id_id, instance.date)])
+
+
+@receiver([post_save, post_delete], sender=LeaveRecords)
+def invalidate_leave_reports(sender, instance, **kwargs):
+    """請假記錄異動（依請假開始時間歸屬月份）"""
+    report_cache.invalidate_records([(instance.relation_id_id, instance.start_time.date())], daily=False)
+
+
+@receiver([post_save, post_delete], sender=OvertimeRecords)
+def invalidate_overtime_reports(sender, instance, **kwargs):
+    """加班記錄異動"""
+    report_cache.invalidate_records([(instance.relation_id_id, instance.date)], daily=False)
+
+
+@receiver(post_init, sender=ApprovalRecords)
+@receiver(post_init, sender=OvertimeApproval)
+@receiver(post_init, sender=MakeupClockApproval)
+def remember_pending_approver(sender, instance, **kwargs):
+    """記住審批記錄載入時計入的審批人，儲存時據以更新待審件數"""
+    pending_counters.remember(instance)
+
+
+@receiver(post_save, sender=ApprovalRecords)
+@receiver(post_save, sender=OvertimeApproval)
+@receiver(post_save, sender=MakeupClockApproval)
+def update_pending_counter(sender, instance, created, **kwargs):
+    """審批記錄新增、狀態或審批人異動"""
+    pending_counters.record_save(instance, created=created)
+
+
+@receiver(post_delete, sender=ApprovalRecords)
+@receiver(post_delete, sender=OvertimeApproval)
+@receiver(post_delete, sender=MakeupClockApproval)
+def release_pending_counter(sender, instance, **kwargs):
+    """審批記錄刪除（含申請刪除時的連鎖刪除）"""
+    pending_counters.record_delete(instance)
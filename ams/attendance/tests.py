@@ -1,3 +1,1996 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import qr_tokens, utils
+from .models import (
+    ApprovalPolicy, ApprovalRecords, AttendanceMonthlyRollup, AttendanceRecords, Companies,
+    DepartmentDailyAttendance, Departments, EmpCompanyRel, Employees, ExportJob, IdempotencyKey,
+    LeaveBalances, LeaveRecords, MakeupClockApproval, MakeupClockRequest, Notifications, OvertimeApproval,
+    OvertimeRecords, PendingApprovalCounter, WorkSchedule, generate_qr_secret
+)
+from .approval_policies import approval_policies, compile_segments
+from .approvers import approver_directory
+from .export_jobs import export_jobs
+from .geofence import METERS_PER_DEGREE, QR_MATCH_TOLERANCE_METERS, geofence_index
+from .presence import daily_presence
+from .punch_queue import punch_queue
+from .report_cache import OPEN_PERIOD_TTL, report_cache
+from .schedules import schedule_resolver
+from .rollups import (
+    add_attendance_records, add_leave_hours, apply_attendance_change, department_days, rebuild_month, snapshot
+)
+from .utils import calculate_distance, calculate_distances, label_geofences
+
+
+def _random_points(count, seed=0):
+    """台灣本島範圍內的隨機座標"""
+    rng = random.Random(seed)
+    lats = [rng.uniform(21.9, 25.3) for _ in range(count)]
+    lons = [rng.uniform(120.0, 122.0) for _ in range(count)]
+    return lats, lons
+
+
+def _random_sites(count, seed=1):
+    lats, lons = _random_points(count, seed)
+    rng = random.Random(seed)
+    radii = [rng.choice([200, 500, 2000, 20000]) for _ in range(count)]
+    return lats, lons, radii
+
+
+def _scalar_labels(lats, lons, site_lats, site_lons, site_radii):
+    """逐筆呼叫 calculate_distance 的對照實作"""
+    labels, distances = [], []
+    for lat, lon in zip(lats, lons):
+        row = [calculate_distance(lat, lon, s_lat, s_lon) for s_lat, s_lon in zip(site_lats, site_lons)]
+        inside = [i for i, d in enumerate(row) if d <= site_radii[i]]
+        labels.append(min(inside, key=row.__getitem__) if inside else None)
+        distances.append(min(row))
+    return labels, distances
+
+
+class CalculateDistancesTests(SimpleTestCase):
+    """向量化 Haversine 與逐筆版本的一致性"""
+
+    def test_matches_scalar_version(self):
+        lats, lons = _random_points(500)
+        ref_lat, ref_lon = 25.0330, 121.5654
+
+        expected = [calculate_distance(lat, lon, ref_lat, ref_lon) for lat, lon in zip(lats, lons)]
+        actual = calculate_distances(lats, lons, ref_lat, ref_lon)
+
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, delta=1e-6)
+
+    def test_per_row_reference_points(self):
+        lats, lons = _random_points(100)
+        ref_lats, ref_lons = _random_points(100, seed=2)
+
+        expected = [calculate_distance(*args) for args in zip(lats, lons, ref_lats, ref_lons)]
+        actual = calculate_distances(lats, lons, ref_lats, ref_lons)
+
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, delta=1e-6)
+
+    def test_accepts_decimal(self):
+        distance = calculate_distances([Decimal('25.0331')], [Decimal('121.5655')], Decimal('25.0330'), Decimal('121.5654'))
+        self.assertAlmostEqual(distance[0], calculate_distance(Decimal('25.0331'), Decimal('121.5655'), 25.0330, 121.5654))
+
+    def test_fallback_without_numpy(self):
+        lats, lons = _random_points(50)
+        expected = calculate_distances(lats, lons, 25.0330, 121.5654)
+        with mock.patch.object(utils, 'np', None):
+            actual = calculate_distances(lats, lons, 25.0330, 121.5654)
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, delta=1e-6)
+
+
+class LabelGeofencesTests(SimpleTestCase):
+    """N 個座標 × M 個地點的圍欄判定"""
+
+    def test_matches_scalar_version(self):
+        lats, lons = _random_points(300)
+        site_lats, site_lons, site_radii = _random_sites(40)
+
+        expected_labels, expected_distances = _scalar_labels(lats, lons, site_lats, site_lons, site_radii)
+        labels, distances = label_geofences(lats, lons, site_lats, site_lons, site_radii, chunk_size=64)
+
+        self.assertEqual(labels, expected_labels)
+        for e, a in zip(expected_distances, distances):
+            self.assertAlmostEqual(e, a, delta=1e-6)
+
+    def test_nearest_covering_site_wins(self):
+        # 兩個圍欄重疊時取最近的地點
+        labels, _ = label_geofences(
+            [25.0331, 24.0],
+            [121.5655, 120.0],
+            [25.0330, 25.0400],
+            [121.5654, 121.5654],
+            [2000, 2000],
+        )
+        self.assertEqual(labels, [0, None])
+
+    def test_no_sites(self):
+        self.assertEqual(label_geofences([25.0], [121.0], [], [], []), ([None], [None]))
+
+    def test_fallback_without_numpy(self):
+        lats, lons = _random_points(100)
+        site_lats, site_lons, site_radii = _random_sites(20)
+
+        expected = label_geofences(lats, lons, site_lats, site_lons, site_radii)
+        with mock.patch.object(utils, 'np', None):
+            actual = label_geofences(lats, lons, site_lats, site_lons, site_radii)
+
+        self.assertEqual(actual[0], expected[0])
+        for e, a in zip(expected[1], actual[1]):
+            self.assertAlmostEqual(e, a, delta=1e-6)
+
+
+@unittest.skipUnless(os.environ.get('RUN_BENCHMARKS'), '設定 RUN_BENCHMARKS=1 執行效能測試')
+class DistanceBenchmark(SimpleTestCase):
+    """
+    向量化與逐筆計算的效能比較
+
+        RUN_BENCHMARKS=1 python manage.py test attendance.tests.DistanceBenchmark
+    """
+
+    def _time(self, func, repeat=3):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_calculate_distances(self):
+        lats, lons = _random_points(100000)
+        lats = [Decimal(str(round(lat, 7))) for lat in lats]
+        lons = [Decimal(str(round(lon, 7))) for lon in lons]
+
+        scalar = self._time(lambda: [calculate_distance(lat, lon, 25.0330, 121.5654) for lat, lon in zip(lats, lons)])
+        vectorized = self._time(lambda: calculate_distances(lats, lons, 25.0330, 121.5654))
+        print(f"\ncalculate_distance × {len(lats)}: {scalar * 1000:.1f} ms")
+        print(f"calculate_distances({len(lats)}): {vectorized * 1000:.1f} ms（{scalar / vectorized:.1f}x）")
+
+    def test_label_geofences(self):
+        lats, lons = _random_points(10000)
+        site_lats, site_lons, site_radii = _random_sites(200)
+
+        scalar = self._time(lambda: _scalar_labels(lats, lons, site_lats, site_lons, site_radii), repeat=1)
+        vectorized = self._time(lambda: label_geofences(lats, lons, site_lats, site_lons, site_radii))
+        print(f"\n逐筆判定 {len(lats)} × {len(site_lats)}: {scalar * 1000:.1f} ms")
+        print(f"label_geofences {len(lats)} × {len(site_lats)}: {vectorized * 1000:.1f} ms（{scalar / vectorized:.1f}x）")
+
+
+def _company(**fields):
+    """測試用公司（預設為台北的總公司）"""
+    fields = {'name': '總公司', 'address': '台北', 'latitude': 25.0330, 'longitude': 121.5654, **fields}
+    return Companies.objects.create(**fields)
+
+
+def _organization():
+    """總公司與其研發部"""
+    company = _company()
+    return company, Departments.objects.create(name='研發部', company_id=company)
+
+
+def _staff(employee_id, company, department=None, username=None, **fields):
+    """
+    建立員工與在職的任職關聯
+
+    Returns:
+        tuple: (Employees, EmpCompanyRel)
+    """
+    employee = Employees.objects.create_user(
+        employee_id=employee_id, username=username or employee_id, password='pw', department=department, **fields
+    )
+    relation = EmpCompanyRel.objects.create(
+        employee_id=employee, company_id=company, employment_status=True, hire_date=date(2024, 1, 1)
+    )
+    return employee, relation
+
+
+class PunchTestCase(TestCase):
+    """打卡測試共用：半徑 500 公尺的總公司與本人的任職關聯"""
+
+    def setUp(self):
+        self.company = _company(radius=500)
+        self.employee, self.relation = _staff('E001', self.company)
+        # 當日已打卡名單為程序層級，不隨測試交易回滾
+        daily_presence.discard(self.relation.id, date.today())
+        self.client = APIClient()
+        self.client.force_authenticate(self.employee)
+
+    def _clock_in(self, headers=None, **fields):
+        data = {
+            'qr_latitude': '25.0330', 'qr_longitude': '121.5654', 'user_latitude': '25.0331',
+            'user_longitude': '121.5655', 'relation_id': self.relation.id, **fields
+        }
+        return self.client.post('/clock-in/', data, format='json', **(headers or {}))
+
+
+class GeofenceIndexTests(TestCase):
+    """地理圍欄索引：QR Code 座標容許誤差與公司異動時重建"""
+
+    def setUp(self):
+        self.company = _company(radius=500)
+        geofence_index.invalidate()
+
+    def test_qr_rounding_within_tolerance(self):
+        # 不同裝置產生的 QR Code 小數位數不同（約 5 公尺）
+        site = geofence_index.resolve_qr('25.03304', '121.56536')
+        self.assertEqual(site.id, self.company.id)
+        self.assertEqual(geofence_index.resolve_qr(25.0331, 121.5654).id, self.company.id)
+
+    def test_just_outside_tolerance(self):
+        # 往北 QR_MATCH_TOLERANCE_METERS + 5 公尺
+        offset = (QR_MATCH_TOLERANCE_METERS + 5) / METERS_PER_DEGREE
+        self.assertIsNone(geofence_index.resolve_qr(25.0330 + offset, 121.5654))
+        offset = (QR_MATCH_TOLERANCE_METERS - 5) / METERS_PER_DEGREE
+        self.assertEqual(geofence_index.resolve_qr(25.0330 + offset, 121.5654).id, self.company.id)
+
+    def test_company_changes_rebuild_index(self):
+        self.assertIsNotNone(geofence_index.resolve_qr(25.0330, 121.5654))
+
+        # 不等存活時間（INDEX_TTL_SECONDS），儲存後下一次查詢即重建
+        self.company.latitude, self.company.longitude = 24.1477, 120.6736
+        self.company.save()
+        self.assertIsNone(geofence_index.resolve_qr(25.0330, 121.5654))
+        self.assertEqual(geofence_index.resolve_qr(24.1477, 120.6736).id, self.company.id)
+
+        self.company.delete()
+        self.assertIsNone(geofence_index.resolve_qr(24.1477, 120.6736))
+        self.assertIsNone(geofence_index.get(self.company.id))
+
+
+class DailyRecordUniquenessTests(PunchTestCase):
+    """每人每天一筆出勤記錄：唯一約束與重複打卡回應"""
+
+    def _record(self, checkin):
+        return AttendanceRecords.objects.create(
+            relation_id=self.relation, date=checkin.date(), checkin_time=checkin, checkout_time=checkin,
+            checkin_location='-', checkout_location='-', work_hours=Decimal('0.00')
+        )
+
+    def test_constraint_rejects_second_record(self):
+        self._record(datetime(2025, 3, 3, 9))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self._record(datetime(2025, 3, 3, 10))
+        self._record(datetime(2025, 3, 4, 9))
+        self.assertEqual(AttendanceRecords.objects.count(), 2)
+
+    def test_constraint_violation_maps_to_already_clocked_in(self):
+        # 其他程序寫入的記錄：當日已打卡名單中沒有，由唯一約束擋下
+        self._record(datetime.now())
+
+        response = self._clock_in()
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json()['error']['code'], 'ALREADY_CLOCKED_IN')
+        self.assertEqual(AttendanceRecords.objects.count(), 1)
+        # 之後的重複打卡驗證關聯後由名單判定並確認記錄存在，不再嘗試寫入
+        with self.assertNumQueries(2):
+            response = self._clock_in()
+        self.assertEqual(response.json()['error']['code'], 'ALREADY_CLOCKED_IN')
+
+    def test_stale_presence_is_confirmed_before_rejecting(self):
+        # 其他 worker 或後台刪除記錄時本程序的名單不會更新（名單仍有、資料庫沒有）
+        daily_presence.add(self.relation.id, date.today())
+
+        response = self._clock_in()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(AttendanceRecords.objects.get().id, response.json()['data']['id'])
+
+
+class MergeDuplicateRecordsTests(TransactionTestCase):
+    """0011 遷移：加上唯一約束前合併既有的重複出勤記錄"""
+
+    def setUp(self):
+        self.constraint = next(
+            constraint for constraint in AttendanceRecords._meta.constraints
+            if constraint.name == 'uniq_attendance_relation_date'
+        )
+        # 建立唯一約束之前的資料（SQLite 依模型定義重建資料表，須一併移除模型上的約束）
+        constraints = [
+            constraint for constraint in AttendanceRecords._meta.constraints if constraint is not self.constraint
+        ]
+        with mock.patch.object(AttendanceRecords._meta, 'constraints', constraints), \
+                connection.schema_editor() as editor:
+            editor.remove_constraint(AttendanceRecords, self.constraint)
+
+    def tearDown(self):
+        AttendanceRecords.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(AttendanceRecords, self.constraint)
+
+    def test_merge_keeps_first_checkin_and_last_checkout(self):
+        _, relation = _staff('E001', _company())
+        records = [
+            AttendanceRecords.objects.create(
+                relation_id=relation, date=date(2025, 3, 3), checkin_time=checkin, checkout_time=checkout,
+                checkin_location=f'in-{index}', checkout_location=f'out-{index}', work_hours=Decimal('0.00'),
+                is_makeup=index == 2
+            )
+            for index, (checkin, checkout) in enumerate([
+                (datetime(2025, 3, 3, 9, 5), datetime(2025, 3, 3, 12)),
+                (datetime(2025, 3, 3, 8, 55), datetime(2025, 3, 3, 9, 0)),
+                (datetime(2025, 3, 3, 13), datetime(2025, 3, 3, 18, 30)),
+            ])
+        ]
+        other_day = AttendanceRecords.objects.create(
+            relation_id=relation, date=date(2025, 3, 4), checkin_time=datetime(2025, 3, 4, 9),
+            checkout_time=datetime(2025, 3, 4, 18), checkin_location='-', checkout_location='-',
+            work_hours=Decimal('9.00')
+        )
+        makeup = MakeupClockRequest.objects.create(
+            relation_id=relation, date=date(2025, 3, 3), makeup_type='checkout', reason='-',
+            attendance_record=records[2]
+        )
+
+        # 以遷移當時的模型執行（不觸發 signals）
+        migration = importlib.import_module('attendance.migrations.0011_attendancerecords_unique_relation_date')
+        state = MigrationLoader(connection).project_state(('attendance', '0011_attendancerecords_unique_relation_date'))
+        migration.merge_duplicate_records(state.apps, None)
+
+        keep = AttendanceRecords.objects.get(date=date(2025, 3, 3))
+        self.assertEqual(keep.id, records[1].id)
+        self.assertEqual((keep.checkin_time, keep.checkin_location), (datetime(2025, 3, 3, 8, 55), 'in-1'))
+        self.assertEqual((keep.checkout_time, keep.checkout_location), (datetime(2025, 3, 3, 18, 30), 'out-2'))
+        self.assertEqual(keep.work_hours, Decimal('9.58'))
+        self.assertTrue(keep.is_makeup)
+        makeup.refresh_from_db()
+        self.assertEqual(makeup.attendance_record_id, keep.id)
+        self.assertEqual(AttendanceRecords.objects.get(date=date(2025, 3, 4)).id, other_day.id)
+
+
+class PunchQueueTests(PunchTestCase):
+    """打卡緩衝佇列：受理、批次寫入、當機後重新寫入、收據查詢"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(
+            PUNCH_QUEUE_ENABLED=True, PUNCH_QUEUE_DIR=directory.name, PUNCH_QUEUE_IN_PROCESS_FLUSHER=False
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def _receipt(self, receipt, client=None):
+        return (client or self.client).get(f'/clock-in/receipts/{receipt}/')
+
+    def test_enqueue_then_flush(self):
+        response = self._clock_in()
+        self.assertEqual(response.status_code, 202, response.content)
+        first = response.json()['data']['receipt']
+        # 受理後即列入當日名單，寫入前的重複打卡直接拒絕
+        response = self._clock_in()
+        self.assertEqual(response.json()['error']['code'], 'ALREADY_CLOCKED_IN')
+        # 其他程序受理的同日打卡於寫入時拒絕
+        second = punch_queue.enqueue(self.relation.id, timezone.now(), '25.0331, 121.5655')
+        self.assertFalse(AttendanceRecords.objects.exists())
+        self.assertEqual(self._receipt(first).json()['data']['status'], 'pending')
+        self.assertEqual(punch_queue.pending_count(), 2)
+
+        self.assertEqual(punch_queue.flush(), {'committed': 1, 'rejected': 1})
+
+        record = AttendanceRecords.objects.get()
+        self.assertEqual((record.relation_id_id, record.punch_receipt), (self.relation.id, first))
+        data = self._receipt(first).json()['data']
+        self.assertEqual((data['status'], data['id']), ('committed', record.id))
+        data = self._receipt(second).json()['data']
+        self.assertEqual((data['status'], data['error']['code']), ('rejected', 'ALREADY_CLOCKED_IN'))
+        self.assertEqual(punch_queue.pending_count(), 0)
+        self.assertEqual(AttendanceMonthlyRollup.objects.get(relation_id=self.relation).days_present, 1)
+
+    def test_reflush_after_crash_skips_committed_receipts(self):
+        receipt = self._clock_in().json()['data']['receipt']
+
+        # 寫入資料庫後、刪除區段前當機：區段留在目錄中
+        with mock.patch('attendance.punch_queue.os.remove', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                punch_queue.flush()
+        self.assertEqual(punch_queue.pending_count(), 1)
+
+        self.assertEqual(punch_queue.flush(), {'committed': 0, 'rejected': 0})
+        self.assertEqual(AttendanceRecords.objects.get().punch_receipt, receipt)
+        self.assertEqual(punch_queue.pending_count(), 0)
+        self.assertEqual(self._receipt(receipt).json()['data']['status'], 'committed')
+
+    def test_status_reads_only_appended_entries(self):
+        first = self._clock_in().json()['data']['receipt']
+        self.assertEqual(punch_queue.status(first)['status'], 'pending')
+        second = punch_queue.enqueue(self.relation.id, timezone.now(), '25.0331, 121.5655')
+
+        # 只解析新追加的一行，不重新讀取整份日誌
+        with mock.patch('attendance.punch_queue.json.loads', wraps=json.loads) as loads:
+            self.assertEqual(punch_queue.status(second)['status'], 'pending')
+            self.assertEqual(punch_queue.status(first)['status'], 'pending')
+        self.assertEqual(loads.call_count, 1)
+
+        # 改名為區段後不需重新讀取；區段刪除後移出索引
+        punch_queue.flush()
+        self.assertEqual(punch_queue.status(first)['status'], 'committed')
+        self.assertEqual(punch_queue.status(second)['status'], 'rejected')
+        self.assertEqual(punch_queue.pending_count(), 0)
+
+    def test_relation_is_validated_before_receipt(self):
+        _, other = _staff('E002', self.company)
+        # 對方今天已打卡：仍回應 403，不透露他人的打卡狀態
+        daily_presence.add(other.id, date.today())
+        self.addCleanup(daily_presence.discard, other.id, date.today())
+
+        response = self._clock_in(relation_id=999999)
+        self.assertEqual((response.status_code, response.json()['error']['code']), (400, 'RELATION_NOT_FOUND'))
+        response = self._clock_in(relation_id=other.id)
+        self.assertEqual((response.status_code, response.json()['error']['code']), (403, 'FORBIDDEN'))
+        self.assertEqual(punch_queue.pending_count(), 0)
+
+    def test_receipt_is_visible_to_owner_only(self):
+        receipt = self._clock_in().json()['data']['receipt']
+        other, _ = _staff('E002', self.company)
+        client = APIClient()
+        client.force_authenticate(other)
+
+        self.assertEqual(self._receipt(receipt, client).status_code, 404)
+        punch_queue.flush()
+        self.assertEqual(self._receipt(receipt, client).status_code, 404)
+        self.assertEqual(self._receipt(receipt).status_code, 200)
+        self.assertEqual(self._receipt('20250101-unknown').status_code, 404)
+
+    def test_disabled_queue_writes_synchronously(self):
+        with override_settings(PUNCH_QUEUE_ENABLED=False):
+            response = self._clock_in()
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(AttendanceRecords.objects.get().id, response.json()['data']['id'])
+        self.assertEqual(punch_queue.pending_count(), 0)
+
+
+class ScheduleResolverTests(TestCase):
+    """班表快取：預設班表、異動時失效與命中統計"""
+
+    def setUp(self):
+        self.company = _company()
+        self.default = WorkSchedule.objects.create(company_id=self.company, name='標準班', is_default=True)
+        self.night = WorkSchedule.objects.create(company_id=self.company, name='夜班', work_start_time=dt_time(22, 0))
+        _, self.relation = _staff('E001', self.company)
+        _, self.other = _staff('E002', self.company)
+        schedule_resolver.invalidate_all()
+
+    def test_resolve_many_falls_back_to_default(self):
+        self.other.work_schedule = self.night
+        self.other.save()
+
+        schedules = schedule_resolver.resolve_many([self.relation, self.other])
+        self.assertEqual(schedules, {self.relation.id: self.default, self.other.id: self.night})
+
+        # 公司沒有啟用中的預設班表
+        self.default.is_active = False
+        self.default.save()
+        self.assertIsNone(schedule_resolver.resolve(self.relation))
+
+    def test_stats_count_hits_and_misses(self):
+        before = schedule_resolver.stats()
+        schedule_resolver.resolve(self.relation)
+        schedule_resolver.resolve(self.relation)
+        schedule_resolver.resolve_many([self.relation, self.other])
+
+        after = schedule_resolver.stats()
+        self.assertEqual(after['misses'] - before['misses'], 2)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(after['cached_relations'], 2)
+
+    def test_schedule_changes_invalidate_cache(self):
+        self.assertEqual(schedule_resolver.resolve(self.relation).work_start_time, dt_time(9, 0))
+
+        self.default.work_start_time = dt_time(8, 30)
+        self.default.save()
+        self.assertEqual(schedule_resolver.resolve(self.relation).work_start_time, dt_time(8, 30))
+
+        self.relation.work_schedule = self.night
+        self.relation.save()
+        self.assertEqual(schedule_resolver.resolve(self.relation), self.night)
+
+        self.night.delete()
+        self.relation.refresh_from_db()
+        self.assertEqual(schedule_resolver.resolve(self.relation), self.default)
+
+        misses = schedule_resolver.stats()['misses']
+        schedule_resolver.resolve(self.relation)
+        self.assertEqual(schedule_resolver.stats()['misses'], misses)
+
+        # 任職關聯刪除後移出快取
+        cached = schedule_resolver.stats()['cached_relations']
+        self.relation.delete()
+        self.assertEqual(schedule_resolver.stats()['cached_relations'], cached - 1)
+
+
+class KioskBatchClockInTests(PunchTestCase):
+    """資訊站批次打卡：逐筆回傳結果，單筆失敗不影響其他筆"""
+
+    def setUp(self):
+        super().setUp()
+        kiosk = Employees.objects.create_user(employee_id='K001', username='kiosk', password='pw', role='manager')
+        self.kiosk = APIClient()
+        self.kiosk.force_authenticate(kiosk)
+        self.staff = [_staff(employee_id, self.company)[1] for employee_id in ('E002', 'E003')]
+        for relation in self.staff:
+            daily_presence.discard(relation.id, date.today())
+
+    def _batch(self, punches, client=None):
+        return (client or self.kiosk).post('/clock-in/batch/', {
+            'qr_latitude': '25.0330', 'qr_longitude': '121.5654', 'punches': punches
+        }, format='json')
+
+    def _punch(self, relation, **fields):
+        return {'relation_id': relation.id, 'user_latitude': '25.0331', 'user_longitude': '121.5655', **fields}
+
+    def test_partial_failures(self):
+        self.assertEqual(self._clock_in().status_code, 201)
+        _, branch = _staff('E009', _company(name='分公司', address='台中', latitude=24.1477, longitude=120.6736))
+        first, second = self.staff
+        punches = [
+            self._punch(first),
+            self._punch(self.relation),
+            self._punch(branch),
+            self._punch(second, user_latitude='26.0'),
+            self._punch(second, timestamp=(datetime.now() - timedelta(hours=2)).isoformat()),
+            {'relation_id': second.id},
+            self._punch(first),
+            self._punch(second),
+        ]
+
+        self.assertEqual(self._batch(punches, client=self.client).status_code, 403)
+        response = self._batch(punches)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()['data']
+
+        self.assertEqual((data['accepted'], data['rejected']), (2, 6))
+        results = data['results']
+        self.assertEqual([result['index'] for result in results], list(range(len(punches))))
+        self.assertEqual(
+            [result['error']['code'] if not result['success'] else None for result in results],
+            [None, 'ALREADY_CLOCKED_IN', 'RELATION_NOT_FOUND', 'LOCATION_OUT_OF_RANGE', 'INVALID_TIMESTAMP',
+             'MISSING_PARAMETERS', 'ALREADY_CLOCKED_IN', None]
+        )
+        self.assertEqual(
+            dict(AttendanceRecords.objects.filter(relation_id__in=self.staff).values_list('relation_id', 'id')),
+            {first.id: results[0]['id'], second.id: results[7]['id']}
+        )
+        self.assertEqual(AttendanceMonthlyRollup.objects.filter(relation_id__in=self.staff, days_present=1).count(), 2)
+
+    def test_concurrent_write_rejects_only_conflicting_punch(self):
+        first, second = self.staff
+        resolve_many = schedule_resolver.resolve_many
+
+        def write_first_then_resolve(relations):
+            # 批次查詢既有打卡之後，其他途徑寫入了同一天的記錄
+            now = datetime.now()
+            AttendanceRecords.objects.create(
+                relation_id=first, date=now.date(), checkin_time=now, checkout_time=now,
+                checkin_location='-', checkout_location='-', work_hours=Decimal('0.00')
+            )
+            return resolve_many(relations)
+
+        with mock.patch.object(schedule_resolver, 'resolve_many', side_effect=write_first_then_resolve):
+            response = self._batch([self._punch(first), self._punch(second)])
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()['data']['results']
+
+        self.assertEqual(results[0]['error']['code'], 'ALREADY_CLOCKED_IN')
+        self.assertTrue(results[1]['success'])
+        self.assertEqual(AttendanceRecords.objects.get(relation_id=second).id, results[1]['id'])
+        self.assertEqual(AttendanceMonthlyRollup.objects.get(relation_id=second).days_present, 1)
+        self.assertTrue(daily_presence.contains(first.id, date.today()))
+
+
+class IdempotencyKeyTests(PunchTestCase):
+    """Idempotency-Key：重送回放、處理中 409、內容不同 422"""
+
+    def _clock_in_with_key(self, key='key-1', **fields):
+        return self._clock_in(headers={'HTTP_IDEMPOTENCY_KEY': key}, **fields)
+
+    def test_replay_returns_saved_response(self):
+        first = self._clock_in_with_key()
+        self.assertEqual(first.status_code, 201, first.content)
+
+        # 重送時不再執行 view（不會因已打卡而回傳 400），只查詢冪等鍵
+        with CaptureQueriesContext(connection) as queries:
+            replay = self._clock_in_with_key()
+        other = [query['sql'] for query in queries if IdempotencyKey._meta.db_table not in query['sql']]
+        self.assertTrue(all('SAVEPOINT' in sql for sql in other), other)
+        self.assertEqual((replay.status_code, replay.json()), (201, first.json()))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(AttendanceRecords.objects.count(), 1)
+
+        # 未帶標頭的請求照常執行
+        self.assertEqual(self._clock_in().json()['error']['code'], 'ALREADY_CLOCKED_IN')
+
+    def test_reused_key_with_different_body(self):
+        self._clock_in_with_key()
+
+        response = self._clock_in_with_key(user_latitude='25.0332')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['error']['code'], 'IDEMPOTENCY_KEY_REUSED')
+
+    def test_in_flight_request(self):
+        # 第一次請求尚未完成：記錄已建立但沒有回應
+        key = IdempotencyKey.objects.create(
+            user=self.employee, key='key-1', request_fingerprint='-', expires_at=datetime.now() + timedelta(hours=1)
+        )
+
+        response = self._clock_in_with_key()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['error']['code'], 'IDEMPOTENCY_IN_PROGRESS')
+        self.assertFalse(AttendanceRecords.objects.exists())
+
+        # 處理中超過時限視為中斷，允許重新執行
+        IdempotencyKey.objects.filter(pk=key.pk).update(created_at=datetime.now() - timedelta(minutes=5))
+        self.assertEqual(self._clock_in_with_key().status_code, 201)
+
+    def test_keys_are_scoped_per_user_and_errors_are_not_saved(self):
+        other, relation = _staff('E002', self.company)
+        daily_presence.discard(relation.id, date.today())
+        client = APIClient()
+        client.force_authenticate(other)
+
+        with mock.patch('attendance.views.evaluate_lateness', side_effect=RuntimeError):
+            self.assertEqual(self._clock_in_with_key().status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        self.assertEqual(self._clock_in_with_key().status_code, 201)
+        response = client.post('/clock-in/', {
+            'qr_latitude': '25.0330', 'qr_longitude': '121.5654', 'user_latitude': '25.0331',
+            'user_longitude': '121.5655', 'relation_id': relation.id
+        }, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=datetime.now() - timedelta(seconds=1))
+        call_command('purge_idempotency_keys', stdout=io.StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class OfflineSyncTests(PunchTestCase):
+    """離線打卡同步：同日去重、與既有記錄去重、地理圍欄驗證"""
+
+    def _punch(self, punch_type, timestamp, **fields):
+        return {
+            'type': punch_type, 'timestamp': timestamp.isoformat(), 'qr_latitude': '25.0330',
+            'qr_longitude': '121.5654', 'user_latitude': '25.0331', 'user_longitude': '121.5655', **fields
+        }
+
+    def _sync(self, punches, relation=None):
+        return self.client.post('/offline-punches/sync/', {
+            'relation_id': (relation or self.relation).id, 'punches': punches
+        }, format='json')
+
+    def _day(self, days_ago, hour=9, minute=0):
+        return (datetime.now() - timedelta(days=days_ago)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    def test_dedupe_within_batch_and_against_existing_records(self):
+        synced, existing = self._day(2), self._day(1)
+        AttendanceRecords.objects.create(
+            relation_id=self.relation, date=existing.date(), checkin_time=existing, checkout_time=existing,
+            checkin_location='-', checkout_location='-', work_hours=Decimal('0.00')
+        )
+        punches = [
+            self._punch('in', synced),
+            self._punch('in', synced - timedelta(minutes=5)),
+            self._punch('out', synced + timedelta(hours=8)),
+            self._punch('out', synced + timedelta(hours=9)),
+            self._punch('in', existing),
+            self._punch('out', existing + timedelta(hours=9)),
+            self._punch('out', self._day(3, hour=18)),
+        ]
+
+        response = self._sync(punches)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()['data']
+        self.assertEqual(
+            [item['result'] for item in data['results']],
+            ['duplicate', 'created', 'duplicate', 'updated', 'duplicate', 'updated', 'rejected']
+        )
+        self.assertEqual(data['results'][6]['error']['code'], 'NO_CHECKIN')
+        self.assertEqual(data['summary'], {'duplicate': 3, 'created': 1, 'updated': 2, 'rejected': 1})
+
+        record = AttendanceRecords.objects.get(date=synced.date())
+        self.assertEqual(record.checkin_time, synced - timedelta(minutes=5))
+        self.assertEqual(record.checkout_time, synced + timedelta(hours=9))
+        self.assertEqual(record.work_hours, Decimal('9.08'))
+        self.assertEqual(AttendanceRecords.objects.get(date=existing.date()).work_hours, Decimal('9.00'))
+
+        # 重新同步同一批打卡不會再寫入
+        data = self._sync(punches).json()['data']
+        self.assertEqual(data['summary'], {'duplicate': 6, 'rejected': 1})
+
+    def test_geofence_and_window_rejections(self):
+        day = self._day(1)
+        branch = _company(name='分公司', address='台中', latitude=24.1477, longitude=120.6736, radius=500)
+        punches = [
+            self._punch('in', day, user_latitude='25.0500'),
+            self._punch('in', day, qr_latitude=str(branch.latitude), qr_longitude=str(branch.longitude),
+                        user_latitude='24.1477', user_longitude='120.6736'),
+            self._punch('in', day, qr_latitude='26.0000'),
+            self._punch('in', self._day(30)),
+            self._punch('in', day, user_latitude='abc'),
+            {'type': 'in'},
+        ]
+
+        data = self._sync(punches).json()['data']
+        self.assertEqual(
+            [item['error']['code'] for item in data['results']],
+            ['LOCATION_OUT_OF_RANGE', 'INVALID_QR_CODE', 'INVALID_QR_CODE', 'INVALID_TIMESTAMP',
+             'INVALID_COORDINATES', 'MISSING_PARAMETERS']
+        )
+        self.assertFalse(AttendanceRecords.objects.exists())
+
+        _, other = _staff('E002', self.company)
+        self.assertEqual(self._sync([self._punch('in', day)], relation=other).status_code, 403)
+
+
+class LocationAuditTests(TestCase):
+    """打卡位置稽核：回填舊資料的座標字串、依距離與打卡類型篩選"""
+
+    def setUp(self):
+        company = _company(radius=500)
+        branch = _company(name='分公司', address='台中', latitude=24.1477, longitude=120.6736, radius=500)
+        self.company_id = company.id
+        _, relation = _staff('E001', company)
+        _, branch_relation = _staff('E002', branch)
+        self.hr, _ = _staff('HR001', company, role='hr_admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.hr)
+
+        # 舊資料：只有 "lat, lng" 字串，尚無結構化座標
+        self.records = [
+            self._record(relation, 3, '25.0331, 121.5655', '25.0500, 121.5654'),
+            self._record(relation, 4, '25.0600, 121.5654'),
+            self._record(relation, 5, '補打卡', '補打卡'),
+            self._record(branch_relation, 3, '24.1600, 120.6736'),
+        ]
+
+    def _record(self, relation, day, checkin_location, checkout_location=None):
+        checkin = datetime(2025, 3, day, 9)
+        return AttendanceRecords.objects.create(
+            relation_id=relation, date=checkin.date(), checkin_time=checkin,
+            # 下班時間與上班時間相同表示尚未下班打卡
+            checkout_time=datetime(2025, 3, day, 18) if checkout_location else checkin,
+            checkin_location=checkin_location, checkout_location=checkout_location or checkin_location,
+            work_hours=Decimal('0.00')
+        )
+
+    def _backfill(self):
+        out = io.StringIO()
+        call_command('backfill_attendance_locations', batch_size=2, stdout=out)
+        return out.getvalue()
+
+    def _audit(self, **params):
+        params = {'start_date': '2025-03-01', 'end_date': '2025-03-31', 'min_distance': 100, **params}
+        return self.client.get('/hr/location-audit/', params)
+
+    def test_backfill_legacy_string_coordinates(self):
+        self.assertIn('共回填 3 筆', self._backfill())
+
+        near, far, legacy, branch = [AttendanceRecords.objects.get(pk=record.pk) for record in self.records]
+        self.assertEqual((near.checkin_latitude, near.checkin_longitude), (25.0331, 121.5655))
+        self.assertAlmostEqual(near.checkin_distance, 15.0, delta=1)
+        self.assertAlmostEqual(near.checkout_distance, 1890, delta=10)
+        # 尚未下班打卡：只回填上班座標
+        self.assertIsNotNone(far.checkin_distance)
+        self.assertIsNone(far.checkout_latitude)
+        # 無法解析的字串維持空值
+        self.assertIsNone(legacy.checkin_latitude)
+        # 距離以員工所屬公司計算
+        self.assertAlmostEqual(branch.checkin_distance, 1368, delta=10)
+
+        # 重複執行不再回填
+        self.assertIn('共回填 0 筆', self._backfill())
+
+    def test_audit_filters(self):
+        self._backfill()
+        near, far, _, branch = [record.id for record in self.records]
+
+        def ids(response):
+            self.assertEqual(response.status_code, 200, response.content)
+            return [record['id'] for record in response.json()['data']['records']]
+
+        self.assertEqual(ids(self._audit()), [near, branch, far])
+        self.assertEqual(ids(self._audit(punch_type='checkin')), [branch, far])
+        self.assertEqual(ids(self._audit(punch_type='checkout')), [near])
+        self.assertEqual(ids(self._audit(company_id=self.company_id)), [near, far])
+        self.assertEqual(ids(self._audit(min_distance=2000)), [far])
+        self.assertEqual(ids(self._audit(end_date='2025-03-03')), [near, branch])
+
+        data = self._audit(page=2, page_size=2).json()['data']
+        self.assertEqual((data['total'], data['total_pages']), (3, 2))
+        self.assertEqual([record['id'] for record in data['records']], [far])
+
+        self.assertEqual(self._audit(punch_type='lunch').status_code, 400)
+        self.assertEqual(self._audit(start_date='2025-03-31', end_date='2025-03-01').status_code, 400)
+        self.assertEqual(self._audit(start_date='2024-01-01', end_date='2025-03-01').status_code, 400)
+        employee = APIClient()
+        employee.force_authenticate(Employees.objects.get(employee_id='E001'))
+        self.assertEqual(employee.get('/hr/location-audit/').status_code, 403)
+
+
+class QRTokenTests(PunchTestCase):
+    """資訊站輪替 QR Code：簽章驗證、時間窗與寬限、金鑰輪替"""
+
+    # 時間窗起點
+    NOW = qr_tokens.WINDOW_SECONDS * 40000000
+
+    def _token(self, now=NOW):
+        return qr_tokens.issue_token(geofence_index.get(self.company.id), now)[0]
+
+    def _error(self, token, now):
+        with self.assertRaises(qr_tokens.InvalidQRToken) as raised:
+            qr_tokens.verify_token(token, now)
+        return raised.exception.code
+
+    def test_verify_window_and_grace(self):
+        token = self._token()
+        window = qr_tokens.WINDOW_SECONDS
+
+        self.assertEqual(qr_tokens.verify_token(token, self.NOW).id, self.company.id)
+        # 前 GRACE_WINDOWS 個時間窗仍有效
+        self.assertEqual(qr_tokens.verify_token(token, self.NOW + window * qr_tokens.GRACE_WINDOWS).id, self.company.id)
+        self.assertEqual(self._error(token, self.NOW + window * (qr_tokens.GRACE_WINDOWS + 1)), 'QR_CODE_EXPIRED')
+        # 未來時間窗的權杖
+        self.assertEqual(self._error(token, self.NOW - window), 'QR_CODE_EXPIRED')
+
+    def test_tampered_tokens(self):
+        token = self._token()
+        version, company_id, window, signature = token.split('.')
+        branch = _company(name='分公司', address='台中', latitude=24.1477, longitude=120.6736)
+
+        for tampered in (
+            f'{version}.{company_id}.{window}.{signature[:-1]}{"0" if signature[-1] != "0" else "1"}',
+            f'{version}.{branch.id}.{window}.{signature}',
+            f'{version}.{company_id}.{int(window) + 1}.{signature}',
+            f'v2.{company_id}.{window}.{signature}',
+            'not-a-token',
+        ):
+            self.assertEqual(self._error(tampered, self.NOW), 'INVALID_QR_CODE', tampered)
+
+    def test_secret_rotation_invalidates_tokens(self):
+        token = self._token()
+        self.company.qr_secret = generate_qr_secret()
+        self.company.save(update_fields=['qr_secret'])
+
+        self.assertEqual(self._error(token, self.NOW), 'INVALID_QR_CODE')
+        self.assertEqual(qr_tokens.verify_token(self._token(), self.NOW).id, self.company.id)
+
+    def test_kiosk_token_endpoint_and_clock_in(self):
+        manager = Employees.objects.create_user(employee_id='M001', username='M001', password='pw', role='manager')
+        kiosk = APIClient()
+        kiosk.force_authenticate(manager)
+
+        self.assertEqual(self.client.get('/kiosk/qr-token/', {'company_id': self.company.id}).status_code, 403)
+        self.assertEqual(kiosk.get('/kiosk/qr-token/', {'company_id': 999999}).status_code, 404)
+        data = kiosk.get('/kiosk/qr-token/', {'company_id': self.company.id}).json()['data']
+        self.assertLessEqual(data['expires_in'], qr_tokens.WINDOW_SECONDS)
+        self.assertNotIn('qr_secret', self.client.get(f'/companies/{self.company.id}/').json())
+
+        expired = self._token(self.NOW)
+        response = self._clock_in(qr_latitude=None, qr_longitude=None, qr_token=expired)
+        self.assertEqual(response.json()['error']['code'], 'QR_CODE_EXPIRED')
+
+        with override_settings(QR_REQUIRE_SIGNED_TOKEN=True):
+            self.assertEqual(self._clock_in().json()['error']['code'], 'QR_TOKEN_REQUIRED')
+            response = self._clock_in(qr_latitude=None, qr_longitude=None, qr_token=data['token'])
+        self.assertEqual(response.status_code, 201, response.content)
+
+
+class DepartmentReportTests(TestCase):
+    """部門報表：查詢數不隨員工人數增加（讀取月統計）"""
+
+    def setUp(self):
+        self.company, self.department = _organization()
+        self.hr = Employees.objects.create_user(employee_id='HR001', username='hr', password='pw', role='hr_admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.hr)
+        self.count = 0
+        cache.clear()
+
+    def _add_employee(self):
+        # 報表快取於交易提交後失效
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._create_employee()
+
+    def _create_employee(self):
+        self.count += 1
+        employee, relation = _staff(
+            f'E{self.count:03d}', self.company, self.department, username=f'emp{self.count}'
+        )
+        for day, late_minutes in ((2, 0), (3, 15)):
+            checkin = datetime(2025, 3, day, 9, late_minutes)
+            AttendanceRecords.objects.create(
+                relation_id=relation, date=checkin.date(), checkin_time=checkin,
+                checkout_time=datetime(2025, 3, day, 18, 0), checkin_location='-', checkout_location='-',
+                work_hours=Decimal('8.50'), is_late=bool(late_minutes), late_minutes=late_minutes
+            )
+        LeaveRecords.objects.create(
+            relation_id=relation, start_time=datetime(2025, 3, 10, 9), end_time=datetime(2025, 3, 10, 18),
+            leave_hours=Decimal('8.00'), status='approved'
+        )
+        OvertimeRecords.objects.create(
+            relation_id=relation, date=date(2025, 3, 11), start_time='18:00', end_time='20:00',
+            overtime_hours=Decimal('2.00'), reason='上線', status='approved'
+        )
+        return employee
+
+    def _report(self):
+        # 測試資料直接以 ORM 建立，未經增量更新路徑
+        rebuild_month(2025, 3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/manager/reports/department/', {'year': 2025, 'month': 3})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data'], len(queries)
+
+    def test_query_count_is_constant(self):
+        self._add_employee()
+        self._add_employee()
+        _, few = self._report()
+
+        for _ in range(5):
+            self._add_employee()
+        data, many = self._report()
+
+        self.assertEqual(data['employee_count'], 7)
+        self.assertEqual(few, many)
+
+    def test_output_format(self):
+        employee = self._add_employee()
+        data, _ = self._report()
+
+        row = next(item for item in data['employees'] if item['employee_id'] == employee.employee_id)
+        self.assertEqual(row, {
+            'employee_id': employee.employee_id,
+            'username': employee.username,
+            'department': '研發部',
+            'attendance': {
+                'total_days': 2,
+                'late_count': 1,
+                'late_minutes_total': 15,
+                'early_leave_count': 0,
+                'total_work_hours': 17.0,
+            },
+            'leave_hours': 8.0,
+            'overtime_hours': 2.0,
+        })
+
+
+class MonthlyRollupTests(TestCase):
+    """出勤月統計：增量更新結果與重建結果一致"""
+
+    def setUp(self):
+        company = _company()
+        self.employee, self.relation = _staff('E001', company, username='emp')
+
+    def _checkin(self, day, late_minutes=0):
+        record = AttendanceRecords.objects.create(
+            relation_id=self.relation, date=date(2025, 3, day),
+            checkin_time=datetime(2025, 3, day, 9, late_minutes), checkout_time=datetime(2025, 3, day, 9, late_minutes),
+            checkin_location='-', checkout_location='-', work_hours=Decimal('0.00'),
+            is_late=bool(late_minutes), late_minutes=late_minutes
+        )
+        add_attendance_records([record])
+        return record
+
+    def _checkout(self, record, hour, early_leave_minutes=0):
+        before = snapshot(record)
+        record.checkout_time = datetime(2025, 3, record.date.day, hour)
+        record.work_hours = Decimal(hour - 9)
+        record.is_early_leave = bool(early_leave_minutes)
+        record.early_leave_minutes = early_leave_minutes
+        record.save()
+        apply_attendance_change(before, snapshot(record))
+
+    def _rollup(self):
+        return AttendanceMonthlyRollup.objects.values(
+            'days_present', 'late_count', 'late_minutes', 'early_leave_count', 'early_leave_minutes',
+            'makeup_count', 'work_hours', 'leave_hours', 'overtime_hours'
+        ).get(relation_id=self.relation, year=2025, month=3)
+
+    def test_incremental_matches_rebuild(self):
+        first = self._checkin(3, late_minutes=10)
+        self._checkout(first, 18)
+        second = self._checkin(4)
+        self._checkout(second, 17, early_leave_minutes=60)
+        leave = LeaveRecords.objects.create(
+            relation_id=self.relation, start_time=datetime(2025, 3, 10, 9), end_time=datetime(2025, 3, 10, 18),
+            leave_hours=Decimal('8.00'), status='approved'
+        )
+        add_leave_hours(leave)
+
+        incremental = self._rollup()
+        self.assertEqual(incremental['days_present'], 2)
+        self.assertEqual(incremental['late_minutes'], 10)
+        self.assertEqual(incremental['early_leave_count'], 1)
+        self.assertEqual(incremental['work_hours'], Decimal('17.00'))
+        self.assertEqual(incremental['leave_hours'], Decimal('8.00'))
+
+        rebuild_month(2025, 3)
+        self.assertEqual(self._rollup(), incremental)
+
+    def test_delete_subtracts_record(self):
+        record = self._checkin(3, late_minutes=5)
+        self._checkin(4)
+        record.delete()
+
+        rollup = self._rollup()
+        self.assertEqual(rollup['days_present'], 1)
+        self.assertEqual(rollup['late_count'], 0)
+        self.assertEqual(rollup['late_minutes'], 0)
+
+    def test_delete_without_rollup_rebuilds_from_records(self):
+        record = self._checkin(3, late_minutes=5)
+        self._checkin(4)
+        AttendanceMonthlyRollup.objects.all().delete()
+        record.delete()
+
+        # 統計列不存在時不以負差額建立，而是由剩餘的出勤記錄重建
+        rollup = self._rollup()
+        self.assertEqual(rollup['days_present'], 1)
+        self.assertEqual(rollup['late_count'], 0)
+
+    def test_deleting_employee_with_attendance(self):
+        self._checkin(3, late_minutes=5)
+        self._checkin(4)
+
+        self.employee.delete()
+
+        self.assertFalse(AttendanceRecords.objects.exists())
+        self.assertFalse(AttendanceMonthlyRollup.objects.exists())
+        # 連鎖刪除時不可寫入參照已刪除關聯的統計列
+        connection.check_constraints()
+
+
+class ManagerDashboardTests(TestCase):
+    """主管儀表板：讀取部門每日計數"""
+
+    def setUp(self):
+        self.company, self.department = _organization()
+        self.manager = Employees.objects.create_user(
+            employee_id='M001', username='manager', password='pw', role='manager', department=self.department
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+        self.today = date.today()
+        self.count = 0
+        cache.clear()
+
+    def _add_employee(self, checkin=False, is_late=False):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self._create_employee(checkin, is_late)
+
+    def _create_employee(self, checkin, is_late):
+        self.count += 1
+        employee, relation = _staff(
+            f'E{self.count:03d}', self.company, self.department, username=f'emp{self.count}'
+        )
+        if checkin:
+            now = datetime.now()
+            record = AttendanceRecords.objects.create(
+                relation_id=relation, date=self.today, checkin_time=now, checkout_time=now,
+                checkin_location='-', checkout_location='-', work_hours=Decimal('0.00'),
+                is_late=is_late, late_minutes=5 if is_late else 0
+            )
+            add_attendance_records([record])
+            return record
+        return employee
+
+    def _dashboard(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/manager/dashboard/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data'], len(queries)
+
+    def test_counts_follow_punches(self):
+        self._add_employee(checkin=True, is_late=True)
+        record = self._add_employee(checkin=True)
+        absent = self._add_employee()
+
+        data, _ = self._dashboard()
+        self.assertEqual(data['summary'], {
+            'total_employees': 3,
+            'checked_in': 2,
+            'not_checked_in': 1,
+            'late_count': 1,
+            'early_leave_count': 0,
+        })
+        self.assertEqual(data['not_checked_in_list'], [{'employee_id': absent.employee_id, 'username': absent.username}])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            # 下班打卡標記早退
+            before = snapshot(record)
+            record.is_early_leave, record.early_leave_minutes = True, 30
+            record.save()
+            apply_attendance_change(before, snapshot(record))
+            # 刪除記錄
+            AttendanceRecords.objects.filter(is_late=True).get().delete()
+
+        data, _ = self._dashboard()
+        self.assertEqual(data['summary']['checked_in'], 1)
+        self.assertEqual(data['summary']['late_count'], 0)
+        self.assertEqual(data['summary']['early_leave_count'], 1)
+        self.assertEqual(len(data['not_checked_in_list']), 2)
+
+        counter = DepartmentDailyAttendance.objects.get(department=self.department, date=self.today)
+        self.assertEqual(
+            (counter.checked_in_count, counter.late_count, counter.early_leave_count), (1, 0, 1)
+        )
+
+    def test_employee_with_two_companies_counts_once(self):
+        # 應出勤人數以員工計，已打卡人數也以員工計
+        employee = self._add_employee()
+        branch = _company(name='分公司')
+        second = EmpCompanyRel.objects.create(
+            employee_id=employee, company_id=branch, employment_status=True, hire_date=date(2024, 1, 1)
+        )
+        now = datetime.now()
+        records = []
+        with self.captureOnCommitCallbacks(execute=True):
+            for relation, is_late in ((employee.employee.get(company_id=self.company), False), (second, True)):
+                record = AttendanceRecords.objects.create(
+                    relation_id=relation, date=self.today, checkin_time=now, checkout_time=now,
+                    checkin_location='-', checkout_location='-', work_hours=Decimal('0.00'), is_late=is_late
+                )
+                add_attendance_records([record])
+                records.append(record)
+
+        data, _ = self._dashboard()
+        self.assertEqual(
+            (data['summary']['total_employees'], data['summary']['checked_in'], data['summary']['late_count']),
+            (1, 1, 1)
+        )
+
+        # 刪除其中一筆：仍有另一筆記錄，已打卡不變；遲到的那筆刪除後不再計為遲到
+        with self.captureOnCommitCallbacks(execute=True):
+            records[1].delete()
+        counter = DepartmentDailyAttendance.objects.get(department=self.department, date=self.today)
+        self.assertEqual((counter.checked_in_count, counter.late_count), (1, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            records[0].delete()
+        counter.refresh_from_db()
+        self.assertEqual((counter.checked_in_count, counter.late_count), (0, 0))
+
+    def test_headcount_refreshes_only_on_department_or_status_change(self):
+        employee = self._add_employee()
+        self._add_employee()
+        counter = department_days([self.department.id], self.today)[0]
+        self.assertEqual(counter.expected_headcount, 3)  # 含部門主管
+        table = DepartmentDailyAttendance._meta.db_table
+
+        # 個人資料、登入不重新計算
+        employee = Employees.objects.get(pk=employee.pk)
+        with CaptureQueriesContext(connection) as queries:
+            employee.phone = '0912345678'
+            employee.save()
+            employee.save(update_fields=['last_login'])
+        self.assertFalse([query for query in queries.captured_queries if table in query['sql']])
+
+        employee.is_active = False
+        employee.save()
+        counter.refresh_from_db()
+        self.assertEqual(counter.expected_headcount, 2)
+
+        other = Departments.objects.create(name='業務部', company_id=self.company)
+        moved = Employees.objects.only('pk').get(employee_id='E002')
+        moved.department = other
+        moved.save(update_fields=['department'])
+        counter.refresh_from_db()
+        self.assertEqual(counter.expected_headcount, 1)
+
+    def test_checkout_without_flag_change_skips_department_row(self):
+        record = self._add_employee(checkin=True)
+        table = DepartmentDailyAttendance._meta.db_table
+
+        before = snapshot(record)
+        record.checkout_time, record.work_hours = datetime.now(), Decimal('8.00')
+        record.save()
+        with CaptureQueriesContext(connection) as queries:
+            apply_attendance_change(before, snapshot(record))
+        # 部門計數不變，不寫入（也不鎖定）整個部門共用的計數列
+        self.assertFalse([query for query in queries.captured_queries if table in query['sql']])
+
+    def test_query_count_is_constant(self):
+        self._add_employee(checkin=True)
+        self._dashboard()
+        self._add_employee(checkin=True)
+        _, few = self._dashboard()
+
+        for _ in range(10):
+            self._add_employee(checkin=True)
+            self._add_employee()
+        data, many = self._dashboard()
+
+        self.assertEqual(data['summary']['total_employees'], 22)
+        self.assertEqual(data['summary']['checked_in'], 12)
+        self.assertEqual(few, many)
+
+        # 未異動時由報表快取回應
+        _, cached = self._dashboard()
+        self.assertLess(cached, many)
+
+
+class ReportCacheTests(TestCase):
+    """報表快取：命中與依標籤失效"""
+
+    def setUp(self):
+        cache.clear()
+        company = _company()
+        self.relations = {}
+        self.clients = {}
+        for employee_id in ('E001', 'E002'):
+            employee, self.relations[employee_id] = _staff(employee_id, company)
+            self.clients[employee_id] = APIClient()
+            self.clients[employee_id].force_authenticate(employee)
+
+    def _summary(self, employee_id, month=3):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.clients[employee_id].get('/reports/attendance-summary/', {'year': 2025, 'month': month})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']['attendance']['total_days'], len(queries)
+
+    def _checkin(self, employee_id, day):
+        with self.captureOnCommitCallbacks(execute=True):
+            AttendanceRecords.objects.create(
+                relation_id=self.relations[employee_id], date=date(2025, 3, day),
+                checkin_time=datetime(2025, 3, day, 9), checkout_time=datetime(2025, 3, day, 18),
+                checkin_location='-', checkout_location='-', work_hours=Decimal('9.00')
+            )
+
+    @mock.patch('attendance.report_cache.CLOSED_PERIOD_TTL', 30 * 24 * 60 * 60)
+    def test_closed_period_ttl_requires_shared_cache(self):
+        # LocMemCache 的標籤失效只作用在單一程序，已結束期間不長時間保存
+        self.assertEqual(report_cache.closed_period_ttl, OPEN_PERIOD_TTL)
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'ams_cache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(report_cache.closed_period_ttl, 30 * 24 * 60 * 60)
+
+    def test_hit_skips_queries(self):
+        self._checkin('E001', 3)
+        days, first = self._summary('E001')
+        cached_days, second = self._summary('E001')
+
+        self.assertEqual((days, cached_days), (1, 1))
+        self.assertLess(second, first)
+
+    def test_invalidates_only_affected_entries(self):
+        self._summary('E001')
+        self._summary('E002')
+        self._summary('E001', month=4)
+
+        self._checkin('E001', 4)
+
+        days, queries = self._summary('E001')
+        self.assertEqual(days, 1)
+        _, other_employee = self._summary('E002')
+        _, other_month = self._summary('E001', month=4)
+        self.assertLess(other_employee, queries)
+        self.assertLess(other_month, queries)
+
+
+class AttendanceSummaryTests(TestCase):
+    """個人出勤摘要：單一查詢、月份區間"""
+
+    def setUp(self):
+        cache.clear()
+        company = _company()
+        employee, relation = _staff('E001', company)
+        for day, late, early in ((3, 10, 0), (4, 0, 15), (5, 0, 0)):
+            AttendanceRecords.objects.create(
+                relation_id=relation, date=date(2025, 3, day),
+                checkin_time=datetime(2025, 3, day, 9), checkout_time=datetime(2025, 3, day, 18),
+                checkin_location='-', checkout_location='-', work_hours=Decimal('8.50'),
+                is_late=bool(late), late_minutes=late, is_early_leave=bool(early), early_leave_minutes=early,
+                is_makeup=day == 5
+            )
+        # 4 月整月請假，沒有出勤記錄
+        LeaveRecords.objects.create(
+            relation_id=relation, start_time=datetime(2025, 4, 1, 9), end_time=datetime(2025, 4, 1, 18),
+            leave_hours=Decimal('8.00'), status='approved'
+        )
+        LeaveRecords.objects.create(
+            relation_id=relation, start_time=datetime(2025, 3, 31, 9), end_time=datetime(2025, 3, 31, 18),
+            leave_hours=Decimal('4.00'), status='pending'
+        )
+        OvertimeRecords.objects.create(
+            relation_id=relation, date=date(2025, 3, 4), start_time=datetime(2025, 3, 4, 18).time(),
+            end_time=datetime(2025, 3, 4, 20).time(), overtime_hours=Decimal('2.00'), reason='-', status='approved'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(employee)
+
+    def _get(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/reports/attendance-summary/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data'], len(queries)
+
+    def test_single_month_in_one_query(self):
+        data, queries = self._get({'year': 2025, 'month': 3})
+
+        self.assertEqual(queries, 1)
+        self.assertEqual(data['period']['end_date'], '2025-03-31')
+        self.assertEqual(data['attendance'], {
+            'total_days': 3, 'late_count': 1, 'late_minutes_total': 10, 'early_leave_count': 1,
+            'early_leave_minutes_total': 15, 'makeup_count': 1, 'total_work_hours': 25.5
+        })
+        self.assertEqual((data['leave']['total_hours'], data['overtime']['total_hours']), (0.0, 2.0))
+
+    def test_month_range(self):
+        data, queries = self._get({'start_month': '2025-02', 'end_month': '2025-04'})
+
+        self.assertEqual(queries, 1)
+        self.assertEqual([(m['month'], m['attendance']['total_days'], m['leave']['total_hours']) for m in data['months']],
+                         [(2, 0, 0.0), (3, 3, 0.0), (4, 0, 8.0)])
+        self.assertEqual(data['total']['attendance']['late_minutes_total'], 10)
+        self.assertEqual((data['total']['leave']['total_hours'], data['total']['overtime']['total_hours']), (8.0, 2.0))
+
+        response = self.client.get('/reports/attendance-summary/', {'start_month': '2024-01', 'end_month': '2025-03'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ApprovalPolicyMatcherTests(TestCase):
+    """審批政策區間表：二分搜尋、公司優先、異動時重建"""
+
+    def setUp(self):
+        self.company = _company()
+        approval_policies.invalidate()
+        # 測試資料庫回滾不會觸發 signals
+        self.addCleanup(approval_policies.invalidate)
+        self.addCleanup(approver_directory.invalidate)
+
+    def _policy(self, min_days, max_days, role, company=None):
+        return ApprovalPolicy.objects.create(
+            policy_name=role, company_id=company, min_days=min_days, max_days=max_days,
+            approval_levels=[{'level': 1, 'role': role}]
+        )
+
+    def _role(self, company_id, days):
+        return approval_policies.resolve(company_id, days)[1][0]['role']
+
+    def test_overlapping_policies_prefer_lower_min_days(self):
+        segments = compile_segments([(1, 'a', 0, 3, []), (2, 'b', 1, 5, []), (3, 'c', 2, 4, []), (4, 'd', 5, None, [])])
+
+        self.assertEqual([(s.lower, s.lower_open, s.upper, s.policy_id) for s in segments],
+                         [(0, False, 3, 1), (3, True, 5, 2), (5, True, None, 4)])
+
+    def test_global_policies_take_precedence(self):
+        # 與原本的 order_by('company_id', 'min_days') 相同：全域政策（company_id 為 NULL）優先，
+        # 全域政策未涵蓋的天數才使用公司政策
+        self._policy(0, 3, 'manager')
+        self._policy(3.5, None, 'ceo')
+        self._policy(1, 2, 'hr', company=self.company)
+        self._policy(3, 3.4, 'hr', company=self.company)
+
+        with self.assertNumQueries(1):
+            roles = [self._role(self.company.id, days) for days in (0.5, 1.5, 3, 3.2, 10)]
+        self.assertEqual(roles, ['manager', 'manager', 'manager', 'hr', 'ceo'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._role(None, 1), 'manager')
+
+        # 政策異動後重建
+        ApprovalPolicy.objects.filter(company_id__isnull=True, min_days=0).update(is_active=False)
+        approval_policies.invalidate()
+        self.assertEqual(self._role(self.company.id, 1.5), 'hr')
+        self.assertEqual(self._role(self.company.id, 2.5), 'manager')  # 皆無時只需主管審批
+
+    def test_apply_leave_uses_matched_policy(self):
+        self._policy(0, None, 'hr', company=self.company)
+        hr = Employees.objects.create_user(employee_id='HR001', username='HR001', password='pw', role='hr_admin')
+        employee, relation = _staff('E001', self.company)
+        client = APIClient()
+        client.force_authenticate(employee)
+
+        response = client.post('/leave/apply/', {
+            'relation_id': relation.id, 'leave_type': 'annual', 'start_time': '2025-03-03T09:00:00',
+            'end_time': '2025-03-03T18:00:00', 'leave_hours': 8
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201, response.content)
+        data = response.json()['data']
+        self.assertEqual(data['policy_name'], 'hr')
+        self.assertEqual([approval['approver_id'] for approval in data['approvals']], [hr.employee_id])
+
+
+class ApproverDirectoryTests(TestCase):
+    """審批人目錄：依 (公司, 角色) 查詢、輪流與待審件數最少分派"""
+
+    def setUp(self):
+        self.company = _company()
+        self.branch = Companies.objects.create(name='分公司', address='台中', latitude=24.1477, longitude=120.6736)
+        self.hr = [self._employee(f'P00{index}', 'hr_admin', self.company) for index in range(2)]
+        self._employee('P009', 'hr_admin', self.branch)
+        self.applicant = self._employee('E001', 'employee', self.company)
+        self.relation = EmpCompanyRel.objects.get(employee_id=self.applicant)
+        self.addCleanup(approver_directory.invalidate)
+
+    def _employee(self, employee_id, role, company):
+        employee, _ = _staff(employee_id, company, role=role)
+        return employee
+
+    def test_round_robin_within_company(self):
+        approver_directory.load()
+
+        with self.assertNumQueries(0):
+            assigned = [approver_directory.assign(self.company.id, 'hr', strategy='round_robin').employee_id
+                        for _ in range(4)]
+        self.assertEqual(sorted(assigned), ['P000', 'P000', 'P001', 'P001'])
+        # 公司內沒有 CEO：改用舊版員工編號前綴
+        self.assertIsNone(approver_directory.assign(self.company.id, 'ceo'))
+        self._employee('CEO01', 'employee', self.branch)
+        self.assertEqual(approver_directory.assign(self.company.id, 'ceo').employee_id, 'CEO01')
+
+    def test_least_pending_and_manager_chain(self):
+        leave = LeaveRecords.objects.create(
+            relation_id=self.relation, start_time=datetime(2025, 3, 3, 9), end_time=datetime(2025, 3, 3, 18),
+            leave_hours=Decimal('8.00')
+        )
+        for _ in range(2):
+            ApprovalRecords.objects.create(leave_id=leave, approver_id=self.hr[0])
+        approver_directory.load()
+
+        # 每次分派讀取一次待審計數列
+        with self.assertNumQueries(3):
+            assigned = {approver_directory.assign(self.company.id, 'hr', strategy='least_pending').employee_id
+                        for _ in range(3)}
+        self.assertEqual(assigned, {'P001'})
+
+        # 沒有直屬主管與部門主管時，從公司內的 manager 分派；申請人本身排除
+        self.assertIsNone(approver_directory.manager_for(self.relation, exclude='E001'))
+        manager = self._employee('M001', 'manager', self.company)
+        self.assertEqual(approver_directory.manager_for(self.relation, exclude='E001').employee_id, 'M001')
+        department = Departments.objects.create(name='研發部', company_id=self.company, manager=self.hr[1])
+        Employees.objects.filter(pk=self.applicant.pk).update(department=department)
+        approver_directory.invalidate()
+        self.assertEqual(approver_directory.manager_for(self.relation).employee_id, 'P001')
+        self.relation.direct_manager = manager
+        self.assertEqual(approver_directory.manager_for(self.relation).employee_id, 'M001')
+
+
+class ApprovalInboxTests(TestCase):
+    """審批收件匣：三種待審記錄以 UNION 合併、游標分頁"""
+
+    def setUp(self):
+        company = _company()
+        self.manager = Employees.objects.create_user(employee_id='M001', username='M001', password='pw', role='manager')
+        other = Employees.objects.create_user(employee_id='M002', username='M002', password='pw', role='manager')
+        employee, relation = _staff('E001', company, username='王小明')
+        leave = LeaveRecords.objects.create(
+            relation_id=relation, leave_type='sick', start_time=datetime(2025, 3, 3, 9),
+            end_time=datetime(2025, 3, 3, 18), leave_hours=Decimal('8.00'), leave_reason='感冒'
+        )
+        overtime = OvertimeRecords.objects.create(
+            relation_id=relation, date=date(2025, 3, 4), start_time=datetime(2025, 3, 4, 18).time(),
+            end_time=datetime(2025, 3, 4, 20).time(), overtime_hours=Decimal('2.00'), reason='上線'
+        )
+        makeup = MakeupClockRequest.objects.create(
+            relation_id=relation, date=date(2025, 3, 5), makeup_type='checkin', reason='忘記打卡'
+        )
+        approvals = [
+            ApprovalRecords.objects.create(leave_id=leave, approver_id=self.manager),
+            OvertimeApproval.objects.create(overtime_id=overtime, approver_id=self.manager),
+            MakeupClockApproval.objects.create(request_id=makeup, approver_id=self.manager),
+            ApprovalRecords.objects.create(leave_id=leave, approver_id=self.manager, approval_level=2),
+        ]
+        # 送出時間：請假、加班、補打卡同一時間，第二筆請假最晚
+        for approval, minute in zip(approvals, (0, 0, 0, 5)):
+            type(approval).objects.filter(pk=approval.pk).update(created_at=datetime(2025, 3, 6, 9, minute))
+        ApprovalRecords.objects.create(leave_id=leave, approver_id=other)
+        ApprovalRecords.objects.create(leave_id=leave, approver_id=self.manager, status='approved')
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def _get(self, params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/approval/inbox/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data'], len(queries)
+
+    def test_cursor_pagination_over_union(self):
+        pages = []
+        params = {'limit': 2}
+        while True:
+            data, queries = self._get(params)
+            # 一頁一個 UNION 查詢，加上一次件數查詢
+            self.assertEqual(queries, 2)
+            pages.append([(item['type'], item['approval_level']) for item in data['items']])
+            if not data['has_more']:
+                break
+            params['cursor'] = data['next_cursor']
+
+        self.assertEqual(pages, [[('leave', 1), ('makeup', 1)], [('overtime', 1), ('leave', 2)]])
+        self.assertEqual(data['counts'], {'leave': 2, 'overtime': 1, 'makeup': 1, 'total': 4})
+
+    def test_type_filter_and_normalized_fields(self):
+        data, _ = self._get({'type': 'overtime,makeup'})
+
+        self.assertEqual([item['type'] for item in data['items']], ['makeup', 'overtime'])
+        makeup, overtime = data['items']
+        self.assertEqual(overtime['applicant'], {'employee_id': 'E001', 'name': '王小明'})
+        self.assertEqual((overtime['date'], overtime['hours'], overtime['reason']), ('2025-03-04', 2.0, '上線'))
+        self.assertEqual((makeup['hours'], makeup['category_display']), (None, '補上班打卡'))
+        self.assertEqual(data['counts']['total'], 4)
+
+        response = self.client.get('/approval/inbox/', {'type': 'vacation'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/approval/inbox/', {'cursor': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchApproveTests(TestCase):
+    """批次審批：整批查詢、額度合併更新、通知"""
+
+    def setUp(self):
+        cache.clear()
+        company = _company()
+        self.manager = Employees.objects.create_user(employee_id='M001', username='M001', password='pw', role='manager')
+        self.other = Employees.objects.create_user(employee_id='M002', username='M002', password='pw', role='manager')
+        self.relations = []
+        for index in range(3):
+            employee, relation = _staff(f'E00{index}', company)
+            self.relations.append(relation)
+            LeaveBalances.objects.create(
+                employee_id=employee, year=2025, leave_type='annual', total_hours=Decimal('80.00'), used_hours=Decimal('0')
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.manager)
+
+    def _post(self, approval_type, ids, action='approve', comment=''):
+        return self.client.post('/approval/batch/', {
+            'approval_type': approval_type, 'approval_ids': ids, 'action': action, 'comment': comment
+        }, format='json')
+
+    def _leave_approvals(self, per_relation):
+        approvals = []
+        for relation in self.relations:
+            for day in range(1, per_relation + 1):
+                leave = LeaveRecords.objects.create(
+                    relation_id=relation, leave_type='annual', start_time=datetime(2025, 3, day, 9),
+                    end_time=datetime(2025, 3, day, 13), leave_hours=Decimal('4.00')
+                )
+                approvals.append(ApprovalRecords.objects.create(leave_id=leave, approver_id=self.manager))
+        return approvals
+
+    def test_approve_leaves_in_bulk(self):
+        approvals = self._leave_approvals(per_relation=3)
+        foreign = ApprovalRecords.objects.create(leave_id=approvals[0].leave_id, approver_id=self.other)
+        ids = [approval.id for approval in approvals]
+        first, rest = ids[0::3], [pk for pk in ids if pk not in ids[0::3]]
+        # 月統計列已存在，之後每位員工每月只需一次累加
+        for relation in self.relations:
+            AttendanceMonthlyRollup.objects.create(relation_id=relation, year=2025, month=3)
+
+        with CaptureQueriesContext(connection) as small:
+            response = self._post('leave', first)
+        self.assertEqual(response.status_code, 200, response.content)
+
+        with CaptureQueriesContext(connection) as large:
+            response = self._post('leave', rest + [ids[0], foreign.id, 999999, 'x'])
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()['data']
+
+        # 查詢數與筆數無關
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(data['processed'], rest)
+        self.assertEqual([item['reason'] for item in data['failed']], ['已處理過', '無權限審批', '記錄不存在', '記錄不存在'])
+
+        self.assertFalse(LeaveRecords.objects.exclude(status='approved').exists())
+        for balance in LeaveBalances.objects.all():
+            self.assertEqual((balance.used_hours, balance.remaining_hours), (Decimal('12.00'), Decimal('68.00')))
+        self.assertEqual(
+            sorted(AttendanceMonthlyRollup.objects.values_list('relation_id', 'leave_hours')),
+            [(relation.id, Decimal('12.00')) for relation in self.relations]
+        )
+        self.assertEqual(Notifications.objects.filter(title='請假申請已批准').count(), 9)
+
+    def test_overtime_compensatory_balance_and_rejection(self):
+        approvals = []
+        for relation in self.relations[:2]:
+            for day in (3, 4):
+                overtime = OvertimeRecords.objects.create(
+                    relation_id=relation, date=date(2025, 3, day), start_time=datetime(2025, 3, day, 18).time(),
+                    end_time=datetime(2025, 3, day, 20).time(), overtime_hours=Decimal('2.00'),
+                    compensatory_hours=Decimal('2.00'), reason='-'
+                )
+                approvals.append(OvertimeApproval.objects.create(overtime_id=overtime, approver_id=self.manager))
+
+        response = self._post('overtime', [approval.id for approval in approvals[:3]])
+        self.assertEqual(response.status_code, 200, response.content)
+        balances = dict(LeaveBalances.objects.filter(leave_type='compensatory').values_list(
+            'employee_id', 'remaining_hours'
+        ))
+        self.assertEqual(balances, {'E000': Decimal('4.00'), 'E001': Decimal('2.00')})
+
+        response = self._post('overtime', [approvals[3].id], action='reject', comment='不需要')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(OvertimeRecords.objects.get(pk=approvals[3].overtime_id_id).status, 'rejected')
+        self.assertEqual(
+            Notifications.objects.get(related_id=approvals[3].overtime_id_id).content,
+            '您 2025-03-04 的加班申請已被拒絕。原因：不需要'
+        )
+
+    def test_failure_rolls_back_whole_batch(self):
+        approvals = self._leave_approvals(per_relation=1)
+
+        with mock.patch('attendance.views.add_approved_records', side_effect=RuntimeError):
+            response = self._post('leave', [approval.id for approval in approvals])
+        self.assertEqual(response.status_code, 500)
+
+        self.assertFalse(ApprovalRecords.objects.exclude(status='pending').exists())
+        self.assertFalse(LeaveBalances.objects.exclude(used_hours=0).exists())
+        self.assertFalse(Notifications.objects.exists())
+
+
+class PendingCounterTests(TestCase):
+    """審批人待審件數：隨審批記錄增量維護、reconcile 修正偏差"""
+
+    def setUp(self):
+        company = _company()
+        self.manager = Employees.objects.create_user(employee_id='M001', username='M001', password='pw', role='manager')
+        self.other = Employees.objects.create_user(employee_id='M002', username='M002', password='pw', role='manager')
+        self.employee, self.relation = _staff('E001', company)
+        LeaveBalances.objects.create(
+            employee_id=self.employee, year=2025, leave_type='annual', total_hours=Decimal('80.00'),
+            used_hours=Decimal('0')
+        )
+        cache.clear()
+
+    def _counts(self, approver):
+        counter = PendingApprovalCounter.objects.filter(approver=approver).first()
+        if counter is None:
+            return (0, 0, 0)
+        return (counter.leave_count, counter.overtime_count, counter.makeup_count)
+
+    def _leave_approval(self, day, approver=None):
+        leave = LeaveRecords.objects.create(
+            relation_id=self.relation, leave_type='annual', start_time=datetime(2025, 3, day, 9),
+            end_time=datetime(2025, 3, day, 13), leave_hours=Decimal('4.00')
+        )
+        return ApprovalRecords.objects.create(leave_id=leave, approver_id=approver or self.manager)
+
+    def _overtime_approval(self, day):
+        overtime = OvertimeRecords.objects.create(
+            relation_id=self.relation, date=date(2025, 3, day), start_time=datetime(2025, 3, day, 18).time(),
+            end_time=datetime(2025, 3, day, 20).time(), overtime_hours=Decimal('2.00'), reason='-'
+        )
+        return OvertimeApproval.objects.create(overtime_id=overtime, approver_id=self.manager)
+
+    def test_counters_follow_approval_changes(self):
+        first, second = self._leave_approval(3), self._leave_approval(4)
+        overtime = self._overtime_approval(5)
+        makeup = MakeupClockRequest.objects.create(
+            relation_id=self.relation, date=date(2025, 3, 6), makeup_type='checkin', reason='-'
+        )
+        MakeupClockApproval.objects.create(request_id=makeup, approver_id=self.manager)
+        self.assertEqual(self._counts(self.manager), (2, 1, 1))
+
+        # 核准：-1；改派：原審批人 -1、新審批人 +1；再次儲存不重複扣減
+        approval = ApprovalRecords.objects.get(pk=first.pk)
+        approval.status = 'approved'
+        approval.save()
+        approval.save()
+        second.approver_id = self.other
+        second.save()
+        self.assertEqual(self._counts(self.manager), (0, 1, 1))
+        self.assertEqual(self._counts(self.other), (1, 0, 0))
+
+        # 刪除待審記錄；申請人取消加班（QuerySet.update）
+        MakeupClockApproval.objects.get().delete()
+        self.employee.refresh_from_db()
+        client = APIClient()
+        client.force_authenticate(self.employee)
+        response = client.post(f'/overtime/cancel/{overtime.overtime_id_id}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self._counts(self.manager), (0, 0, 0))
+
+    def test_batch_approve_and_dashboard(self):
+        approvals = [self._leave_approval(day) for day in (3, 4, 5)]
+        client = APIClient()
+        client.force_authenticate(self.manager)
+
+        response = client.post('/approval/batch/', {
+            'approval_type': 'leave', 'approval_ids': [approval.id for approval in approvals[:2]], 'action': 'approve'
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self._counts(self.manager), (1, 0, 0))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/manager/dashboard/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['data']['pending_approvals'], {
+            'leave': 1, 'overtime': 0, 'makeup': 0, 'total': 1
+        })
+        self.assertEqual(sum(PendingApprovalCounter._meta.db_table in query['sql'] for query in queries), 1)
+
+    def test_deleting_approver_with_pending_items(self):
+        self._leave_approval(3)
+        self._leave_approval(4, approver=self.other)
+        self._overtime_approval(5)
+
+        self.manager.delete()
+
+        self.assertFalse(PendingApprovalCounter.objects.filter(approver_id='M001').exists())
+        self.assertEqual(self._counts(self.other), (1, 0, 0))
+        # 連鎖刪除審批記錄時不可以負差額建立參照已刪除審批人的計數列
+        connection.check_constraints()
+
+    def test_missing_counter_is_not_created_from_decrement(self):
+        approval = self._leave_approval(3)
+        PendingApprovalCounter.objects.all().delete()
+
+        approval.delete()
+        self.assertFalse(PendingApprovalCounter.objects.exists())
+
+    def test_reconcile_fixes_drift(self):
+        self._leave_approval(3)
+        self._overtime_approval(4)
+        PendingApprovalCounter.objects.update(leave_count=99)
+        # 繞過 signals 新增的待審記錄
+        ApprovalRecords.objects.bulk_create([
+            ApprovalRecords(leave_id=LeaveRecords.objects.get(), approver_id=self.other)
+        ])
+
+        out = io.StringIO()
+        call_command('reconcile_pending_counters', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(self._counts(self.manager), (1, 1, 0))
+        self.assertEqual(self._counts(self.other), (1, 0, 0))
+
+        # 已一致時不再修正
+        out = io.StringIO()
+        call_command('reconcile_pending_counters', stdout=out)
+        self.assertIn('已修正 0 位', out.getvalue())
+
+
+class AnomalyListTests(TestCase):
+    """出勤異常清單：半開日期區間與游標分頁"""
+
+    def setUp(self):
+        cache.clear()
+        company = _company()
+        employee, self.relation = _staff('E001', company)
+        # 2025-01-30 ~ 2025-03-03 每天一筆，奇數日遲到
+        day = date(2025, 1, 30)
+        while day <= date(2025, 3, 3):
+            AttendanceRecords.objects.create(
+                relation_id=self.relation, date=day,
+                checkin_time=datetime.combine(day, datetime.min.time()), checkout_time=datetime.combine(day, datetime.max.time()),
+                checkin_location='-', checkout_location='-', work_hours=Decimal('9.00'),
+                is_late=day.day % 2 == 1, late_minutes=5 if day.day % 2 == 1 else 0
+            )
+            day += timedelta(days=1)
+        self.client = APIClient()
+        self.client.force_authenticate(employee)
+
+    def _get(self, **params):
+        response = self.client.get('/reports/anomaly-list/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_month_range_and_pages(self):
+        dates = []
+        cursor = None
+        while True:
+            params = {'year': 2025, 'month': 2, 'limit': 5}
+            if cursor:
+                params['cursor'] = cursor
+            data = self._get(**params)
+            dates += [item['date'] for item in data['anomalies']]
+            cursor = data['next_cursor']
+            self.assertEqual(data['has_more'], cursor is not None)
+            if not cursor:
+                break
+
+        expected = [f'2025-02-{day:02d}' for day in range(27, 0, -2)]
+        self.assertEqual(dates, expected)
+
+    def test_month_without_year_spans_all_years(self):
+        AttendanceRecords.objects.create(
+            relation_id=self.relation, date=date(2024, 2, 11),
+            checkin_time=datetime(2024, 2, 11, 9, 30), checkout_time=datetime(2024, 2, 11, 18),
+            checkin_location='-', checkout_location='-', work_hours=Decimal('8.50'), is_late=True, late_minutes=30
+        )
+
+        data = self._get(month=2, limit=200)
+        self.assertEqual(data['count'], 15)
+        self.assertEqual((data['anomalies'][0]['date'], data['anomalies'][-1]['date']), ('2025-02-27', '2024-02-11'))
+
+    def test_year_range_and_invalid_cursor(self):
+        data = self._get(year=2025, limit=200)
+        self.assertEqual(data['count'], 17)
+        self.assertEqual((data['anomalies'][0]['date'], data['anomalies'][-1]['date']), ('2025-03-03', '2025-01-31'))
+        self.assertFalse(data['has_more'])
+
+        response = self.client.get('/reports/anomaly-list/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTests(TestCase):
+    """匯出：串流輸出、BOM 只出現一次"""
+
+    def setUp(self):
+        company = _company()
+        self.hr, relation = _staff('HR001', company, username='hr', role='hr_admin')
+        for day in range(1, 29):
+            AttendanceRecords.objects.create(
+                relation_id=relation, date=date(2025, 2, day),
+                checkin_time=datetime(2025, 2, day, 9), checkout_time=datetime(2025, 2, day, 18),
+                checkin_location='-', checkout_location='-', work_hours=Decimal('9.00'),
+                is_late=day == 3, late_minutes=12 if day == 3 else 0
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(self.hr)
+
+    def test_streams_attendance_csv(self):
+        response = self.client.post('/export/attendance/', {
+            'date_from': '2025-02-01', 'date_to': '2025-02-28', 'employee_ids': ['HR001']
+        }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(content.count('\ufeff'), 1)
+        self.assertTrue(content.startswith('\ufeff日期,員工編號'))
+
+        lines = content.splitlines()
+        self.assertEqual(len(lines), 29)
+        self.assertEqual(lines[3], '2025-02-03,HR001,hr,2025-02-03 09:00:00,2025-02-03 18:00:00,9.00,是,12,否,0,否')
+
+    def test_xlsx_exports(self):
+        import openpyxl
+
+        LeaveRecords.objects.create(
+            relation_id=EmpCompanyRel.objects.get(), start_time=datetime(2025, 2, 10, 9),
+            end_time=datetime(2025, 2, 10, 18), leave_hours=Decimal('8.00')
+        )
+
+        for path, title, rows in (('/export/attendance/', '出勤記錄', 29), ('/export/leave/', '請假記錄', 2)):
+            response = self.client.post(path, {
+                'date_from': '2025-02-01', 'date_to': '2025-02-28', 'employee_ids': ['HR001'], 'format': 'xlsx'
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+
+            wb = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(wb.sheetnames, [title])
+            self.assertEqual(wb[title].max_row, rows)
+
+    def test_parquet_exports_are_typed(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest('pyarrow 未安裝')
+
+        relation = EmpCompanyRel.objects.get()
+        OvertimeRecords.objects.create(
+            relation_id=relation, date=date(2025, 2, 5), start_time=datetime(2025, 2, 5, 18).time(), end_time=datetime(2025, 2, 5, 20, 30).time(),
+            overtime_hours=Decimal('2.50'), reason='上線', status='approved'
+        )
+
+        response = self.client.post('/export/attendance/', {
+            'date_from': '2025-02-01', 'date_to': '2025-02-28', 'employee_ids': ['HR001'], 'format': 'parquet'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.num_rows, 28)
+        self.assertEqual(str(table.schema.field('is_late').type), 'bool')
+        self.assertEqual(str(table.schema.field('work_hours').type), 'decimal128(5, 2)')
+        row = table.slice(2, 1).to_pylist()[0]
+        self.assertEqual(row['checkin_time'], datetime(2025, 2, 3, 9))
+        self.assertEqual((row['is_late'], row['late_minutes'], row['work_hours']), (True, 12, Decimal('9.00')))
+
+        response = self.client.post('/export/overtime/', {
+            'date_from': '2025-02-01', 'date_to': '2025-02-28', 'format': 'parquet'
+        }, format='json')
+        rows = pq.read_table(io.BytesIO(b''.join(response.streaming_content))).to_pylist()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['end_time'].isoformat(), '20:30:00')
+        self.assertEqual(rows[0]['overtime_hours'], Decimal('2.50'))
+
+        # 背景匯出工作同樣支援
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(EXPORT_JOBS_IN_PROCESS=False, EXPORT_JOB_DIR=directory):
+            job, _ = export_jobs.submit(self.hr, 'overtime', 'parquet', {
+                'relation_ids': [relation.id], 'date_from': '2025-02-01', 'date_to': '2025-02-28'
+            })
+            export_jobs.run(job.id)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.processed_rows), ('completed', 1))
+            self.assertEqual(pq.read_table(export_jobs.path(job)).num_rows, 1)
+
+    def test_admin_leave_export_stores_search_for_select_all(self):
+        from django.contrib import admin
+        from django.contrib.messages.storage.fallback import FallbackStorage
+        from django.test import RequestFactory
+
+        from .admin import LeaveRecordsAdmin
+
+        _, other = _staff('E002', EmpCompanyRel.objects.get().company_id, username='other')
+        for relation in (EmpCompanyRel.objects.get(employee_id=self.hr), other):
+            LeaveRecords.objects.create(
+                relation_id=relation, start_time=datetime(2025, 2, 10, 9),
+                end_time=datetime(2025, 2, 10, 18), leave_hours=Decimal('8.00')
+            )
+        model_admin = LeaveRecordsAdmin(LeaveRecords, admin.site)
+
+        def export(select_across, queryset):
+            request = RequestFactory().post('/admin/attendance/leaverecords/?q=hr', {
+                'apply': '1', 'select_across': select_across, 'start_date': '2025-02-01', 'end_date': '2025-02-28'
+            })
+            request.user, request.session = self.hr, {}
+            request._messages = FallbackStorage(request)
+            model_admin.export_by_date_range(request, queryset)
+            return ExportJob.objects.latest('id')
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(EXPORT_JOBS_IN_PROCESS=False, EXPORT_JOB_DIR=directory):
+            # 選取全部：保存搜尋條件而非逐筆 ID
+            job = export(1, LeaveRecords.objects.filter(relation_id__employee_id=self.hr))
+            self.assertEqual(job.params, {'date_from': '2025-02-01', 'date_to': '2025-02-28', 'search': 'hr'})
+            # 勾選的記錄（單頁）保存 ID
+            selected = export(0, LeaveRecords.objects.filter(relation_id=other))
+            self.assertEqual(len(selected.params['leave_ids']), 1)
+
+            self.assertEqual(export_jobs.run_pending(), 2)
+            job.refresh_from_db()
+            selected.refresh_from_db()
+            self.assertEqual((job.total_rows, selected.total_rows), (1, 1))
+
+    def test_export_job_lifecycle(self):
+        payload = {'kind': 'attendance', 'date_from': '2025-02-01', 'date_to': '2025-02-28', 'employee_ids': ['HR001']}
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(EXPORT_JOBS_IN_PROCESS=False, EXPORT_JOB_DIR=directory):
+            with self.captureOnCommitCallbacks(execute=True):
+                first = self.client.post('/export/jobs/', payload, format='json')
+                second = self.client.post('/export/jobs/', payload, format='json')
+
+            self.assertEqual(first.status_code, 202)
+            job_id = first.data['data']['id']
+            self.assertEqual(second.data['data']['id'], job_id)
+            self.assertTrue(second.data['data']['deduplicated'])
+
+            response = self.client.get(f'/export/jobs/{job_id}/download/')
+            self.assertEqual(response.status_code, 409)
+
+            self.assertEqual(export_jobs.run_pending(), 1)
+
+            status_data = self.client.get(f'/export/jobs/{job_id}/').data['data']
+            self.assertEqual(status_data['status'], 'completed')
+            self.assertEqual((status_data['total_rows'], status_data['progress']), (28, 100))
+
+            response = self.client.get(status_data['download_url'])
+            self.assertEqual(response.status_code, 200)
+            content = b''.join(response.streaming_content).decode('utf-8')
+            self.assertEqual(len(content.splitlines()), 29)
+
+            # 完成後去重鍵釋放，相同請求建立新工作
+            third = self.client.post('/export/jobs/', payload, format='json')
+            self.assertNotEqual(third.data['data']['id'], job_id)
+
+            ExportJob.objects.filter(id=job_id).update(expires_at=datetime(2000, 1, 1))
+            self.assertEqual(export_jobs.purge_expired(), 1)
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(self.client.get(f'/export/jobs/{job_id}/download/').status_code, 410)
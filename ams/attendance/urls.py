@@ -19,7 +19,11 @@ urlpatterns = [
     path('send-test-email/', views.test_send_email),
     # 新增：後端打卡驗證 API
     path('clock-in/', views.clock_in, name='clock_in'),
+    path('clock-in/batch/', views.clock_in_batch, name='clock_in_batch'),
+    path('clock-in/receipts/<str:receipt>/', views.clock_in_receipt, name='clock_in_receipt'),
     path('clock-out/<int:record_id>/', views.clock_out, name='clock_out'),
+    path('kiosk/qr-token/', views.kiosk_qr_token, name='kiosk_qr_token'),
+    path('offline-punches/sync/', views.sync_offline_punches, name='sync_offline_punches'),
 
     # Phase 2 Week 4：請假與審批 API
     path('leave/apply/', views.apply_leave, name='apply_leave'),
@@ -29,6 +33,7 @@ urlpatterns = [
     path('approval/approve/<int:approval_id>/', views.approve_leave, name='approve_leave'),
     path('approval/reject/<int:approval_id>/', views.reject_leave, name='reject_leave'),
     path('approval/pending/', views.pending_approvals, name='pending_approvals'),
+    path('approval/inbox/', views.approval_inbox, name='approval_inbox'),
 
     # Phase 1：補打卡 API
     path('makeup-clock/apply/', views.apply_makeup_clock, name='apply_makeup_clock'),
@@ -77,6 +82,7 @@ urlpatterns = [
     path('hr/employees/<str:employee_id>/', views.hr_update_employee, name='hr_update_employee'),
     path('hr/employees/<str:employee_id>/assign-manager/', views.hr_assign_manager, name='hr_assign_manager'),
     path('hr/leave-balances/batch-set/', views.hr_batch_set_leave_balances, name='hr_batch_set_leave_balances'),
+    path('hr/location-audit/', views.hr_location_audit, name='hr_location_audit'),
 
     # Phase 3：部門管理 API
     path('hr/departments/', views.department_list, name='department_list'),
@@ -87,6 +93,10 @@ urlpatterns = [
     # Phase 3：資料匯出 API
     path('export/attendance/', views.export_attendance, name='export_attendance'),
     path('export/leave/', views.export_leave, name='export_leave'),
+    path('export/overtime/', views.export_overtime, name='export_overtime'),
+    path('export/jobs/', views.create_export_job, name='create_export_job'),
+    path('export/jobs/<int:job_id>/', views.export_job_status, name='export_job_status'),
+    path('export/jobs/<int:job_id>/download/', views.download_export_job, name='download_export_job'),
 ]
 
 urlpatterns += router.urls
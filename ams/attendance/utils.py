@@ -4,6 +4,15 @@
 from math import radians, cos, sin, asin, sqrt
 from decimal import Decimal
 
+try:
+    import numpy as np
+except ImportError:  # 未安裝 NumPy 時改以逐筆計算
+    np = None
+
+
+# 地球半徑（公尺）
+EARTH_RADIUS_METERS = 6371000
+
 
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
@@ -34,10 +43,118 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
     c = 2 * asin(sqrt(a))
 
-    # 地球半徑（公尺）
-    r = 6371000
+    return c * EARTH_RADIUS_METERS
+
+
+def calculate_distances(lat_array, lon_array, ref_lat, ref_lon):
+    """
+    批次計算多個 GPS 座標與參考點之間的距離（公尺）
+    使用向量化的 Haversine 公式（與 calculate_distance 結果一致）
+
+    Args:
+        lat_array: 緯度序列
+        lon_array: 經度序列
+        ref_lat: 參考點緯度（單一值，或與 lat_array 等長的序列）
+        ref_lon: 參考點經度（單一值，或與 lon_array 等長的序列）
+
+    Returns:
+        list: 每個座標與參考點之間的距離（公尺）
+    """
+    if np is None:
+        count = len(lat_array)
+        ref_lats = ref_lat if isinstance(ref_lat, (list, tuple)) else [ref_lat] * count
+        ref_lons = ref_lon if isinstance(ref_lon, (list, tuple)) else [ref_lon] * count
+        return [
+            calculate_distance(lat, lon, r_lat, r_lon)
+            for lat, lon, r_lat, r_lon in zip(lat_array, lon_array, ref_lats, ref_lons)
+        ]
+
+    lat1 = np.radians(np.asarray(lat_array, dtype=float))
+    lon1 = np.radians(np.asarray(lon_array, dtype=float))
+    lat2 = np.radians(np.asarray(ref_lat, dtype=float))
+    lon2 = np.radians(np.asarray(ref_lon, dtype=float))
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(a))
+
+    return (c * EARTH_RADIUS_METERS).tolist()
+
+
+def label_geofences(lat_array, lon_array, site_lats, site_lons, site_radii, chunk_size=4096):
+    """
+    批次判定多個 GPS 座標落在哪個打卡地點（地理圍欄）內
+    一次計算 N 個座標 × M 個地點的距離矩陣（分批計算以限制記憶體用量）
+
+    Args:
+        lat_array: 座標緯度序列（N 筆）
+        lon_array: 座標經度序列（N 筆）
+        site_lats: 地點緯度序列（M 筆）
+        site_lons: 地點經度序列（M 筆）
+        site_radii: 地點打卡半徑序列（公尺，M 筆）
+        chunk_size: 每批計算的座標筆數
+
+    Returns:
+        tuple: (labels, distances)
+            labels: 每個座標所屬地點的索引（涵蓋該座標的地點中最近者），不在任何圍欄內為 None
+            distances: 每個座標與最近地點的距離（公尺），沒有地點時為 None
+    """
+    count = len(lat_array)
+    if not len(site_lats):
+        return [None] * count, [None] * count
+
+    if np is None:
+        labels, distances = [], []
+        for lat, lon in zip(lat_array, lon_array):
+            row = calculate_distances(list(site_lats), list(site_lons), lat, lon)
+            nearest = min(range(len(row)), key=row.__getitem__)
+            inside = [i for i, d in enumerate(row) if d <= float(site_radii[i])]
+            labels.append(min(inside, key=row.__getitem__) if inside else None)
+            distances.append(row[nearest])
+        return labels, distances
+
+    lats = np.radians(np.asarray(lat_array, dtype=float))[:, None]
+    lons = np.radians(np.asarray(lon_array, dtype=float))[:, None]
+    ref_lats = np.radians(np.asarray(site_lats, dtype=float))[None, :]
+    ref_lons = np.radians(np.asarray(site_lons, dtype=float))[None, :]
+    radii = np.asarray(site_radii, dtype=float)[None, :]
+    cos_ref_lats = np.cos(ref_lats)
+
+    labels, distances = [], []
+    for start in range(0, count, chunk_size):
+        lat1 = lats[start:start + chunk_size]
+        lon1 = lons[start:start + chunk_size]
+
+        a = (np.sin((ref_lats - lat1) / 2) ** 2
+             + np.cos(lat1) * cos_ref_lats * np.sin((ref_lons - lon1) / 2) ** 2)
+        matrix = 2 * np.arcsin(np.sqrt(a)) * EARTH_RADIUS_METERS
+
+        # 圍欄外的地點設為無限大，再取最近者
+        inside = np.where(matrix <= radii, matrix, np.inf)
+        nearest_inside = inside.argmin(axis=1)
+        has_site = np.isfinite(inside[np.arange(len(inside)), nearest_inside])
+
+        labels.extend(int(i) if ok else None for i, ok in zip(nearest_inside, has_site))
+        distances.extend(matrix.min(axis=1).tolist())
+
+    return labels, distances
+
 
-    return c * r
+def parse_location(location):
+    """
+    解析打卡位置字串（"lat, lng"）
+
+    Returns:
+        tuple: (緯度, 經度)；無法解析（如「補打卡」）時為 (None, None)
+    """
+    try:
+        lat, lng = (float(part) for part in str(location).split(','))
+    except (TypeError, ValueError):
+        return None, None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None
+    return lat, lng
 
 
 def calculate_work_hours(checkin_time, checkout_time):
@@ -64,6 +181,71 @@ def calculate_work_hours(checkin_time, checkout_time):
     return Decimal(str(round(hours, 2)))
 
 
+def _combine_like(day, clock_time, reference):
+    """將日期與時間組合成 datetime，時區設定（naive / aware）與 reference 一致"""
+    from datetime import datetime
+    from django.utils import timezone
+
+    combined = datetime.combine(day, clock_time)
+    if timezone.is_aware(reference):
+        combined = timezone.make_aware(combined)
+    return combined
+
+
+def evaluate_lateness(schedule, checkin_time, work_date=None):
+    """
+    依班表判定是否遲到
+
+    Args:
+        schedule: 適用班表（WorkSchedule，可為 None）
+        checkin_time: 上班打卡時間（datetime）
+        work_date: 考勤日期（預設為打卡當天）
+
+    Returns:
+        tuple: (是否遲到, 遲到分鐘數)
+    """
+    from datetime import timedelta
+
+    if not schedule or not checkin_time:
+        return False, 0
+
+    work_date = work_date or checkin_time.date()
+    scheduled_start = _combine_like(work_date, schedule.work_start_time, checkin_time)
+    # 加上寬限時間
+    grace_deadline = scheduled_start + timedelta(minutes=schedule.grace_period_minutes)
+
+    if checkin_time <= grace_deadline:
+        return False, 0
+
+    late_minutes = int((checkin_time - scheduled_start).total_seconds() / 60)
+    return True, max(late_minutes, 0)
+
+
+def evaluate_early_leave(schedule, checkout_time, work_date=None):
+    """
+    依班表判定是否早退
+
+    Args:
+        schedule: 適用班表（WorkSchedule，可為 None）
+        checkout_time: 下班打卡時間（datetime）
+        work_date: 考勤日期（預設為打卡當天）
+
+    Returns:
+        tuple: (是否早退, 早退分鐘數)
+    """
+    if not schedule or not checkout_time:
+        return False, 0
+
+    work_date = work_date or checkout_time.date()
+    scheduled_end = _combine_like(work_date, schedule.work_end_time, checkout_time)
+
+    if checkout_time >= scheduled_end:
+        return False, 0
+
+    early_leave_minutes = int((scheduled_end - checkout_time).total_seconds() / 60)
+    return True, max(early_leave_minutes, 0)
+
+
 def calculate_annual_leave_days(hire_date, target_date=None):
     """
     根據勞基法計算特休天數
@@ -1,10 +1,11 @@
 from django.contrib.auth import authenticate, get_user_model, login as django_login, logout
 from django.core.mail import send_mail
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
 from django.db.models import Q
 from .models import *
 from .serializers import *
-from .responses import success_response, error_response, unauthorized_response, validation_error_response, server_error_response
+from .responses import success_response, error_response, unauthorized_response, forbidden_response, not_found_response, validation_error_response, server_error_response
 from datetime import time, date, timedelta, datetime
 from rest_framework.viewsets import ModelViewSet
 from rest_framework import viewsets
@@ -213,34 +214,101 @@ class EmpCompanyRelView(viewsets.ModelViewSet):
 
 
 # ========== 新增：後端打卡驗證 API ==========
-from .utils import calculate_distance, calculate_work_hours
+from .utils import calculate_distance, calculate_distances, calculate_work_hours, evaluate_lateness, evaluate_early_leave, parse_location
+from .geofence import geofence_index
+from .punch_queue import punch_queue
+from .schedules import schedule_resolver
+from .presence import daily_presence
+from .punches import build_checkin, insert_checkins
+from .reports import empty_summary, month_range, months_between, summarize_months
+from .rollups import (
+    add_approved_records, add_attendance_records, add_leave_hours, add_overtime_hours,
+    apply_attendance_change, department_days, monthly_summaries, snapshot as rollup_snapshot
+)
+from .idempotency import idempotent
+from .approval_policies import approval_policies
+from .approvers import approver_directory
+from .inbox import INBOX_MAX_PAGE_SIZE, INBOX_PAGE_SIZE, TYPES as INBOX_TYPES, decode_inbox_cursor, inbox_page
+from . import pending_counters
+from .report_cache import department_tag, day_period, employee_tag, month_period, report_cache
+from .qr_tokens import InvalidQRToken, QR_PAYLOAD_TYPE, issue_token, verify_token
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_filter, parse_limit
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import IntegrityError, transaction
+from django.conf import settings
+import json
+import time as time_module
 from decimal import Decimal
 
 
+def _qr_error_response(code, message):
+    return Response({
+        'success': False,
+        'error': {
+            'code': code,
+            'message': message
+        }
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+def _resolve_qr_site(data):
+    """
+    依請求中的 QR Code 內容解析打卡公司
+
+    - qr_token: 資訊站輪替 QR Code（HMAC 簽章，記憶體驗證）
+    - qr_latitude / qr_longitude: 印出的靜態 QR Code 座標
+      （QR_REQUIRE_SIGNED_TOKEN 啟用時不再接受）
+
+    Returns:
+        tuple: (Site, None) 或 (None, 錯誤回應)
+    """
+    qr_token = data.get('qr_token')
+    if qr_token:
+        try:
+            return verify_token(qr_token), None
+        except InvalidQRToken as e:
+            return None, _qr_error_response(e.code, e.message)
+
+    qr_lat = data.get('qr_latitude')
+    qr_lng = data.get('qr_longitude')
+    if not qr_lat or not qr_lng:
+        return None, _qr_error_response('MISSING_PARAMETERS', '缺少必要參數')
+    if settings.QR_REQUIRE_SIGNED_TOKEN:
+        return None, _qr_error_response('QR_TOKEN_REQUIRED', '請掃描資訊站顯示的 QR Code')
+
+    try:
+        site = geofence_index.resolve_qr(Decimal(str(qr_lat)), Decimal(str(qr_lng)))
+    except Exception:
+        return None, _qr_error_response('INVALID_COORDINATES', 'GPS 座標格式錯誤')
+    if not site:
+        return None, _qr_error_response('INVALID_QR_CODE', '無效的 QR Code')
+    return site, None
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def clock_in(request):
     """
     上班打卡 API（後端驗證版本）
 
     請求參數：
+    - qr_token: 資訊站輪替 QR Code 權杖（或改用下列靜態 QR Code 座標）
     - qr_latitude: QR Code 緯度
     - qr_longitude: QR Code 經度
     - user_latitude: 使用者緯度
     - user_longitude: 使用者經度
-    - relation_id: 員工-公司關聯 ID
+    - relation_id: 員工-公司關聯 ID（須為本人的關聯）
     """
     try:
         # 1. 取得請求參數
-        qr_lat = request.data.get('qr_latitude')
-        qr_lng = request.data.get('qr_longitude')
         user_lat = request.data.get('user_latitude')
         user_lng = request.data.get('user_longitude')
         relation_id = request.data.get('relation_id')
 
         # 2. 參數驗證
-        if not all([qr_lat, qr_lng, user_lat, user_lng, relation_id]):
+        if not all([user_lat, user_lng, relation_id]):
             return Response({
                 'success': False,
                 'error': {
@@ -251,8 +319,6 @@ def clock_in(request):
 
         # 3. 轉換參數類型
         try:
-            qr_lat = Decimal(str(qr_lat))
-            qr_lng = Decimal(str(qr_lng))
             user_lat = Decimal(str(user_lat))
             user_lng = Decimal(str(user_lng))
         except Exception:
@@ -264,26 +330,16 @@ def clock_in(request):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 4. 驗證 QR Code 座標是否為有效公司
-        company = Companies.objects.filter(
-            latitude=str(qr_lat),
-            longitude=str(qr_lng)
-        ).first()
-
-        if not company:
-            return Response({
-                'success': False,
-                'error': {
-                    'code': 'INVALID_QR_CODE',
-                    'message': '無效的 QR Code'
-                }
-            }, status=status.HTTP_400_BAD_REQUEST)
+        # 4. 驗證 QR Code 是否為有效公司（記憶體地理圍欄索引與 HMAC 驗證，不查資料庫）
+        site, error = _resolve_qr_site(request.data)
+        if error:
+            return error
 
-        # 5. 計算 GPS 距離（後端計算）
-        distance = calculate_distance(user_lat, user_lng, qr_lat, qr_lng)
+        # 5. 計算 GPS 距離（後端計算，以公司登錄座標為準）
+        distance = calculate_distance(user_lat, user_lng, site.latitude, site.longitude)
 
         # 6. 驗證距離是否在範圍內（預設 2000 公尺）
-        max_distance = float(company.radius) if company.radius else 2000.0
+        max_distance = site.radius
         if distance > max_distance:
             return Response({
                 'success': False,
@@ -297,36 +353,20 @@ def clock_in(request):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 7. 檢查今天是否已經打卡
-        today = timezone.now().date()
-        existing_record = AttendanceRecords.objects.filter(
-            relation_id=relation_id,
-            date=today
-        ).first()
-
-        if existing_record:
+        try:
+            relation_id = int(relation_id)
+        except (TypeError, ValueError):
             return Response({
                 'success': False,
                 'error': {
-                    'code': 'ALREADY_CLOCKED_IN',
-                    'message': '今天已經打過卡'
+                    'code': 'RELATION_NOT_FOUND',
+                    'message': '無效的員工關聯'
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 8. 產生當前時間（後端產生）
-        now = timezone.now()
-        location = f"{user_lat}, {user_lng}"
-
-        # =====================================================
-        # Phase 1 新增：取得員工班表並判定遲到
-        # =====================================================
-        from .models import WorkSchedule, EmpCompanyRel
-        from datetime import datetime, timedelta
-
-        # 取得員工關聯資訊
-        try:
-            relation = EmpCompanyRel.objects.get(id=relation_id)
-        except EmpCompanyRel.DoesNotExist:
+        # 7. 驗證員工關聯（緩衝模式也須在回傳收據前確認，不延後到寫入時）
+        relation = EmpCompanyRel.objects.filter(id=relation_id).first()
+        if relation is None:
             return Response({
                 'success': False,
                 'error': {
@@ -334,49 +374,82 @@ def clock_in(request):
                     'message': '無效的員工關聯'
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
+        if relation.employee_id_id != request.user.employee_id:
+            return Response({
+                'success': False,
+                'error': {
+                    'code': 'FORBIDDEN',
+                    'message': '您只能為自己打卡'
+                }
+            }, status=status.HTTP_403_FORBIDDEN)
 
-        # 取得班表（優先員工專屬，否則使用公司預設）
-        schedule = relation.work_schedule
-        if not schedule:
-            schedule = WorkSchedule.objects.filter(
-                company_id=relation.company_id,
-                is_default=True,
-                is_active=True
-            ).first()
+        # 8. 檢查今天是否已經打卡（當日已打卡名單命中時向資料庫確認；
+        #    名單未命中時由 (relation_id, date) 唯一約束把關）。
+        #    須在關聯歸屬驗證之後，避免透露他人的打卡狀態
+        now = timezone.now()
+        today = now.date()
+        if daily_presence.is_clocked_in(relation_id, today):
+            return _already_clocked_in_response()
+
+        # 緩衝模式：驗證通過即寫入本機日誌並回傳收據，由背景 flusher 寫入資料庫
+        if punch_queue.enabled:
+            receipt = punch_queue.enqueue(
+                relation_id=relation_id,
+                punch_time=now,
+                location=f"{user_lat}, {user_lng}",
+                distance=round(distance, 2)
+            )
+            # 受理後即列入當日名單，寫入前的重複打卡直接拒絕
+            daily_presence.add(relation_id, today)
+            return Response({
+                'success': True,
+                'message': '打卡已受理，正在寫入紀錄',
+                'data': {
+                    'receipt': receipt,
+                    'status': 'pending',
+                    'checkin_time': now.isoformat(),
+                    'distance': round(distance, 2)
+                }
+            }, status=status.HTTP_202_ACCEPTED)
+
+        # 9. 打卡位置
+        location = f"{user_lat}, {user_lng}"
+
+        # =====================================================
+        # Phase 1 新增：取得員工班表並判定遲到
+        # =====================================================
+        # 取得班表（優先員工專屬，否則使用公司預設；程序層級快取）
+        schedule = schedule_resolver.resolve(relation)
 
         # 判定遲到
-        is_late = False
-        late_minutes = 0
+        is_late, late_minutes = evaluate_lateness(schedule, now, today)
 
-        if schedule:
-            # 組合今日的上班時間
-            scheduled_start = timezone.make_aware(
-                datetime.combine(today, schedule.work_start_time)
-            )
-            # 加上寬限時間
-            grace_deadline = scheduled_start + timedelta(minutes=schedule.grace_period_minutes)
-
-            if now > grace_deadline:
-                is_late = True
-                late_minutes = int((now - scheduled_start).total_seconds() / 60)
-                if late_minutes < 0:
-                    late_minutes = 0
-
-        # 9. 建立打卡記錄（含遲到資訊）
-        record = AttendanceRecords.objects.create(
-            relation_id_id=relation_id,
-            date=today,
-            checkin_time=now,
-            checkout_time=now,  # 初始設定為相同時間
-            checkin_location=location,
-            checkout_location=location,
-            work_hours=Decimal('0.00'),
-            schedule=schedule,      # Phase 1 新增
-            is_late=is_late,        # Phase 1 新增
-            late_minutes=late_minutes  # Phase 1 新增
-        )
-
-        # 10. 返回成功回應（含遲到資訊）
+        # 10. 建立打卡記錄（含遲到資訊）；同日重複打卡由唯一約束擋下
+        try:
+            with transaction.atomic():
+                record = AttendanceRecords.objects.create(
+                    relation_id_id=relation_id,
+                    date=today,
+                    checkin_time=now,
+                    checkout_time=now,  # 初始設定為相同時間
+                    checkin_location=location,
+                    checkout_location=location,
+                    checkin_latitude=float(user_lat),
+                    checkin_longitude=float(user_lng),
+                    checkin_distance=round(distance, 2),
+                    work_hours=Decimal('0.00'),
+                    schedule=schedule,      # Phase 1 新增
+                    is_late=is_late,        # Phase 1 新增
+                    late_minutes=late_minutes  # Phase 1 新增
+                )
+                add_attendance_records([record])
+        except IntegrityError:
+            daily_presence.add(relation_id, today)
+            return _already_clocked_in_response()
+
+        daily_presence.add(relation_id, today)
+
+        # 11. 返回成功回應（含遲到資訊）
         response_data = {
             'id': record.id,
             'date': str(record.date),
@@ -412,13 +485,281 @@ def clock_in(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _already_clocked_in_response():
+    return Response({
+        'success': False,
+        'error': {
+            'code': 'ALREADY_CLOCKED_IN',
+            'message': '今天已經打過卡'
+        }
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def clock_in_receipt(request, receipt):
+    """
+    查詢緩衝打卡收據狀態 API
+
+    URL: GET /clock-in/receipts/<receipt>/
+    回傳狀態：
+    - pending: 已受理，尚未寫入
+    - committed: 已寫入（含出勤記錄 ID，可用於下班打卡）
+    - rejected: 寫入時被拒絕（例如今天已經打過卡）
+    """
+    try:
+        result = punch_queue.status(receipt)
+
+        # 只能查詢自己的收據（他人的收據視同不存在）
+        if result['status'] == 'unknown' or not EmpCompanyRel.objects.filter(
+            id=result['relation_id'], employee_id=request.user
+        ).exists():
+            return not_found_response("找不到此打卡收據", code="RECEIPT_NOT_FOUND")
+
+        data = {'receipt': receipt, 'status': result['status']}
+        if result['status'] == 'committed':
+            record = result['record']
+            data.update({
+                'id': record['id'],
+                'date': str(record['date']),
+                'checkin_time': record['checkin_time'].isoformat(),
+                'is_late': record['is_late'],
+                'late_minutes': record['late_minutes'],
+            })
+        elif result['status'] == 'rejected':
+            data['error'] = {'code': result['code'], 'message': result['message']}
+
+        return success_response(message="查詢成功", data=data)
+
+    except Exception as e:
+        print(f"查詢打卡收據錯誤: {str(e)}")
+        return server_error_response("查詢失敗，請稍後再試")
+
+
+# 資訊站批次打卡：單次最多筆數、可接受的打卡時間範圍
+KIOSK_BATCH_MAX_PUNCHES = 200
+KIOSK_PUNCH_MAX_AGE = timedelta(minutes=15)
+KIOSK_PUNCH_MAX_SKEW = timedelta(minutes=2)
+
+
+def _parse_punch_timestamp(value, now, max_age=KIOSK_PUNCH_MAX_AGE):
+    """解析裝置端打卡時間（ISO 8601）；未提供時以伺服器時間為準，無效或超出範圍時回傳 None"""
+    if not value:
+        return now
+    punch_time = parse_datetime(str(value))
+    if punch_time is None:
+        return None
+
+    # 與伺服器時間（timezone.now()）一致的 naive / aware 形式
+    if timezone.is_aware(punch_time) and timezone.is_naive(now):
+        punch_time = timezone.make_naive(punch_time)
+    elif timezone.is_naive(punch_time) and timezone.is_aware(now):
+        punch_time = timezone.make_aware(punch_time)
+
+    if punch_time < now - max_age or punch_time > now + KIOSK_PUNCH_MAX_SKEW:
+        return None
+    return punch_time
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def clock_in_batch(request):
+    """
+    資訊站批次上班打卡 API（共用 QR 打卡終端）
+
+    URL: POST /clock-in/batch/
+    請求參數：
+    - qr_token: 資訊站輪替 QR Code 權杖（或改用下列靜態 QR Code 座標）
+    - qr_latitude: QR Code 緯度
+    - qr_longitude: QR Code 經度
+    - punches: 打卡清單，每筆包含
+        - relation_id: 員工-公司關聯 ID
+        - user_latitude: 使用者緯度
+        - user_longitude: 使用者經度
+        - timestamp: 打卡時間（ISO 8601，選填，預設為伺服器時間）
+
+    所有打卡須屬於同一打卡地點；逐筆回傳結果（成功或錯誤代碼），
+    單筆失敗不影響其他筆。資訊站帳號須具主管以上權限。
+    """
+    try:
+        if not _check_manager_permission(request.user):
+            return forbidden_response("您沒有權限使用資訊站打卡")
+
+        punches = request.data.get('punches')
+
+        if not isinstance(punches, list) or not punches:
+            return validation_error_response("缺少必要參數")
+        if len(punches) > KIOSK_BATCH_MAX_PUNCHES:
+            return validation_error_response(f"單次最多 {KIOSK_BATCH_MAX_PUNCHES} 筆打卡")
+
+        site, error = _resolve_qr_site(request.data)
+        if error:
+            return error
+
+        now = timezone.now()
+        results = [None] * len(punches)
+
+        def reject(index, relation_id, code, message):
+            results[index] = {
+                'index': index,
+                'relation_id': relation_id,
+                'success': False,
+                'error': {'code': code, 'message': message}
+            }
+
+        # 1. 逐筆驗證格式、時間與地理圍欄（一次掃描，不查資料庫）
+        valid = []
+        for index, punch in enumerate(punches):
+            if not isinstance(punch, dict):
+                reject(index, None, 'MISSING_PARAMETERS', '缺少必要參數')
+                continue
+
+            relation_id = punch.get('relation_id')
+            user_lat = punch.get('user_latitude')
+            user_lng = punch.get('user_longitude')
+            if not all([relation_id, user_lat, user_lng]):
+                reject(index, relation_id, 'MISSING_PARAMETERS', '缺少必要參數')
+                continue
+
+            try:
+                relation_id = int(relation_id)
+            except (TypeError, ValueError):
+                reject(index, relation_id, 'RELATION_NOT_FOUND', '無效的員工關聯')
+                continue
+
+            try:
+                user_lat = Decimal(str(user_lat))
+                user_lng = Decimal(str(user_lng))
+            except Exception:
+                reject(index, relation_id, 'INVALID_COORDINATES', 'GPS 座標格式錯誤')
+                continue
+
+            punch_time = _parse_punch_timestamp(punch.get('timestamp'), now)
+            if punch_time is None:
+                reject(index, relation_id, 'INVALID_TIMESTAMP', '打卡時間無效或超出可接受範圍')
+                continue
+
+            distance = calculate_distance(user_lat, user_lng, site.latitude, site.longitude)
+            if distance > site.radius:
+                reject(index, relation_id, 'LOCATION_OUT_OF_RANGE', f'打卡位置超出範圍（{site.radius} 公尺）')
+                continue
+
+            valid.append((index, relation_id, punch_time, f"{user_lat}, {user_lng}", distance))
+
+        # 2. 一次取回關聯、既有打卡與班表
+        relation_ids = {item[1] for item in valid}
+        relations = EmpCompanyRel.objects.in_bulk(relation_ids)
+        dates = {item[2].date() for item in valid}
+        clocked_in = set(
+            AttendanceRecords.objects.filter(relation_id__in=relation_ids, date__in=dates)
+            .values_list('relation_id', 'date')
+        )
+        schedules = schedule_resolver.resolve_many(relations.values())
+
+        records = []
+        pending = []
+        for index, relation_id, punch_time, location, distance in valid:
+            relation = relations.get(relation_id)
+            work_date = punch_time.date()
+
+            if relation is None or relation.company_id_id != site.id:
+                reject(index, relation_id, 'RELATION_NOT_FOUND', '無效的員工關聯')
+                continue
+            if (relation_id, work_date) in clocked_in or punch_queue.has_pending(relation_id, work_date):
+                reject(index, relation_id, 'ALREADY_CLOCKED_IN', '今天已經打過卡')
+                continue
+            clocked_in.add((relation_id, work_date))
+
+            records.append(build_checkin(relation, schedules[relation_id], punch_time, location, round(distance, 2)))
+            pending.append((index, distance))
+
+        # 3. 單次寫入；期間其他途徑已寫入的同日記錄由唯一約束擋下
+        created, conflicts = insert_checkins(records)
+        conflicted = {id(record) for record in conflicts}
+
+        for (index, distance), record in zip(pending, records):
+            if id(record) in conflicted:
+                reject(index, record.relation_id_id, 'ALREADY_CLOCKED_IN', '今天已經打過卡')
+                continue
+            results[index] = {
+                'index': index,
+                'relation_id': record.relation_id_id,
+                'success': True,
+                'id': record.id,
+                'date': str(record.date),
+                'checkin_time': record.checkin_time.isoformat(),
+                'is_late': record.is_late,
+                'late_minutes': record.late_minutes,
+                'distance': round(distance, 2)
+            }
+
+        return success_response(
+            message=f"批次打卡完成：成功 {len(created)} 筆，失敗 {len(punches) - len(created)} 筆",
+            data={
+                'company_id': site.id,
+                'company_name': site.name,
+                'accepted': len(created),
+                'rejected': len(punches) - len(created),
+                'results': results
+            }
+        )
+
+    except Exception as e:
+        print(f"批次打卡錯誤: {str(e)}")
+        return server_error_response("批次打卡失敗，請稍後再試")
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def kiosk_qr_token(request):
+    """
+    資訊站顯示用的輪替 QR Code 權杖 API
+
+    URL: GET /kiosk/qr-token/?company_id=<公司 ID>
+    回傳：
+    - token: 目前時間窗的權杖（打卡時以 qr_token 送出）
+    - qr_data: QR Code 內容（JSON 字串，資訊站直接編碼顯示）
+    - expires_in: 本時間窗剩餘秒數，資訊站應於到期前重新取得
+
+    資訊站帳號須具主管以上權限。
+    """
+    try:
+        if not _check_manager_permission(request.user):
+            return forbidden_response("您沒有權限使用資訊站功能")
+
+        site = geofence_index.get(request.query_params.get('company_id'))
+        if site is None:
+            return not_found_response("公司不存在", code="COMPANY_NOT_FOUND")
+
+        now = time_module.time()
+        token, expires_at = issue_token(site, now)
+
+        return success_response(
+            message="產生成功",
+            data={
+                'company_id': site.id,
+                'company_name': site.name,
+                'token': token,
+                'qr_data': json.dumps({'type': QR_PAYLOAD_TYPE, 'token': token}),
+                'expires_in': round(expires_at - now, 1),
+            }
+        )
+
+    except Exception as e:
+        print(f"產生 QR Code 權杖錯誤: {str(e)}")
+        return server_error_response("產生失敗，請稍後再試")
+
+
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def clock_out(request, record_id):
     """
     下班打卡 API（後端驗證版本）
 
     請求參數：
+    - qr_token: 資訊站輪替 QR Code 權杖（或改用下列靜態 QR Code 座標）
     - qr_latitude: QR Code 緯度
     - qr_longitude: QR Code 經度
     - user_latitude: 使用者緯度
@@ -438,13 +779,11 @@ def clock_out(request, record_id):
             }, status=status.HTTP_404_NOT_FOUND)
 
         # 2. 取得請求參數
-        qr_lat = request.data.get('qr_latitude')
-        qr_lng = request.data.get('qr_longitude')
         user_lat = request.data.get('user_latitude')
         user_lng = request.data.get('user_longitude')
 
         # 3. 參數驗證
-        if not all([qr_lat, qr_lng, user_lat, user_lng]):
+        if not all([user_lat, user_lng]):
             return Response({
                 'success': False,
                 'error': {
@@ -455,8 +794,6 @@ def clock_out(request, record_id):
 
         # 4. 轉換參數類型
         try:
-            qr_lat = Decimal(str(qr_lat))
-            qr_lng = Decimal(str(qr_lng))
             user_lat = Decimal(str(user_lat))
             user_lng = Decimal(str(user_lng))
         except Exception:
@@ -468,24 +805,14 @@ def clock_out(request, record_id):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # 5. 驗證 QR Code
-        company = Companies.objects.filter(
-            latitude=str(qr_lat),
-            longitude=str(qr_lng)
-        ).first()
-
-        if not company:
-            return Response({
-                'success': False,
-                'error': {
-                    'code': 'INVALID_QR_CODE',
-                    'message': '無效的 QR Code'
-                }
-            }, status=status.HTTP_400_BAD_REQUEST)
+        # 5. 驗證 QR Code（記憶體地理圍欄索引與 HMAC 驗證）
+        site, error = _resolve_qr_site(request.data)
+        if error:
+            return error
 
         # 6. 計算距離
-        distance = calculate_distance(user_lat, user_lng, qr_lat, qr_lng)
-        max_distance = float(company.radius) if company.radius else 2000.0
+        distance = calculate_distance(user_lat, user_lng, site.latitude, site.longitude)
+        max_distance = site.radius
 
         if distance > max_distance:
             return Response({
@@ -510,31 +837,23 @@ def clock_out(request, record_id):
         # =====================================================
         # Phase 1 新增：判定早退
         # =====================================================
-        from datetime import datetime, timedelta
-
-        is_early_leave = False
-        early_leave_minutes = 0
-
-        schedule = record.schedule
-        if schedule:
-            # 組合今日的下班時間
-            scheduled_end = timezone.make_aware(
-                datetime.combine(record.date, schedule.work_end_time)
-            )
-
-            if now < scheduled_end:
-                is_early_leave = True
-                early_leave_minutes = int((scheduled_end - now).total_seconds() / 60)
-                if early_leave_minutes < 0:
-                    early_leave_minutes = 0
+        is_early_leave, early_leave_minutes = evaluate_early_leave(
+            schedule_resolver.get_schedule(record.schedule_id), now, record.date
+        )
 
-        # 9. 更新記錄（含早退資訊）
+        # 9. 更新記錄（含早退資訊）與月統計
+        before = rollup_snapshot(record)
         record.checkout_time = now
         record.checkout_location = location
+        record.checkout_latitude = float(user_lat)
+        record.checkout_longitude = float(user_lng)
+        record.checkout_distance = round(distance, 2)
         record.work_hours = work_hours
         record.is_early_leave = is_early_leave      # Phase 1 新增
         record.early_leave_minutes = early_leave_minutes  # Phase 1 新增
-        record.save()
+        with transaction.atomic():
+            record.save()
+            apply_attendance_change(before, rollup_snapshot(record))
 
         # 10. 返回成功回應（含早退資訊）
         response_data = {
@@ -573,6 +892,208 @@ def clock_out(request, record_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# 離線打卡同步：單次最多筆數、可補傳的天數
+OFFLINE_SYNC_MAX_PUNCHES = 100
+OFFLINE_SYNC_MAX_AGE = timedelta(days=7)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+def sync_offline_punches(request):
+    """
+    離線打卡同步 API（地下室、倉庫等無訊號環境）
+
+    URL: POST /offline-punches/sync/
+    請求參數：
+    - relation_id: 員工-公司關聯 ID
+    - punches: 離線期間記錄的打卡，每筆包含
+        - type: in（上班）/ out（下班）
+        - timestamp: 裝置打卡時間（ISO 8601，最多可補傳 7 天）
+        - qr_latitude / qr_longitude: 掃描到的 QR Code 座標
+        - user_latitude / user_longitude: 打卡當下的 GPS 座標
+
+    以向量化 Haversine 一次驗證所有打卡的距離，與既有出勤記錄去重後
+    在同一個交易中寫入。同一天有多筆時，上班取最早、下班取最晚；
+    逐筆回傳處理結果（created / updated / duplicate / rejected）。
+    """
+    try:
+        relation_id = request.data.get('relation_id')
+        punches = request.data.get('punches')
+
+        if not relation_id or not isinstance(punches, list) or not punches:
+            return validation_error_response("缺少必要參數")
+        if len(punches) > OFFLINE_SYNC_MAX_PUNCHES:
+            return validation_error_response(f"單次最多同步 {OFFLINE_SYNC_MAX_PUNCHES} 筆打卡")
+
+        try:
+            relation = EmpCompanyRel.objects.get(id=int(relation_id))
+        except (TypeError, ValueError, EmpCompanyRel.DoesNotExist):
+            return error_response("無效的員工關聯", code="RELATION_NOT_FOUND")
+        if relation.employee_id_id != request.user.employee_id:
+            return forbidden_response("您只能同步自己的打卡記錄")
+
+        now = timezone.now()
+        results = [None] * len(punches)
+
+        def settle(index, result, code=None, message=None, record=None):
+            punch = punches[index]
+            item = {'index': index, 'type': punch.get('type') if isinstance(punch, dict) else None, 'result': result}
+            if record is not None:
+                item['record_id'] = record.id
+                item['date'] = str(record.date)
+            if code:
+                item['error'] = {'code': code, 'message': message}
+            results[index] = item
+
+        # 1. 格式、時間與 QR Code 驗證（記憶體地理圍欄索引）
+        parsed = []
+        for index, punch in enumerate(punches):
+            if not isinstance(punch, dict):
+                settle(index, 'rejected', 'MISSING_PARAMETERS', '缺少必要參數')
+                continue
+
+            punch_type = punch.get('type')
+            fields = [punch.get(name) for name in ('qr_latitude', 'qr_longitude', 'user_latitude', 'user_longitude')]
+            if punch_type not in ('in', 'out') or not punch.get('timestamp') or not all(fields):
+                settle(index, 'rejected', 'MISSING_PARAMETERS', '缺少必要參數')
+                continue
+
+            try:
+                qr_lat, qr_lng, user_lat, user_lng = [Decimal(str(value)) for value in fields]
+            except Exception:
+                settle(index, 'rejected', 'INVALID_COORDINATES', 'GPS 座標格式錯誤')
+                continue
+
+            punch_time = _parse_punch_timestamp(punch['timestamp'], now, OFFLINE_SYNC_MAX_AGE)
+            if punch_time is None:
+                settle(index, 'rejected', 'INVALID_TIMESTAMP', '打卡時間無效或超出可補傳範圍')
+                continue
+
+            site = geofence_index.resolve_qr(qr_lat, qr_lng)
+            if site is None or site.id != relation.company_id_id:
+                settle(index, 'rejected', 'INVALID_QR_CODE', '無效的 QR Code')
+                continue
+
+            parsed.append((index, punch_type, punch_time, user_lat, user_lng, site))
+
+        # 2. 向量化距離驗證
+        distances = calculate_distances(
+            [item[3] for item in parsed],
+            [item[4] for item in parsed],
+            [item[5].latitude for item in parsed],
+            [item[5].longitude for item in parsed],
+        ) if parsed else []
+
+        checkins = {}
+        checkouts = {}
+        for (index, punch_type, punch_time, user_lat, user_lng, site), distance in zip(parsed, distances):
+            if distance > site.radius:
+                settle(index, 'rejected', 'LOCATION_OUT_OF_RANGE', f'打卡位置超出範圍（{site.radius} 公尺）')
+                continue
+
+            # 同一天：上班取最早、下班取最晚，其餘視為重複
+            group, keep_earliest = (checkins, True) if punch_type == 'in' else (checkouts, False)
+            punch = (index, punch_time, f"{user_lat}, {user_lng}", round(distance, 2))
+            current = group.get(punch_time.date())
+            if current is None:
+                group[punch_time.date()] = punch
+            elif (punch_time < current[1]) == keep_earliest and punch_time != current[1]:
+                settle(current[0], 'duplicate')
+                group[punch_time.date()] = punch
+            else:
+                settle(index, 'duplicate')
+
+        # 3. 與既有出勤記錄去重
+        dates = set(checkins) | set(checkouts)
+        existing = {
+            record.date: record
+            for record in AttendanceRecords.objects.filter(relation_id=relation, date__in=dates)
+        }
+        schedule = schedule_resolver.resolve(relation)
+
+        new_records = {}
+        for work_date, (index, punch_time, location, distance) in checkins.items():
+            if work_date in existing:
+                settle(index, 'duplicate', record=existing[work_date])
+                continue
+            new_records[work_date] = (index, build_checkin(relation, schedule, punch_time, location, distance))
+
+        updated = []
+        updated_indexes = []
+        before_snapshots = []
+        for work_date, (index, punch_time, location, distance) in checkouts.items():
+            if work_date in new_records:
+                record = new_records[work_date][1]
+            elif work_date in existing:
+                record = existing[work_date]
+            else:
+                settle(index, 'rejected', 'NO_CHECKIN', '該日沒有上班打卡記錄')
+                continue
+
+            if punch_time <= record.checkin_time:
+                settle(index, 'rejected', 'INVALID_TIMESTAMP', '下班時間早於上班時間')
+                continue
+            if record.checkout_time > record.checkin_time and punch_time <= record.checkout_time:
+                settle(index, 'duplicate', record=record)
+                continue
+
+            is_early_leave, early_leave_minutes = evaluate_early_leave(
+                schedule_resolver.get_schedule(record.schedule_id), punch_time, work_date
+            )
+            if record.pk:
+                before_snapshots.append(rollup_snapshot(record))
+            record.checkout_time = punch_time
+            record.checkout_location = location
+            record.checkout_latitude, record.checkout_longitude = parse_location(location)
+            record.checkout_distance = distance
+            record.work_hours = calculate_work_hours(record.checkin_time, punch_time)
+            record.is_early_leave = is_early_leave
+            record.early_leave_minutes = early_leave_minutes
+            if record.pk:
+                updated.append(record)
+            updated_indexes.append((index, record))
+
+        # 4. 同一個交易中寫入
+        with transaction.atomic():
+            created, conflicts = insert_checkins([record for _, record in new_records.values()])
+            if updated:
+                AttendanceRecords.objects.bulk_update(updated, [
+                    'checkout_time', 'checkout_location', 'checkout_latitude',
+                    'checkout_longitude', 'checkout_distance', 'work_hours',
+                    'is_early_leave', 'early_leave_minutes'
+                ])
+                for before, record in zip(before_snapshots, updated):
+                    apply_attendance_change(before, rollup_snapshot(record))
+                # bulk_update 不會觸發 post_save
+                report_cache.invalidate_records((record.relation_id_id, record.date) for record in updated)
+
+        conflicted = {id(record) for record in conflicts}
+        for index, record in new_records.values():
+            if id(record) in conflicted:
+                settle(index, 'duplicate')
+            else:
+                settle(index, 'created', record=record)
+        for index, record in updated_indexes:
+            if id(record) in conflicted:
+                settle(index, 'rejected', 'CONFLICT', '該日記錄已由其他途徑寫入，請重新同步')
+            else:
+                settle(index, 'updated', record=record)
+
+        summary = {}
+        for item in results:
+            summary[item['result']] = summary.get(item['result'], 0) + 1
+
+        return success_response(
+            message="離線打卡同步完成",
+            data={'summary': summary, 'results': results}
+        )
+
+    except Exception as e:
+        print(f"離線打卡同步錯誤: {str(e)}")
+        return server_error_response("同步失敗，請稍後再試")
+
+
 # ========== Phase 2 Week 4: 請假與審批 API ==========
 from .models import ApprovalRecords, LeaveBalances
 from .serializers import LeaveRecordsSerializer, ApprovalRecordsSerializer, LeaveBalancesSerializer
@@ -581,6 +1102,7 @@ from decimal import Decimal as D
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def apply_leave(request):
     """
     請假申請 API（Phase 2 Week 4）
@@ -684,28 +1206,11 @@ def apply_leave(request):
         leave_record = serializer.save()
 
         # 6. 根據審批政策自動建立審批記錄
-        from .models import ApprovalPolicy, ManagerialRelationship
-        import json
-
         # 計算請假天數
         leave_days = (leave_record.end_time - leave_record.start_time).total_seconds() / (24 * 3600)
 
-        # 查找適用的審批政策
-        company_id = relation.company_id
-        policy = ApprovalPolicy.objects.filter(
-            is_active=True,
-            min_days__lte=leave_days
-        ).filter(
-            models.Q(max_days__gte=leave_days) | models.Q(max_days__isnull=True)
-        ).filter(
-            models.Q(company_id=company_id) | models.Q(company_id__isnull=True)
-        ).order_by('company_id', 'min_days').first()
-
-        if not policy:
-            # 預設政策：只需主管審批
-            policy_levels = [{"level": 1, "role": "manager", "description": "直屬主管"}]
-        else:
-            policy_levels = policy.approval_levels if isinstance(policy.approval_levels, list) else json.loads(policy.approval_levels)
+        # 查找適用的審批政策（全域政策優先，其次為公司政策；皆無時只需主管審批）
+        policy_name, policy_levels = approval_policies.resolve(relation.company_id_id, leave_days)
 
         # 根據政策建立審批記錄
         approvals_created = []
@@ -713,32 +1218,16 @@ def apply_leave(request):
             level = level_config['level']
             role = level_config['role']
 
-            # 根據角色找到審批人
-            approver = None
+            # 根據角色找到審批人（申請人不審批自己的申請）
             if role == 'manager':
-                # 從直屬主管欄位取得
-                approver = relation.direct_manager
-                if not approver:
-                    # 嘗試從 ManagerialRelationship 取得
-                    mgr_rel = ManagerialRelationship.objects.filter(
-                        employee_id=employee,
-                        effective_date__lte=datetime.now().date(),
-                        end_date__isnull=True
-                    ).first()
-                    if mgr_rel:
-                        approver = mgr_rel.manager_id
-                    else:
-                        # 最後備援：找第一個 MGR 開頭的員工
-                        approver = Employees.objects.filter(employee_id__startswith='MGR').first()
-            elif role == 'hr':
-                approver = Employees.objects.filter(employee_id__startswith='HR').first()
-            elif role == 'ceo':
-                approver = Employees.objects.filter(employee_id__startswith='CEO').first()
+                approver = approver_directory.manager_for(relation, exclude=employee.employee_id)
+            else:
+                approver = approver_directory.assign(relation.company_id_id, role, exclude=employee.employee_id)
 
             if approver:
                 approval = ApprovalRecords.objects.create(
                     leave_id=leave_record,
-                    approver_id=approver,
+                    approver_id_id=approver.employee_id,
                     approval_level=level,
                     status='pending'
                 )
@@ -779,7 +1268,7 @@ def apply_leave(request):
                 'leave_days': round(leave_days, 2),
                 'status': leave_record.get_status_display(),
                 'approvals': approvals_created,
-                'policy_name': policy.policy_name if policy else '預設政策'
+                'policy_name': policy_name
             },
             status_code=status.HTTP_201_CREATED
         )
@@ -849,14 +1338,16 @@ def approve_leave(request, approval_id):
 
         if next_level:
             # 建立下一層級審批記錄
-            next_approver = Employees.objects.filter(
-                employee_id__startswith='HR' if next_level == 2 else 'CEO'
-            ).first()
+            next_approver = approver_directory.assign(
+                leave.relation_id.company_id_id,
+                'hr' if next_level == 2 else 'ceo',
+                exclude=leave.relation_id.employee_id_id
+            )
 
             if next_approver:
                 ApprovalRecords.objects.create(
                     leave_id=leave,
-                    approver_id=next_approver,
+                    approver_id_id=next_approver.employee_id,
                     approval_level=next_level,
                     status='pending'
                 )
@@ -864,14 +1355,18 @@ def approve_leave(request, approval_id):
             else:
                 # 如果找不到下一層級審批人，直接批准請假
                 leave.status = 'approved'
-                leave.save()
+                with transaction.atomic():
+                    leave.save()
+                    add_leave_hours(leave)
                 # 扣除假別額度
                 _deduct_leave_balance(leave)
                 message = "審批成功，請假已批准"
         else:
             # 最後一層級審批，直接批准請假
             leave.status = 'approved'
-            leave.save()
+            with transaction.atomic():
+                leave.save()
+                add_leave_hours(leave)
 
             # 6. 扣除假別額度
             _deduct_leave_balance(leave)
@@ -1165,15 +1660,57 @@ def pending_approvals(request):
         )
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def approval_inbox(request):
+    """
+    待我審批的收件匣 API（請假、加班、補打卡合併）
+
+    URL: GET /approval/inbox/
+    查詢參數：
+    - type: 類型（leave/overtime/makeup，可用逗號分隔多個；預設全部）
+    - limit: 每頁筆數（選填，預設 50，最多 200）
+    - cursor: 上一頁回應的 next_cursor（選填）
+    """
+    try:
+        user = request.user
+
+        types = INBOX_TYPES
+        type_param = request.query_params.get('type')
+        if type_param:
+            types = tuple(t.strip() for t in type_param.split(',') if t.strip())
+            if not types or any(t not in INBOX_TYPES for t in types):
+                return validation_error_response("無效的審批類型")
+
+        limit = parse_limit(request.query_params.get('limit'), INBOX_PAGE_SIZE, INBOX_MAX_PAGE_SIZE)
+
+        after = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                after = decode_inbox_cursor(cursor)
+            except (InvalidCursor, TypeError, ValueError):
+                return validation_error_response("無效的分頁游標")
+
+        data = inbox_page(user.employee_id, types=types, after=after, limit=limit)
+
+        return success_response(message="查詢成功", data=data)
+
+    except Exception as e:
+        print(f"查詢審批收件匣錯誤: {str(e)}")
+        return server_error_response("查詢失敗，請稍後再試")
+
+
 # =====================================================
 # Phase 1 新增：補打卡 API
 # =====================================================
-from .models import MakeupClockRequest, MakeupClockApproval, MakeupClockQuota, WorkSchedule
+from .models import MakeupClockRequest, MakeupClockApproval, MakeupClockQuota
 from .serializers import MakeupClockRequestSerializer, MakeupClockApprovalSerializer, MakeupClockQuotaSerializer, WorkScheduleSerializer
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def apply_makeup_clock(request):
     """
     補打卡申請 API（Phase 1）
@@ -1262,22 +1799,12 @@ def apply_makeup_clock(request):
         )
 
         # 9. 建立審批記錄（直屬主管）
-        approver = relation.direct_manager
-        if not approver:
-            # 嘗試從 ManagerialRelationship 取得
-            from .models import ManagerialRelationship
-            mgr_rel = ManagerialRelationship.objects.filter(
-                employee_id=employee,
-                effective_date__lte=date_class.today(),
-                end_date__isnull=True
-            ).first()
-            if mgr_rel:
-                approver = mgr_rel.manager_id
+        approver = approver_directory.manager_for(relation, exclude=employee.employee_id)
 
         if approver:
             MakeupClockApproval.objects.create(
                 request_id=makeup_request,
-                approver_id=approver,
+                approver_id_id=approver.employee_id,
                 approval_level=1,
                 status='pending'
             )
@@ -1450,42 +1977,53 @@ def _apply_makeup_clock_to_attendance(makeup_request):
         relation = makeup_request.relation_id
         target_date = makeup_request.date
 
-        # 查找或建立出勤記錄
-        record = makeup_request.attendance_record
-        if not record:
-            # 建立新的出勤記錄
-            record = AttendanceRecords.objects.create(
-                relation_id=relation,
-                date=target_date,
-                checkin_time=makeup_request.requested_checkin_time or timezone.now(),
-                checkout_time=makeup_request.requested_checkout_time or timezone.now(),
-                checkin_location="補打卡",
-                checkout_location="補打卡",
-                work_hours=Decimal('0.00'),
-                is_makeup=True
-            )
+        # 出勤記錄、月統計與申請關聯在同一個交易中更新
+        with transaction.atomic():
+            # 查找或建立出勤記錄（申請後才打卡的情況，沿用當天既有記錄）
+            record = makeup_request.attendance_record
+            if not record:
+                record = AttendanceRecords.objects.filter(
+                    relation_id=relation,
+                    date=target_date
+                ).first()
+            before = rollup_snapshot(record) if record else None
+            if not record:
+                # 建立新的出勤記錄
+                record = AttendanceRecords.objects.create(
+                    relation_id=relation,
+                    date=target_date,
+                    checkin_time=makeup_request.requested_checkin_time or timezone.now(),
+                    checkout_time=makeup_request.requested_checkout_time or timezone.now(),
+                    checkin_location="補打卡",
+                    checkout_location="補打卡",
+                    work_hours=Decimal('0.00'),
+                    is_makeup=True
+                )
 
-        # 根據補打卡類型更新記錄
-        if makeup_request.makeup_type in ['checkin', 'both']:
-            if makeup_request.requested_checkin_time:
-                record.checkin_time = makeup_request.requested_checkin_time
-                record.checkin_location = "補打卡"
+            # 根據補打卡類型更新記錄
+            if makeup_request.makeup_type in ['checkin', 'both']:
+                if makeup_request.requested_checkin_time:
+                    record.checkin_time = makeup_request.requested_checkin_time
+                    record.checkin_location = "補打卡"
+                    record.checkin_latitude = record.checkin_longitude = record.checkin_distance = None
 
-        if makeup_request.makeup_type in ['checkout', 'both']:
-            if makeup_request.requested_checkout_time:
-                record.checkout_time = makeup_request.requested_checkout_time
-                record.checkout_location = "補打卡"
+            if makeup_request.makeup_type in ['checkout', 'both']:
+                if makeup_request.requested_checkout_time:
+                    record.checkout_time = makeup_request.requested_checkout_time
+                    record.checkout_location = "補打卡"
+                    record.checkout_latitude = record.checkout_longitude = record.checkout_distance = None
 
-        # 重新計算工時
-        if record.checkin_time and record.checkout_time:
-            record.work_hours = calculate_work_hours(record.checkin_time, record.checkout_time)
+            # 重新計算工時
+            if record.checkin_time and record.checkout_time:
+                record.work_hours = calculate_work_hours(record.checkin_time, record.checkout_time)
 
-        record.is_makeup = True
-        record.save()
+            record.is_makeup = True
+            record.save()
+            apply_attendance_change(before, rollup_snapshot(record))
 
-        # 更新 makeup_request 的關聯
-        makeup_request.attendance_record = record
-        makeup_request.save()
+            # 更新 makeup_request 的關聯
+            makeup_request.attendance_record = record
+            makeup_request.save()
 
         print(f"補打卡已應用到出勤記錄 #{record.id}")
 
@@ -1636,13 +2174,7 @@ def my_work_schedule(request):
             return not_found_response("找不到員工關聯")
 
         # 取得班表（優先員工專屬，否則使用公司預設）
-        schedule = relation.work_schedule
-        if not schedule:
-            schedule = WorkSchedule.objects.filter(
-                company_id=relation.company_id,
-                is_default=True,
-                is_active=True
-            ).first()
+        schedule = schedule_resolver.resolve(relation)
 
         if not schedule:
             return success_response(
@@ -1668,6 +2200,7 @@ def my_work_schedule(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def apply_overtime(request):
     """
     申請加班 API
@@ -1751,22 +2284,20 @@ def apply_overtime(request):
         )
 
         # 7. 建立審批記錄（直屬主管）
-        approver = relation.direct_manager
-        if not approver:
-            approver = Employees.objects.filter(employee_id__startswith='MGR').first()
+        approver = approver_directory.manager_for(relation, exclude=user.employee_id)
         if not approver:
             approver = request.user
 
         approval = OvertimeApproval.objects.create(
             overtime_id=overtime_record,
-            approver_id=approver,
+            approver_id_id=approver.employee_id,
             approval_level=1,
             status='pending'
         )
 
         # 8. 建立通知
         Notifications.objects.create(
-            recipient_id=approver,
+            recipient_id_id=approver.employee_id,
             notification_type='approval_pending',
             title='新加班申請待審批',
             content=f'{user.username} 申請 {ot_date} 加班 {overtime_hours} 小時',
@@ -1882,10 +2413,12 @@ def approve_overtime(request, approval_id):
         approval.approved_at = timezone.now()
         approval.save()
 
-        # 5. 更新加班記錄狀態
+        # 5. 更新加班記錄狀態與月統計
         overtime = approval.overtime_id
         overtime.status = 'approved'
-        overtime.save()
+        with transaction.atomic():
+            overtime.save()
+            add_overtime_hours(overtime)
 
         # 6. 更新補休額度（如果選擇補休）
         if overtime.compensatory_hours > 0:
@@ -2061,15 +2594,24 @@ def cancel_overtime(request, overtime_id):
                 status_code=status.HTTP_400_BAD_REQUEST
             )
 
-        # 4. 更新狀態
-        overtime.status = 'cancelled'
-        overtime.save()
+        # 4. 更新狀態（加班記錄、審批記錄與待審件數在同一個交易中更新）
+        with transaction.atomic():
+            overtime.status = 'cancelled'
+            overtime.save()
 
-        # 更新審批記錄
-        OvertimeApproval.objects.filter(
-            overtime_id=overtime,
-            status='pending'
-        ).update(status='rejected', comment='申請人已取消')
+            # 更新審批記錄
+            pending = OvertimeApproval.objects.select_for_update().filter(
+                overtime_id=overtime,
+                status='pending'
+            )
+            approvers = list(pending.values_list('approver_id', flat=True))
+            pending.update(status='rejected', comment='申請人已取消')
+
+            # QuerySet.update 不會觸發 post_save
+            deltas = {}
+            for approver_id in approvers:
+                deltas[(approver_id, 'overtime')] = deltas.get((approver_id, 'overtime'), 0) - 1
+            pending_counters.adjust(deltas)
 
         return success_response(
             message="已取消加班申請",
@@ -2233,6 +2775,78 @@ def calculate_annual_leave(request):
 # Phase 2 新增：出勤報表 API
 # =====================================================
 
+# 出勤摘要一次最多查詢的月份數
+ATTENDANCE_SUMMARY_MAX_MONTHS = 12
+
+
+def _format_attendance_summary(summary):
+    """彙總結果轉為 attendance_summary 的回應格式"""
+    return {
+        'attendance': {
+            'total_days': summary['total_days'],
+            'late_count': summary['late_count'],
+            'late_minutes_total': summary['late_minutes_total'],
+            'early_leave_count': summary['early_leave_count'],
+            'early_leave_minutes_total': summary['early_leave_minutes_total'],
+            'makeup_count': summary['makeup_count'],
+            'total_work_hours': round(float(summary['total_work_hours']), 2)
+        },
+        'leave': {
+            'total_hours': float(summary['leave_hours'])
+        },
+        'overtime': {
+            'total_hours': float(summary['overtime_hours'])
+        }
+    }
+
+
+def _attendance_summary_data(user, periods):
+    """
+    計算個人出勤摘要（attendance_summary 的回應資料，單一查詢）
+
+    periods 只有一個月份時回傳該月摘要；多個月份時回傳逐月摘要與合計
+    """
+    summaries = summarize_months(EmpCompanyRel.objects.filter(employee_id=user), periods)
+
+    if len(periods) == 1:
+        (year, month), = periods
+        start_date, end_date = month_range(year, month)
+        return {
+            'period': {
+                'year': year,
+                'month': month,
+                'start_date': str(start_date),
+                'end_date': str(end_date - timedelta(days=1))
+            },
+            **_format_attendance_summary(summaries[(year, month)])
+        }
+
+    total = empty_summary()
+    months = []
+    for year, month in periods:
+        summary = summaries[(year, month)]
+        for name, value in summary.items():
+            total[name] += value
+        months.append({'year': year, 'month': month, **_format_attendance_summary(summary)})
+
+    return {
+        'period': {
+            'start_month': f"{periods[0][0]}-{periods[0][1]:02d}",
+            'end_month': f"{periods[-1][0]}-{periods[-1][1]:02d}",
+            'start_date': str(month_range(*periods[0])[0]),
+            'end_date': str(month_range(*periods[-1])[1] - timedelta(days=1))
+        },
+        'months': months,
+        'total': _format_attendance_summary(total)
+    }
+
+
+def _parse_month(value):
+    """解析 YYYY-MM，回傳 (年, 月)"""
+    parsed = datetime.strptime(value, '%Y-%m')
+    return parsed.year, parsed.month
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def attendance_summary(request):
@@ -2243,92 +2857,125 @@ def attendance_summary(request):
     查詢參數：
     - year: 年度（選填，預設今年）
     - month: 月份（選填，預設當月）
+    - start_month, end_month: 月份區間 YYYY-MM（選填，最多 12 個月；
+      指定時忽略 year / month，回傳逐月摘要 months 與合計 total）
     """
     try:
         user = request.user
-        year = int(request.query_params.get('year', timezone.now().year))
-        month = int(request.query_params.get('month', timezone.now().month))
+        start_month = request.query_params.get('start_month')
+        end_month = request.query_params.get('end_month')
 
-        # 取得員工關聯
-        relations = EmpCompanyRel.objects.filter(
-            employee_id=user
-        ).values_list('id', flat=True)
+        if start_month or end_month:
+            try:
+                periods = months_between(_parse_month(start_month), _parse_month(end_month or start_month))
+            except (TypeError, ValueError):
+                return validation_error_response("月份格式錯誤，請使用 YYYY-MM")
+            if not periods:
+                return validation_error_response("結束月份不可早於開始月份")
+            if len(periods) > ATTENDANCE_SUMMARY_MAX_MONTHS:
+                return validation_error_response(f"一次最多查詢 {ATTENDANCE_SUMMARY_MAX_MONTHS} 個月")
+        else:
+            year = int(request.query_params.get('year', timezone.now().year))
+            month = int(request.query_params.get('month', timezone.now().month))
+            periods = [(year, month)]
+
+        period_end = month_range(*periods[-1])[1] - timedelta(days=1)
+        data = report_cache.get_or_compute(
+            'attendance_summary', user.employee_id, tuple(periods),
+            tags=[employee_tag(user.employee_id, month_period(date(year, month, 1))) for year, month in periods] + ['org'],
+            compute=lambda: _attendance_summary_data(user, periods),
+            period_end=period_end
+        )
 
-        # 計算日期範圍
-        from calendar import monthrange
-        _, last_day = monthrange(year, month)
-        start_date = date(year, month, 1)
-        end_date = date(year, month, last_day)
+        return success_response(message="查詢成功", data=data)
 
-        # 查詢出勤記錄
-        records = AttendanceRecords.objects.filter(
-            relation_id__in=relations,
-            date__gte=start_date,
-            date__lte=end_date
-        )
+    except Exception as e:
+        print(f"查詢出勤摘要錯誤: {str(e)}")
+        return server_error_response("查詢失敗，請稍後再試")
 
-        # 統計
-        total_records = records.count()
-        late_records = records.filter(is_late=True)
-        early_leave_records = records.filter(is_early_leave=True)
-        makeup_records = records.filter(is_makeup=True)
 
-        late_count = late_records.count()
-        late_minutes_total = sum(r.late_minutes for r in late_records)
-        early_leave_count = early_leave_records.count()
-        early_leave_minutes_total = sum(r.early_leave_minutes for r in early_leave_records)
+# 出勤異常清單每頁筆數（預設 / 上限）
+ANOMALY_PAGE_SIZE = 50
+ANOMALY_MAX_PAGE_SIZE = 200
 
-        # 計算總工時
-        total_work_hours = sum(
-            float(r.work_hours or 0) for r in records
-        )
 
-        # 查詢請假時數
-        leave_hours = LeaveRecords.objects.filter(
-            relation_id__in=relations,
-            start_time__year=year,
-            start_time__month=month,
-            status='approved'
-        ).aggregate(total=models.Sum('leave_hours'))['total'] or 0
+def _period_range(year, month=None):
+    """年度或月份的半開區間 [start, end)，可直接使用 (relation_id, date) 索引"""
+    if month:
+        return month_range(year, month)
+    return date(year, 1, 1), date(year + 1, 1, 1)
 
-        # 查詢加班時數
-        overtime_hours = OvertimeRecords.objects.filter(
-            relation_id__in=relations,
-            date__year=year,
-            date__month=month,
-            status='approved'
-        ).aggregate(total=models.Sum('overtime_hours'))['total'] or 0
 
-        return success_response(
-            message="查詢成功",
-            data={
-                'period': {
-                    'year': year,
-                    'month': month,
-                    'start_date': str(start_date),
-                    'end_date': str(end_date)
-                },
-                'attendance': {
-                    'total_days': total_records,
-                    'late_count': late_count,
-                    'late_minutes_total': late_minutes_total,
-                    'early_leave_count': early_leave_count,
-                    'early_leave_minutes_total': early_leave_minutes_total,
-                    'makeup_count': makeup_records.count(),
-                    'total_work_hours': round(total_work_hours, 2)
-                },
-                'leave': {
-                    'total_hours': float(leave_hours)
-                },
-                'overtime': {
-                    'total_hours': float(overtime_hours)
-                }
-            }
+def _anomaly_list_data(user, year, month, anomaly_type, after=None, limit=ANOMALY_PAGE_SIZE):
+    """
+    查詢個人出勤異常（anomaly_list 的回應資料）
+
+    依 (date, id) 由新到舊排序；after 為上一頁最後一筆的 (date, id)
+    """
+    # 取得員工關聯
+    relations = EmpCompanyRel.objects.filter(
+        employee_id=user
+    ).values_list('id', flat=True)
+
+    # 查詢異常記錄
+    queryset = AttendanceRecords.objects.filter(
+        relation_id__in=relations
+    )
+
+    if anomaly_type == 'late':
+        queryset = queryset.filter(is_late=True)
+    elif anomaly_type == 'early_leave':
+        queryset = queryset.filter(is_early_leave=True)
+    else:
+        queryset = queryset.filter(
+            models.Q(is_late=True) | models.Q(is_early_leave=True)
         )
 
-    except Exception as e:
-        print(f"查詢出勤摘要錯誤: {str(e)}")
-        return server_error_response("查詢失敗，請稍後再試")
+    if year:
+        start_date, end_date = _period_range(year, month)
+        queryset = queryset.filter(date__gte=start_date, date__lt=end_date)
+    elif month:
+        queryset = queryset.filter(date__month=month)
+
+    if after:
+        queryset = queryset.filter(keyset_filter(('date', 'id'), after))
+
+    # 多取一筆判斷是否還有下一頁
+    records = list(queryset.only(
+        'id', 'date', 'checkin_time', 'checkout_time',
+        'is_late', 'late_minutes', 'is_early_leave', 'early_leave_minutes'
+    ).order_by('-date', '-id')[:limit + 1])
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    # 整理結果
+    anomalies = []
+    for record in records:
+        anomaly_info = {
+            'id': record.id,
+            'date': str(record.date),
+            'checkin_time': str(record.checkin_time) if record.checkin_time else None,
+            'checkout_time': str(record.checkout_time) if record.checkout_time else None,
+            'anomalies': []
+        }
+        if record.is_late:
+            anomaly_info['anomalies'].append({
+                'type': 'late',
+                'description': f'遲到 {record.late_minutes} 分鐘'
+            })
+        if record.is_early_leave:
+            anomaly_info['anomalies'].append({
+                'type': 'early_leave',
+                'description': f'早退 {record.early_leave_minutes} 分鐘'
+            })
+        anomalies.append(anomaly_info)
+
+    return {
+        'count': len(anomalies),
+        'anomalies': anomalies,
+        'has_more': has_more,
+        'next_cursor': encode_cursor([records[-1].date, records[-1].id]) if has_more else None
+    }
 
 
 @api_view(['GET'])
@@ -2340,72 +2987,46 @@ def anomaly_list(request):
     URL: GET /reports/anomaly-list/
     查詢參數：
     - year: 年度（選填）
-    - month: 月份（選填）
+    - month: 月份（選填；未指定年度時查詢各年度的該月份）
     - type: 異常類型（late/early_leave/all，預設 all）
+    - limit: 每頁筆數（選填，預設 50，最多 200）
+    - cursor: 上一頁回應的 next_cursor（選填）
     """
     try:
         user = request.user
         year = request.query_params.get('year')
         month = request.query_params.get('month')
         anomaly_type = request.query_params.get('type', 'all')
+        year = int(year) if year else None
+        month = int(month) if month else None
+        limit = parse_limit(request.query_params.get('limit'), ANOMALY_PAGE_SIZE, ANOMALY_MAX_PAGE_SIZE)
 
-        # 取得員工關聯
-        relations = EmpCompanyRel.objects.filter(
-            employee_id=user
-        ).values_list('id', flat=True)
-
-        # 查詢異常記錄
-        queryset = AttendanceRecords.objects.filter(
-            relation_id__in=relations
-        )
-
-        if anomaly_type == 'late':
-            queryset = queryset.filter(is_late=True)
-        elif anomaly_type == 'early_leave':
-            queryset = queryset.filter(is_early_leave=True)
+        after = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                cursor_date, cursor_id = decode_cursor(cursor, 2)
+                after = (date.fromisoformat(cursor_date), int(cursor_id))
+            except (InvalidCursor, TypeError, ValueError):
+                return validation_error_response("無效的分頁游標")
+
+        # 指定年月時只依賴該月；否則依賴該員工所有月份
+        if year and month:
+            period_end = _period_range(year, month)[1] - timedelta(days=1)
+            tag = employee_tag(user.employee_id, month_period(period_end))
         else:
-            queryset = queryset.filter(
-                models.Q(is_late=True) | models.Q(is_early_leave=True)
-            )
-
-        if year:
-            queryset = queryset.filter(date__year=int(year))
-        if month:
-            queryset = queryset.filter(date__month=int(month))
-
-        # 排序
-        queryset = queryset.order_by('-date')[:50]
-
-        # 整理結果
-        anomalies = []
-        for record in queryset:
-            anomaly_info = {
-                'id': record.id,
-                'date': str(record.date),
-                'checkin_time': str(record.checkin_time) if record.checkin_time else None,
-                'checkout_time': str(record.checkout_time) if record.checkout_time else None,
-                'anomalies': []
-            }
-            if record.is_late:
-                anomaly_info['anomalies'].append({
-                    'type': 'late',
-                    'description': f'遲到 {record.late_minutes} 分鐘'
-                })
-            if record.is_early_leave:
-                anomaly_info['anomalies'].append({
-                    'type': 'early_leave',
-                    'description': f'早退 {record.early_leave_minutes} 分鐘'
-                })
-            anomalies.append(anomaly_info)
-
-        return success_response(
-            message="查詢成功",
-            data={
-                'count': len(anomalies),
-                'anomalies': anomalies
-            }
+            period_end = date(year, 12, 31) if year else date.today()
+            tag = employee_tag(user.employee_id)
+
+        data = report_cache.get_or_compute(
+            'anomaly_list', user.employee_id, (year, month, anomaly_type, after, limit),
+            tags=[tag, 'org'],
+            compute=lambda: _anomaly_list_data(user, year, month, anomaly_type, after, limit),
+            period_end=period_end
         )
 
+        return success_response(message="查詢成功", data=data)
+
     except Exception as e:
         print(f"查詢異常清單錯誤: {str(e)}")
         return server_error_response("查詢失敗，請稍後再試")
@@ -2578,6 +3199,119 @@ def _check_manager_permission(user):
     return user.role in ['manager', 'hr_admin', 'ceo', 'system_admin']
 
 
+def _dashboard_attendance(user, query_date):
+    """
+    主管儀表板的出勤數字與未打卡名單
+
+    讀取部門每日計數（DepartmentDailyAttendance），查詢數與部門人數無關。
+    """
+    # 部門計數（每個部門一列，打卡時更新）：部門主管看自己的部門，HR / CEO 看所有部門
+    org_wide = user.role in ['hr_admin', 'ceo', 'system_admin']
+    if org_wide:
+        department_ids = list(Departments.objects.values_list('id', flat=True))
+    else:
+        department_ids = [user.department_id] if user.department_id else []
+    counters = department_days(department_ids, query_date)
+
+    total_employees = sum(row.expected_headcount for row in counters)
+    checked_in = sum(row.checked_in_count for row in counters)
+    late_count = sum(row.late_count for row in counters)
+    early_leave_count = sum(row.early_leave_count for row in counters)
+
+    # 部門主管不計入自己（自己的出勤已計入所屬部門的計數；計數以員工為單位，
+    # 在多家公司任職時當天任一筆記錄即計為已打卡）
+    if not org_wide and user.department_id:
+        total_employees -= 1
+        own_records = list(AttendanceRecords.objects.filter(
+            relation_id__employee_id=user,
+            date=query_date
+        ).values_list('is_late', 'is_early_leave'))
+        if own_records:
+            checked_in -= 1
+            late_count -= 1 if any(is_late for is_late, _ in own_records) else 0
+            early_leave_count -= 1 if any(is_early_leave for _, is_early_leave in own_records) else 0
+
+    # 不在部門計數內的下屬（沒有部門的員工、其他部門的直屬下屬）即時統計
+    if org_wide:
+        others = Employees.objects.filter(department__isnull=True, is_active=True)
+    else:
+        others = Employees.objects.filter(
+            employee__direct_manager=user,
+            employee__employment_status=True
+        ).exclude(department_id__in=department_ids).exclude(employee_id=user.employee_id).distinct()
+    others = list(others)
+
+    checked_in_others = set()
+    if others:
+        other_records = AttendanceRecords.objects.filter(
+            relation_id__employee_id__in=others,
+            relation_id__employment_status=True,
+            date=query_date
+        ).values_list('relation_id__employee_id', 'is_late', 'is_early_leave')
+        # 與部門計數相同以員工為單位
+        late_others = set()
+        early_leave_others = set()
+        for employee_id, is_late, is_early_leave in other_records:
+            checked_in_others.add(employee_id)
+            if is_late:
+                late_others.add(employee_id)
+            if is_early_leave:
+                early_leave_others.add(employee_id)
+        checked_in += len(checked_in_others)
+        late_count += len(late_others)
+        early_leave_count += len(early_leave_others)
+    total_employees += len(others)
+
+    # 取得未打卡員工（最多 10 人）
+    not_checked_in = [
+        {'employee_id': e.employee_id, 'username': e.username}
+        for e in others
+        if e.employee_id not in checked_in_others
+    ][:10]
+    if len(not_checked_in) < 10 and department_ids:
+        department_absent = Employees.objects.filter(
+            department_id__in=department_ids,
+            is_active=True
+        ).exclude(employee__attendance_records__date=query_date)
+        if not org_wide:
+            department_absent = department_absent.exclude(employee_id=user.employee_id)
+        not_checked_in += [
+            {'employee_id': employee_id, 'username': username}
+            for employee_id, username in department_absent.order_by('employee_id').values_list(
+                'employee_id', 'username'
+            )[:10 - len(not_checked_in)]
+        ]
+
+    return {
+        'summary': {
+            'total_employees': total_employees,
+            'checked_in': checked_in,
+            'not_checked_in': total_employees - checked_in,
+            'late_count': late_count,
+            'early_leave_count': early_leave_count,
+        },
+        'not_checked_in_list': not_checked_in,  # 最多顯示 10 人
+    }
+
+
+def _report_scope_tags(user, period):
+    """
+    主管報表的快取依賴標籤
+
+    HR / CEO 依賴全公司；部門主管依賴自己的部門與直屬下屬所屬的部門。
+    """
+    if user.role in ['hr_admin', 'ceo', 'system_admin']:
+        return [f"all:{period}", 'org']
+    department_ids = {user.department_id} if user.department_id else set()
+    department_ids.update(
+        EmpCompanyRel.objects.filter(
+            direct_manager=user,
+            employment_status=True
+        ).values_list('employee_id__department_id', flat=True)
+    )
+    return [department_tag(department_id, period) for department_id in department_ids] + ['org']
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def manager_dashboard(request):
@@ -2602,76 +3336,24 @@ def manager_dashboard(request):
         else:
             query_date = date.today()
 
-        # 取得下屬員工
-        subordinates = _get_subordinates(user)
-        subordinate_ids = [e.employee_id for e in subordinates]
-
-        # 取得下屬的關聯 ID
-        relations = EmpCompanyRel.objects.filter(
-            employee_id__in=subordinate_ids,
-            employment_status=True
+        # 出勤數字（快取；打卡時依部門與日期失效）
+        attendance = report_cache.get_or_compute(
+            'manager_dashboard', user.employee_id, (query_date,),
+            tags=_report_scope_tags(user, day_period(query_date)),
+            compute=lambda: _dashboard_attendance(user, query_date),
+            period_end=query_date
         )
-        relation_ids = relations.values_list('id', flat=True)
 
-        # 統計出勤資訊
-        attendance_records = AttendanceRecords.objects.filter(
-            relation_id__in=relation_ids,
-            date=query_date
-        )
-
-        # 統計數據
-        total_employees = len(subordinates)
-        checked_in = attendance_records.count()
-        late_count = attendance_records.filter(is_late=True).count()
-        early_leave_count = attendance_records.filter(is_early_leave=True).count()
-
-        # 取得待審批數量
-        pending_leave = ApprovalRecords.objects.filter(
-            approver_id=user,
-            status='pending'
-        ).count()
-
-        pending_overtime = OvertimeApproval.objects.filter(
-            approver_id=user,
-            status='pending'
-        ).count()
-
-        pending_makeup = MakeupClockApproval.objects.filter(
-            approver_id=user,
-            status='pending'
-        ).count()
-
-        # 取得未打卡員工
-        checked_in_employees = set(
-            AttendanceRecords.objects.filter(
-                relation_id__in=relation_ids,
-                date=query_date
-            ).values_list('relation_id__employee_id', flat=True)
-        )
-        not_checked_in = [
-            {'employee_id': e.employee_id, 'username': e.username}
-            for e in subordinates
-            if e.employee_id not in checked_in_employees
-        ]
+        # 取得待審批數量（讀取審批人的待審計數列）
+        pending = pending_counters.pending_counts([user.employee_id])[user.employee_id]
 
         return success_response(
             message="查詢成功",
             data={
                 'date': str(query_date),
-                'summary': {
-                    'total_employees': total_employees,
-                    'checked_in': checked_in,
-                    'not_checked_in': total_employees - checked_in,
-                    'late_count': late_count,
-                    'early_leave_count': early_leave_count,
-                },
-                'pending_approvals': {
-                    'leave': pending_leave,
-                    'overtime': pending_overtime,
-                    'makeup': pending_makeup,
-                    'total': pending_leave + pending_overtime + pending_makeup,
-                },
-                'not_checked_in_list': not_checked_in[:10],  # 最多顯示 10 人
+                'summary': attendance['summary'],
+                'pending_approvals': {**pending, 'total': sum(pending.values())},
+                'not_checked_in_list': attendance['not_checked_in_list'],
             }
         )
 
@@ -2712,6 +3394,59 @@ def _get_subordinates(manager):
     return list(subordinates)
 
 
+def _department_report_data(user, year, month):
+    """部門員工月出勤統計（department_report 的回應資料）"""
+    # 計算日期範圍
+    from calendar import monthrange
+    _, last_day = monthrange(year, month)
+    start_date = date(year, month, 1)
+    end_date = date(year, month, last_day)
+
+    # 取得下屬
+    subordinates = _get_subordinates(user)
+    subordinate_ids = [e.employee_id for e in subordinates]
+
+    # 取得關聯
+    relations = list(EmpCompanyRel.objects.filter(
+        employee_id__in=subordinate_ids,
+        employment_status=True
+    ).select_related('employee_id__department'))
+
+    # 統計每個員工的出勤（讀取月統計，每位員工一列）
+    summaries = monthly_summaries([rel.id for rel in relations], year, month)
+
+    report_data = []
+    for rel in relations:
+        emp = rel.employee_id
+        summary = summaries[rel.id]
+
+        report_data.append({
+            'employee_id': emp.employee_id,
+            'username': emp.username,
+            'department': emp.department.name if emp.department else None,
+            'attendance': {
+                'total_days': summary['total_days'],
+                'late_count': summary['late_count'],
+                'late_minutes_total': summary['late_minutes_total'],
+                'early_leave_count': summary['early_leave_count'],
+                'total_work_hours': round(float(summary['total_work_hours']), 2),
+            },
+            'leave_hours': float(summary['leave_hours']),
+            'overtime_hours': float(summary['overtime_hours']),
+        })
+
+    return {
+        'period': {
+            'year': year,
+            'month': month,
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+        },
+        'employee_count': len(report_data),
+        'employees': report_data,
+    }
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def department_report(request):
@@ -2733,82 +3468,16 @@ def department_report(request):
         year = int(request.query_params.get('year', timezone.now().year))
         month = int(request.query_params.get('month', timezone.now().month))
 
-        # 計算日期範圍
         from calendar import monthrange
-        _, last_day = monthrange(year, month)
-        start_date = date(year, month, 1)
-        end_date = date(year, month, last_day)
-
-        # 取得下屬
-        subordinates = _get_subordinates(user)
-        subordinate_ids = [e.employee_id for e in subordinates]
-
-        # 取得關聯
-        relations = EmpCompanyRel.objects.filter(
-            employee_id__in=subordinate_ids,
-            employment_status=True
+        period_end = date(year, month, monthrange(year, month)[1])
+        data = report_cache.get_or_compute(
+            'department_report', user.employee_id, (year, month),
+            tags=_report_scope_tags(user, month_period(period_end)),
+            compute=lambda: _department_report_data(user, year, month),
+            period_end=period_end
         )
 
-        # 統計每個員工的出勤
-        report_data = []
-        for rel in relations:
-            emp = rel.employee_id
-            records = AttendanceRecords.objects.filter(
-                relation_id=rel,
-                date__gte=start_date,
-                date__lte=end_date
-            )
-
-            total_days = records.count()
-            late_count = records.filter(is_late=True).count()
-            early_leave_count = records.filter(is_early_leave=True).count()
-            total_work_hours = sum(float(r.work_hours or 0) for r in records)
-            late_minutes_total = sum(r.late_minutes for r in records.filter(is_late=True))
-
-            # 請假統計
-            leave_hours = LeaveRecords.objects.filter(
-                relation_id=rel,
-                start_time__year=year,
-                start_time__month=month,
-                status='approved'
-            ).aggregate(total=models.Sum('leave_hours'))['total'] or 0
-
-            # 加班統計
-            overtime_hours = OvertimeRecords.objects.filter(
-                relation_id=rel,
-                date__year=year,
-                date__month=month,
-                status='approved'
-            ).aggregate(total=models.Sum('overtime_hours'))['total'] or 0
-
-            report_data.append({
-                'employee_id': emp.employee_id,
-                'username': emp.username,
-                'department': emp.department.name if emp.department else None,
-                'attendance': {
-                    'total_days': total_days,
-                    'late_count': late_count,
-                    'late_minutes_total': late_minutes_total,
-                    'early_leave_count': early_leave_count,
-                    'total_work_hours': round(total_work_hours, 2),
-                },
-                'leave_hours': float(leave_hours),
-                'overtime_hours': float(overtime_hours),
-            })
-
-        return success_response(
-            message="查詢成功",
-            data={
-                'period': {
-                    'year': year,
-                    'month': month,
-                    'start_date': str(start_date),
-                    'end_date': str(end_date),
-                },
-                'employee_count': len(report_data),
-                'employees': report_data,
-            }
-        )
+        return success_response(message="查詢成功", data=data)
 
     except Exception as e:
         print(f"部門報表錯誤: {str(e)}")
@@ -2817,6 +3486,112 @@ def department_report(request):
         return server_error_response("查詢失敗，請稍後再試")
 
 
+def _batch_approval_pk(approval_id):
+    """審批記錄 ID（格式錯誤時回傳 None）"""
+    try:
+        return int(approval_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _apply_leave_balance_deltas(deltas, field, now, create_missing=False):
+    """
+    依 (員工, 年度, 假別) 合併的差額批次更新假別額度（內部函數）
+
+    Args:
+        deltas: {(employee_id, year, leave_type): 時數}
+        field: 累加的欄位（used_hours / total_hours）
+        create_missing: 額度不存在時是否建立
+    """
+    if not deltas:
+        return
+    if create_missing:
+        LeaveBalances.objects.bulk_create(
+            [
+                LeaveBalances(employee_id_id=employee_id, year=year, leave_type=leave_type)
+                for employee_id, year, leave_type in deltas
+            ],
+            ignore_conflicts=True
+        )
+
+    employee_ids, years, leave_types = (set(values) for values in zip(*deltas))
+    balances = [
+        balance for balance in LeaveBalances.objects.select_for_update().filter(
+            employee_id_id__in=employee_ids, year__in=years, leave_type__in=leave_types
+        )
+        if (balance.employee_id_id, balance.year, balance.leave_type) in deltas
+    ]
+    for balance in balances:
+        key = (balance.employee_id_id, balance.year, balance.leave_type)
+        setattr(balance, field, getattr(balance, field) + deltas[key])
+        # bulk_update 不會呼叫 save()，剩餘時數需自行計算
+        balance.remaining_hours = balance.total_hours - balance.used_hours
+        balance.updated_at = now
+    LeaveBalances.objects.bulk_update(balances, [field, 'remaining_hours', 'updated_at'])
+
+
+def _batch_deduct_leave_balances(leaves, now):
+    """批次扣除假別額度（額度不存在時略過，與 _deduct_leave_balance 相同）"""
+    deltas = {}
+    for leave in leaves:
+        key = (leave.relation_id.employee_id_id, leave.start_time.year, leave.leave_type)
+        deltas[key] = deltas.get(key, Decimal('0')) + leave.leave_hours
+    _apply_leave_balance_deltas(deltas, 'used_hours', now)
+
+
+def _batch_add_compensatory_balances(overtimes, now):
+    """批次累加補休額度（依加班日期年度）"""
+    deltas = {}
+    for overtime in overtimes:
+        if overtime.compensatory_hours > 0:
+            key = (overtime.relation_id.employee_id_id, overtime.date.year, 'compensatory')
+            deltas[key] = deltas.get(key, Decimal('0')) + overtime.compensatory_hours
+    _apply_leave_balance_deltas(deltas, 'total_hours', now, create_missing=True)
+
+
+def _batch_use_makeup_quotas(makeup_requests, now):
+    """批次扣除當年度補打卡額度（額度不存在時略過）"""
+    counts = {}
+    for makeup_request in makeup_requests:
+        employee_id = makeup_request.relation_id.employee_id_id
+        counts[employee_id] = counts.get(employee_id, 0) + 1
+
+    quotas = list(MakeupClockQuota.objects.select_for_update().filter(
+        employee_id_id__in=counts, year=datetime.now().year
+    ))
+    for quota in quotas:
+        quota.used_count += counts[quota.employee_id_id]
+        quota.remaining_count = quota.total_count - quota.used_count
+        quota.updated_at = now
+    MakeupClockQuota.objects.bulk_update(quotas, ['used_count', 'remaining_count', 'updated_at'])
+
+
+def _batch_result_notification(approval_type, item, new_status, comment):
+    """批次審批結果通知（未儲存）"""
+    if approval_type == 'leave':
+        subject, day, related_model = '請假申請', item.start_time.date(), 'LeaveRecords'
+    elif approval_type == 'overtime':
+        subject, day, related_model = '加班申請', item.date, 'OvertimeRecords'
+    else:
+        subject, day, related_model = '補打卡申請', item.date, 'MakeupClockRequest'
+
+    if new_status == 'approved':
+        title = f'{subject}已批准'
+        content = f'您 {day} 的{subject}已獲批准'
+    else:
+        title = f'{subject}已拒絕'
+        content = f'您 {day} 的{subject}已被拒絕。原因：{comment}'
+
+    return Notifications(
+        recipient_id_id=item.relation_id.employee_id_id,
+        notification_type='approval_result',
+        title=title,
+        content=content,
+        related_model=related_model,
+        related_id=item.id
+    )
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def batch_approve(request):
@@ -2851,35 +3626,53 @@ def batch_approve(request):
         if action == 'reject' and not comment:
             return validation_error_response("拒絕時必須填寫原因")
 
-        # 根據類型取得對應的審批模型
+        # 根據類型取得對應的審批模型、申請模型與關聯欄位
         model_map = {
-            'leave': ApprovalRecords,
-            'overtime': OvertimeApproval,
-            'makeup': MakeupClockApproval,
+            'leave': (ApprovalRecords, LeaveRecords, 'leave_id'),
+            'overtime': (OvertimeApproval, OvertimeRecords, 'overtime_id'),
+            'makeup': (MakeupClockApproval, MakeupClockRequest, 'request_id'),
         }
 
         if approval_type not in model_map:
             return validation_error_response("無效的審批類型")
 
-        ApprovalModel = model_map[approval_type]
+        ApprovalModel, RequestModel, request_field = model_map[approval_type]
+        new_status = 'approved' if action == 'approve' else 'rejected'
+        now = timezone.now()
 
         # 批次處理
         processed = []
         failed = []
 
-        for approval_id in approval_ids:
-            try:
-                approval = ApprovalModel.objects.get(id=approval_id)
+        # 整批在同一個交易中處理，任一步驟失敗即全部回滾
+        with transaction.atomic():
+            approvals = (
+                ApprovalModel.objects
+                .select_for_update()
+                .select_related(f'{request_field}__relation_id')
+                .in_bulk([pk for pk in map(_batch_approval_pk, approval_ids) if pk is not None])
+            )
+
+            accepted = []
+            for approval_id in approval_ids:
+                approval = approvals.get(_batch_approval_pk(approval_id))
+
+                if approval is None:
+                    failed.append({
+                        'id': approval_id,
+                        'reason': '記錄不存在'
+                    })
+                    continue
 
                 # 檢查權限
-                if approval.approver_id != user:
+                if approval.approver_id_id != user.employee_id:
                     failed.append({
                         'id': approval_id,
                         'reason': '無權限審批'
                     })
                     continue
 
-                # 檢查狀態
+                # 檢查狀態（同一批重複的 ID 視為已處理）
                 if approval.status != 'pending':
                     failed.append({
                         'id': approval_id,
@@ -2887,73 +3680,51 @@ def batch_approve(request):
                     })
                     continue
 
-                # 更新審批記錄
-                approval.status = 'approved' if action == 'approve' else 'rejected'
+                approval.status = new_status
                 approval.comment = comment
-                approval.approved_at = timezone.now()
-                approval.save()
+                approval.approved_at = now
+                accepted.append(approval)
+                processed.append(approval_id)
+
+            if accepted:
+                # 多筆審批可能屬於同一筆申請
+                requests = list({
+                    getattr(approval, f'{request_field}_id'): getattr(approval, request_field)
+                    for approval in accepted
+                }.values())
+                for item in requests:
+                    item.status = new_status
+                    item.updated_at = now
+
+                # bulk_update 不會觸發 save()，updated_at 需手動設定
+                ApprovalModel.objects.bulk_update(accepted, ['status', 'comment', 'approved_at'])
+                # bulk_update 不會觸發 post_save，待審件數需自行更新
+                pending_counters.sync(accepted)
+                RequestModel.objects.bulk_update(requests, ['status', 'updated_at'])
 
-                # 更新關聯記錄
                 if approval_type == 'leave':
-                    leave = approval.leave_id
                     if action == 'approve':
-                        leave.status = 'approved'
-                        _deduct_leave_balance(leave)
-                    else:
-                        leave.status = 'rejected'
-                    leave.save()
+                        _batch_deduct_leave_balances(requests, now)
+                        add_approved_records(leaves=requests)
+                    # bulk_update 不會觸發 post_save
+                    report_cache.invalidate_records(
+                        [(leave.relation_id_id, leave.start_time.date()) for leave in requests], daily=False
+                    )
                 elif approval_type == 'overtime':
-                    overtime = approval.overtime_id
-                    if action == 'approve':
-                        overtime.status = 'approved'
-                        # 更新補休額度
-                        if overtime.compensatory_hours > 0:
-                            employee = overtime.relation_id.employee_id
-                            year = overtime.date.year
-                            balance, _ = LeaveBalances.objects.get_or_create(
-                                employee_id=employee,
-                                year=year,
-                                leave_type='compensatory',
-                                defaults={
-                                    'total_hours': Decimal('0'),
-                                    'used_hours': Decimal('0'),
-                                    'remaining_hours': Decimal('0')
-                                }
-                            )
-                            balance.total_hours += overtime.compensatory_hours
-                            balance.remaining_hours = balance.total_hours - balance.used_hours
-                            balance.save()
-                    else:
-                        overtime.status = 'rejected'
-                    overtime.save()
-                elif approval_type == 'makeup':
-                    makeup_request = approval.request_id
                     if action == 'approve':
-                        makeup_request.status = 'approved'
+                        _batch_add_compensatory_balances(requests, now)
+                        add_approved_records(overtimes=requests)
+                    report_cache.invalidate_records(
+                        [(overtime.relation_id_id, overtime.date) for overtime in requests], daily=False
+                    )
+                elif approval_type == 'makeup' and action == 'approve':
+                    for makeup_request in requests:
                         _apply_makeup_clock_to_attendance(makeup_request)
-                        # 扣除額度
-                        employee = makeup_request.relation_id.employee_id
-                        current_year = datetime.now().year
-                        try:
-                            quota = MakeupClockQuota.objects.get(
-                                employee_id=employee,
-                                year=current_year
-                            )
-                            quota.used_count += 1
-                            quota.save()
-                        except MakeupClockQuota.DoesNotExist:
-                            pass
-                    else:
-                        makeup_request.status = 'rejected'
-                    makeup_request.save()
+                    _batch_use_makeup_quotas(requests, now)
 
-                processed.append(approval_id)
-
-            except ApprovalModel.DoesNotExist:
-                failed.append({
-                    'id': approval_id,
-                    'reason': '記錄不存在'
-                })
+                Notifications.objects.bulk_create(
+                    [_batch_result_notification(approval_type, item, new_status, comment) for item in requests]
+                )
 
         return success_response(
             message=f"批次審批完成：成功 {len(processed)} 筆，失敗 {len(failed)} 筆",
@@ -3338,6 +4109,127 @@ def hr_batch_set_leave_balances(request):
         return server_error_response("設定失敗，請稍後再試")
 
 
+# 打卡位置稽核：單次查詢的最大天數
+LOCATION_AUDIT_MAX_DAYS = 366
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def hr_location_audit(request):
+    """
+    打卡位置稽核（距公司超過指定距離的打卡）
+
+    URL: GET /api/hr/location-audit/
+    查詢參數：
+    - start_date: 開始日期（YYYY-MM-DD）
+    - end_date: 結束日期（YYYY-MM-DD）
+    - min_distance: 距離門檻（公尺），列出超過此距離的打卡
+    - punch_type: checkin / checkout / all（預設 all）
+    - company_id: 公司 ID（選填）
+    - page: 頁碼
+    - page_size: 每頁筆數（預設 50）
+
+    僅涵蓋有結構化座標的記錄（尚未回填的舊資料請先執行
+    `python manage.py backfill_attendance_locations`）。
+    """
+    try:
+        user = request.user
+
+        # 權限檢查
+        if not _check_hr_permission(user):
+            return forbidden_response("您沒有權限存取此功能")
+
+        try:
+            start_date = datetime.strptime(request.query_params['start_date'], '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.query_params['end_date'], '%Y-%m-%d').date()
+            min_distance = float(request.query_params['min_distance'])
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', 50)), 1), 500)
+        except (KeyError, ValueError):
+            return validation_error_response("請提供有效的 start_date、end_date、min_distance")
+
+        if end_date < start_date:
+            return validation_error_response("結束日期不可早於開始日期")
+        if (end_date - start_date).days >= LOCATION_AUDIT_MAX_DAYS:
+            return validation_error_response(f"查詢區間不可超過 {LOCATION_AUDIT_MAX_DAYS} 天")
+
+        punch_type = request.query_params.get('punch_type', 'all')
+        if punch_type == 'checkin':
+            condition = Q(checkin_distance__gt=min_distance)
+        elif punch_type == 'checkout':
+            condition = Q(checkout_distance__gt=min_distance)
+        elif punch_type == 'all':
+            condition = Q(checkin_distance__gt=min_distance) | Q(checkout_distance__gt=min_distance)
+        else:
+            return validation_error_response("punch_type 須為 checkin、checkout 或 all")
+
+        # (date, checkin_distance) / (date, checkout_distance) 索引
+        queryset = AttendanceRecords.objects.filter(
+            condition,
+            date__gte=start_date,
+            date__lte=end_date
+        )
+
+        company_id = request.query_params.get('company_id')
+        if company_id:
+            queryset = queryset.filter(relation_id__company_id=company_id)
+
+        total = queryset.count()
+
+        start = (page - 1) * page_size
+        rows = queryset.order_by('date', 'id').values(
+            'id', 'date', 'checkin_time', 'checkout_time',
+            'checkin_latitude', 'checkin_longitude', 'checkin_distance',
+            'checkout_latitude', 'checkout_longitude', 'checkout_distance',
+            'relation_id__employee_id__employee_id',
+            'relation_id__employee_id__username',
+            'relation_id__company_id',
+            'relation_id__company_id__name',
+            'relation_id__company_id__radius',
+        )[start:start + page_size]
+
+        records = []
+        for row in rows:
+            records.append({
+                'id': row['id'],
+                'date': str(row['date']),
+                'employee_id': row['relation_id__employee_id__employee_id'],
+                'employee_name': row['relation_id__employee_id__username'],
+                'company_id': row['relation_id__company_id'],
+                'company_name': row['relation_id__company_id__name'],
+                'radius': row['relation_id__company_id__radius'],
+                'checkin': {
+                    'time': row['checkin_time'].isoformat(),
+                    'latitude': row['checkin_latitude'],
+                    'longitude': row['checkin_longitude'],
+                    'distance': row['checkin_distance'],
+                },
+                'checkout': {
+                    'time': row['checkout_time'].isoformat(),
+                    'latitude': row['checkout_latitude'],
+                    'longitude': row['checkout_longitude'],
+                    'distance': row['checkout_distance'],
+                },
+            })
+
+        return success_response(
+            message="查詢成功",
+            data={
+                'total': total,
+                'page': page,
+                'page_size': page_size,
+                'total_pages': (total + page_size - 1) // page_size,
+                'records': records,
+            }
+        )
+
+    except Exception as e:
+        print(f"打卡位置稽核錯誤: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return server_error_response("查詢失敗，請稍後再試")
+
+
 # =====================================================
 # Phase 3 新增：部門管理 API
 # =====================================================
@@ -3519,9 +4411,53 @@ def department_delete(request, department_id):
 # Phase 3 新增：資料匯出 API
 # =====================================================
 
-import csv
-import io
-from django.http import HttpResponse
+from .export_jobs import (
+    EXPORT_KINDS, attendance_export_queryset, download_name, export_jobs, leave_export_queryset,
+    overtime_export_queryset
+)
+from .exports import (
+    ATTENDANCE_COLUMNS, ATTENDANCE_PARQUET_FIELDS, LEAVE_COLUMNS, LEAVE_PARQUET_FIELDS, OVERTIME_COLUMNS,
+    OVERTIME_PARQUET_FIELDS, csv_response, parquet_response, sheet, xlsx_response
+)
+
+
+def _export_relation_ids(user, employee_ids=None):
+    """可匯出的員工關聯 ID（HR 可指定員工，主管只能匯出下屬）"""
+    if _check_hr_permission(user) and employee_ids:
+        employee_filter = employee_ids
+    else:
+        employee_filter = [e.employee_id for e in _get_subordinates(user)]
+    return list(EmpCompanyRel.objects.filter(
+        employee_id__in=employee_filter,
+        employment_status=True
+    ).order_by('id').values_list('id', flat=True))
+
+
+def _export_params(user, data, kind):
+    """
+    驗證匯出請求並產生匯出參數
+
+    Returns:
+        tuple: (params, None) 或 (None, 錯誤回應)
+    """
+    date_from = data.get('date_from')
+    date_to = data.get('date_to')
+
+    if not date_from or not date_to:
+        return None, validation_error_response("請提供日期範圍")
+
+    try:
+        datetime.strptime(date_from, '%Y-%m-%d')
+        datetime.strptime(date_to, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None, validation_error_response("日期格式錯誤，請使用 YYYY-MM-DD")
+
+    employee_ids = data.get('employee_ids', []) if kind != 'leave' else None
+    return {
+        'relation_ids': _export_relation_ids(user, employee_ids),
+        'date_from': date_from,
+        'date_to': date_to,
+    }, None
 
 
 @api_view(['POST'])
@@ -3534,8 +4470,11 @@ def export_attendance(request):
     請求參數：
     - date_from: 開始日期
     - date_to: 結束日期
-    - format: 格式（csv/xlsx）
+    - format: 格式（csv/xlsx/parquet）
     - employee_ids: 員工編號陣列（選填，HR 專用）
+
+    parquet 為具型別的欄位（布林、定點小數、日期時間），供薪資與 BI 系統載入
+    大量資料請改用背景匯出（POST /api/export/jobs/）
     """
     try:
         user = request.user
@@ -3544,47 +4483,20 @@ def export_attendance(request):
         if not _check_manager_permission(user):
             return forbidden_response("您沒有權限執行此操作")
 
-        date_from = request.data.get('date_from')
-        date_to = request.data.get('date_to')
         export_format = request.data.get('format', 'csv')
-        employee_ids = request.data.get('employee_ids', [])
-
-        if not date_from or not date_to:
-            return validation_error_response("請提供日期範圍")
-
-        # 解析日期
-        start_date = datetime.strptime(date_from, '%Y-%m-%d').date()
-        end_date = datetime.strptime(date_to, '%Y-%m-%d').date()
-
-        # 取得員工（根據權限）
-        if _check_hr_permission(user) and employee_ids:
-            # HR 可指定員工
-            relations = EmpCompanyRel.objects.filter(
-                employee_id__in=employee_ids,
-                employment_status=True
-            )
-        else:
-            # 主管只能匯出下屬
-            subordinates = _get_subordinates(user)
-            subordinate_ids = [e.employee_id for e in subordinates]
-            relations = EmpCompanyRel.objects.filter(
-                employee_id__in=subordinate_ids,
-                employment_status=True
-            )
-
-        relation_ids = relations.values_list('id', flat=True)
+        params, error = _export_params(user, request.data, 'attendance')
+        if error:
+            return error
 
         # 查詢記錄
-        records = AttendanceRecords.objects.filter(
-            relation_id__in=relation_ids,
-            date__gte=start_date,
-            date__lte=end_date
-        ).select_related('relation_id__employee_id').order_by('date', 'relation_id')
+        records = attendance_export_queryset(params)
 
         if export_format == 'csv':
             return _export_attendance_csv(records)
         elif export_format == 'xlsx':
             return _export_attendance_xlsx(records)
+        elif export_format == 'parquet':
+            return _parquet_export(records, ATTENDANCE_PARQUET_FIELDS, 'attendance_export.parquet')
         else:
             return validation_error_response("不支援的匯出格式")
 
@@ -3596,95 +4508,35 @@ def export_attendance(request):
 
 
 def _export_attendance_csv(records):
-    """匯出出勤記錄為 CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # 標題列
-    writer.writerow([
-        '日期', '員工編號', '員工姓名', '上班時間', '下班時間',
-        '工時', '是否遲到', '遲到分鐘', '是否早退', '早退分鐘', '是否補打卡'
-    ])
+    """匯出出勤記錄為 CSV（串流輸出）"""
+    return csv_response(records, ATTENDANCE_COLUMNS, 'attendance_export.csv')
 
-    # 資料列
-    for record in records:
-        writer.writerow([
-            str(record.date),
-            record.relation_id.employee_id.employee_id,
-            record.relation_id.employee_id.username,
-            str(record.checkin_time) if record.checkin_time else '',
-            str(record.checkout_time) if record.checkout_time else '',
-            str(record.work_hours),
-            '是' if record.is_late else '否',
-            record.late_minutes,
-            '是' if record.is_early_leave else '否',
-            record.early_leave_minutes,
-            '是' if record.is_makeup else '否',
-        ])
-
-    output.seek(0)
-
-    response = HttpResponse(
-        output.read().encode('utf-8-sig'),
-        content_type='text/csv; charset=utf-8-sig'
-    )
-    response['Content-Disposition'] = 'attachment; filename="attendance_export.csv"'
 
-    return response
+def _xlsx_export(sheets, filename):
+    """匯出 Excel（逐列寫入暫存檔，記憶體用量固定）"""
+    try:
+        return xlsx_response(sheets, filename, column_width=15)
+    except ImportError:
+        return error_response(
+            "伺服器未安裝 openpyxl，請使用 CSV 格式",
+            code="OPENPYXL_NOT_INSTALLED",
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
 
 
 def _export_attendance_xlsx(records):
     """匯出出勤記錄為 Excel"""
-    try:
-        import openpyxl
-        from openpyxl.utils import get_column_letter
+    return _xlsx_export([sheet("出勤記錄", records, ATTENDANCE_COLUMNS)], 'attendance_export.xlsx')
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "出勤記錄"
-
-        # 標題列
-        headers = [
-            '日期', '員工編號', '員工姓名', '上班時間', '下班時間',
-            '工時', '是否遲到', '遲到分鐘', '是否早退', '早退分鐘', '是否補打卡'
-        ]
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
-
-        # 資料列
-        for row, record in enumerate(records, 2):
-            ws.cell(row=row, column=1, value=str(record.date))
-            ws.cell(row=row, column=2, value=record.relation_id.employee_id.employee_id)
-            ws.cell(row=row, column=3, value=record.relation_id.employee_id.username)
-            ws.cell(row=row, column=4, value=str(record.checkin_time) if record.checkin_time else '')
-            ws.cell(row=row, column=5, value=str(record.checkout_time) if record.checkout_time else '')
-            ws.cell(row=row, column=6, value=float(record.work_hours))
-            ws.cell(row=row, column=7, value='是' if record.is_late else '否')
-            ws.cell(row=row, column=8, value=record.late_minutes)
-            ws.cell(row=row, column=9, value='是' if record.is_early_leave else '否')
-            ws.cell(row=row, column=10, value=record.early_leave_minutes)
-            ws.cell(row=row, column=11, value='是' if record.is_makeup else '否')
-
-        # 調整列寬
-        for col in range(1, len(headers) + 1):
-            ws.column_dimensions[get_column_letter(col)].width = 15
-
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
-
-        response = HttpResponse(
-            output.read(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="attendance_export.xlsx"'
-
-        return response
 
+def _parquet_export(records, fields, filename):
+    """匯出 Parquet（以 row group 為單位寫入暫存檔）"""
+    try:
+        return parquet_response(records, fields, filename)
     except ImportError:
         return error_response(
-            "伺服器未安裝 openpyxl，請使用 CSV 格式",
-            code="OPENPYXL_NOT_INSTALLED",
+            "伺服器未安裝 pyarrow，請使用 CSV 格式",
+            code="PYARROW_NOT_INSTALLED",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
@@ -3699,7 +4551,9 @@ def export_leave(request):
     請求參數：
     - date_from: 開始日期
     - date_to: 結束日期
-    - format: 格式（csv/xlsx）
+    - format: 格式（csv/xlsx/parquet）
+
+    大量資料請改用背景匯出（POST /api/export/jobs/）
     """
     try:
         user = request.user
@@ -3708,37 +4562,22 @@ def export_leave(request):
         if not _check_manager_permission(user):
             return forbidden_response("您沒有權限執行此操作")
 
-        date_from = request.data.get('date_from')
-        date_to = request.data.get('date_to')
         export_format = request.data.get('format', 'csv')
-
-        if not date_from or not date_to:
-            return validation_error_response("請提供日期範圍")
-
-        # 解析日期
-        start_date = datetime.strptime(date_from, '%Y-%m-%d')
-        end_date = datetime.strptime(date_to, '%Y-%m-%d')
-
-        # 取得員工
-        subordinates = _get_subordinates(user)
-        subordinate_ids = [e.employee_id for e in subordinates]
-        relations = EmpCompanyRel.objects.filter(
-            employee_id__in=subordinate_ids,
-            employment_status=True
-        )
-        relation_ids = relations.values_list('id', flat=True)
+        params, error = _export_params(user, request.data, 'leave')
+        if error:
+            return error
 
         # 查詢記錄
-        records = LeaveRecords.objects.filter(
-            relation_id__in=relation_ids,
-            start_time__gte=start_date,
-            start_time__lte=end_date
-        ).select_related('relation_id__employee_id').order_by('start_time')
+        records = leave_export_queryset(params)
 
         if export_format == 'csv':
             return _export_leave_csv(records)
+        elif export_format == 'xlsx':
+            return _export_leave_xlsx(records)
+        elif export_format == 'parquet':
+            return _parquet_export(records, LEAVE_PARQUET_FIELDS, 'leave_export.parquet')
         else:
-            return validation_error_response("目前僅支援 CSV 格式")
+            return validation_error_response("不支援的匯出格式")
 
     except Exception as e:
         print(f"匯出請假錯誤: {str(e)}")
@@ -3746,35 +4585,172 @@ def export_leave(request):
 
 
 def _export_leave_csv(records):
-    """匯出請假記錄為 CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
+    """匯出請假記錄為 CSV（串流輸出）"""
+    return csv_response(records, LEAVE_COLUMNS, 'leave_export.csv')
 
-    # 標題列
-    writer.writerow([
-        '員工編號', '員工姓名', '假別', '開始時間', '結束時間',
-        '請假時數', '狀態', '請假原因'
-    ])
 
-    # 資料列
-    for record in records:
-        writer.writerow([
-            record.relation_id.employee_id.employee_id,
-            record.relation_id.employee_id.username,
-            record.get_leave_type_display(),
-            str(record.start_time),
-            str(record.end_time),
-            str(record.leave_hours),
-            record.get_status_display(),
-            record.leave_reason or '',
-        ])
-
-    output.seek(0)
-
-    response = HttpResponse(
-        output.read().encode('utf-8-sig'),
-        content_type='text/csv; charset=utf-8-sig'
-    )
-    response['Content-Disposition'] = 'attachment; filename="leave_export.csv"'
+def _export_leave_xlsx(records):
+    """匯出請假記錄為 Excel"""
+    return _xlsx_export([sheet("請假記錄", records, LEAVE_COLUMNS)], 'leave_export.xlsx')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def export_overtime(request):
+    """
+    匯出加班記錄
+
+    URL: POST /api/export/overtime/
+    請求參數：
+    - date_from: 開始日期
+    - date_to: 結束日期
+    - format: 格式（csv/xlsx/parquet）
+    - employee_ids: 員工編號陣列（選填，HR 專用）
+
+    大量資料請改用背景匯出（POST /api/export/jobs/）
+    """
+    try:
+        user = request.user
+
+        # 權限檢查
+        if not _check_manager_permission(user):
+            return forbidden_response("您沒有權限執行此操作")
+
+        export_format = request.data.get('format', 'csv')
+        params, error = _export_params(user, request.data, 'overtime')
+        if error:
+            return error
 
-    return response
+        # 查詢記錄
+        records = overtime_export_queryset(params)
+
+        if export_format == 'csv':
+            return csv_response(records, OVERTIME_COLUMNS, 'overtime_export.csv')
+        elif export_format == 'xlsx':
+            return _xlsx_export([sheet("加班記錄", records, OVERTIME_COLUMNS)], 'overtime_export.xlsx')
+        elif export_format == 'parquet':
+            return _parquet_export(records, OVERTIME_PARQUET_FIELDS, 'overtime_export.parquet')
+        else:
+            return validation_error_response("不支援的匯出格式")
+
+    except Exception as e:
+        print(f"匯出加班錯誤: {str(e)}")
+        return server_error_response("匯出失敗，請稍後再試")
+
+
+def _serialize_export_job(job):
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'format': job.export_format,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'processed_rows': job.processed_rows,
+        'progress': job.progress,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+    }
+    if job.status == 'completed':
+        data['file_size'] = job.file_size
+        data['download_url'] = reverse('attendance:download_export_job', args=[job.id])
+    elif job.status == 'failed':
+        data['error'] = job.error_message
+    return data
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_export_job(request):
+    """
+    建立背景匯出工作
+
+    URL: POST /api/export/jobs/
+    請求參數：
+    - kind: 匯出內容（attendance/leave/overtime）
+    - date_from, date_to, format, employee_ids：同 export_attendance / export_leave / export_overtime
+
+    相同的匯出請求在處理完成前共用同一個工作（回應的 deduplicated 為 True）
+    """
+    try:
+        user = request.user
+
+        # 權限檢查
+        if not _check_manager_permission(user):
+            return forbidden_response("您沒有權限執行此操作")
+
+        kind = request.data.get('kind')
+        export_format = request.data.get('format', 'csv')
+        if kind not in ('attendance', 'leave', 'overtime'):
+            return validation_error_response("不支援的匯出內容")
+        if export_format not in EXPORT_KINDS[kind].formats:
+            return validation_error_response("不支援的匯出格式")
+
+        params, error = _export_params(user, request.data, kind)
+        if error:
+            return error
+
+        job, created = export_jobs.submit(user, kind, export_format, params)
+
+        data = _serialize_export_job(job)
+        data['deduplicated'] = not created
+        return success_response(
+            message="匯出工作已建立" if created else "已有相同的匯出工作處理中",
+            data=data,
+            status_code=status.HTTP_202_ACCEPTED
+        )
+
+    except Exception as e:
+        print(f"建立匯出工作錯誤: {str(e)}")
+        return server_error_response("建立匯出工作失敗，請稍後再試")
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_job_status(request, job_id):
+    """
+    查詢匯出工作進度
+
+    URL: GET /api/export/jobs/<job_id>/
+    狀態：pending / running / completed / failed / expired
+    """
+    try:
+        job = ExportJob.objects.filter(id=job_id, requested_by=request.user).first()
+        if not job:
+            return not_found_response("匯出工作不存在", code="EXPORT_JOB_NOT_FOUND")
+
+        return success_response(message="查詢成功", data=_serialize_export_job(job))
+
+    except Exception as e:
+        print(f"查詢匯出工作錯誤: {str(e)}")
+        return server_error_response("查詢失敗，請稍後再試")
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_export_job(request, job_id):
+    """
+    下載已完成的匯出檔案
+
+    URL: GET /api/export/jobs/<job_id>/download/
+    """
+    try:
+        job = ExportJob.objects.filter(id=job_id, requested_by=request.user).first()
+        if not job:
+            return not_found_response("匯出工作不存在", code="EXPORT_JOB_NOT_FOUND")
+
+        if job.status == 'expired' or (job.expires_at and job.expires_at <= timezone.now()):
+            return error_response("匯出檔案已過期，請重新匯出", code="EXPORT_JOB_EXPIRED", status_code=status.HTTP_410_GONE)
+        if job.status != 'completed':
+            return error_response("匯出尚未完成", code="EXPORT_JOB_NOT_READY", status_code=status.HTTP_409_CONFLICT)
+
+        try:
+            file = export_jobs.open(job)
+        except FileNotFoundError:
+            return error_response("匯出檔案已過期，請重新匯出", code="EXPORT_JOB_EXPIRED", status_code=status.HTTP_410_GONE)
+
+        return FileResponse(file, as_attachment=True, filename=download_name(job))
+
+    except Exception as e:
+        print(f"下載匯出檔案錯誤: {str(e)}")
+        return server_error_response("下載失敗，請稍後再試")